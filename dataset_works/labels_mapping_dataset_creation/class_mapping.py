@@ -1,10 +1,10 @@
 # Master class mapping for COCO, Objects365, OpenImagesV6, VOC2012
 import json
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
-def normalize(name: str) -> str:
-    return name.lower().strip().replace(' ', '_').replace('/', '_')
+from class_tables import MAPPING_PTH, compile_tables, normalize
 
 # 1) Hardcode COCO class names (80)
 coco_names = [
@@ -21,6 +21,13 @@ coco_names = [
     'teddy_bear','hair_drier','toothbrush'
 ]
 
+# COCO category_id of each of the 80 names above (ids 1..90 with gaps)
+coco_category_ids = [
+    1,2,3,4,5,6,7,8,9,10,11,13,14,15,16,17,18,19,20,21,22,23,24,25,27,28,31,32,33,
+    34,35,36,37,38,39,40,41,42,43,44,46,47,48,49,50,51,52,53,54,55,56,57,58,59,60,
+    61,62,63,64,65,67,70,72,73,74,75,76,77,78,79,80,81,82,84,85,86,87,88,89,90
+]
+
 # 2) Hardcode VOC2012 class names (20)
 voc_names = [
     'aeroplane','bicycle','bird','boat','bottle','bus','car','cat','chair','cow',
@@ -86,13 +93,24 @@ oi_df = pd.read_csv(oi_csv, header=None, names=["LabelName","DisplayName"])
 oi_names = [normalize(n) for n in oi_df["DisplayName"].tolist()]
 
 # 5) Build master list in order: COCO → Objects365 → OpenImages → VOC → (CrowdHuman if needed)
-master = []
-for names in (coco_names, objects365_names, oi_names, voc_names):
-    for n in names:
-        if n not in master:
-            master.append(n)
+#    (dict keeps first-seen order with O(1) membership)
+master = list(dict.fromkeys(n for names in (coco_names, objects365_names, oi_names, voc_names)
+                            for n in names))
 
 # Print summary
 print(f"Master label space size: {len(master)} classes")
 # Optionally save
 Path("./master.names").write_text("\n".join(master))
+
+# 6) Compiled per-dataset lookup tables for the converters (see class_tables.py)
+tables = compile_tables(master, {
+    "coco":        dict(zip(coco_category_ids, coco_names)),   # category_id → name
+    "objects365":  objects365_names,                           # class id → name
+    "openimages":  dict(zip(oi_df["LabelName"], oi_names)),    # MID → name
+    "voc":         {n: n for n in voc_names},                  # name → name
+    "crowdhuman":  {"person": "person", "head": "human_head"},  # person boxes, head boxes
+})
+np.savez(MAPPING_PTH, **tables)
+print(f"Mapping tables version {tables['version']} → {MAPPING_PTH}")
+for ds in ("coco", "objects365", "openimages", "voc", "crowdhuman"):
+    print(f"  {ds}: {int((tables[f'{ds}__lut'] >= 0).sum())} source classes mapped")
@@ -0,0 +1,108 @@
+# Compiled class-mapping tables written by class_mapping.py
+#
+# class_mapping.npz holds the master class list, a version hash and, per
+# source dataset, a dense lookup table to master indices:
+#   <dataset>__lut   int32, master index per source class (-1 = unmapped)
+#   <dataset>__keys  only for string-keyed sources (Open Images MIDs, VOC
+#                    names, ...): sorted keys aligned with <dataset>__lut
+#   <dataset>__names only for integer-keyed sources (COCO category_id,
+#                    Objects365 class id): source class name per id
+# Integer-keyed sources index the LUT directly. Every converter loads the file once, so they all agree on
+# the mapping and apply it with one NumPy indexing operation.
+import hashlib
+from pathlib import Path
+
+import numpy as np
+
+MAPPING_PTH = Path("./class_mapping.npz")
+
+
+def normalize(name: str) -> str:
+    return name.lower().strip().replace(' ', '_').replace('/', '_')
+
+
+def compile_tables(master, sources):
+    """Build the arrays stored in class_mapping.npz.
+
+    `sources` maps dataset name → either a list of normalized class names
+    indexed by source class id, or a dict {source id / key: normalized name}.
+    """
+    name2idx = {n: i for i, n in enumerate(master)}
+    arrays = {"master_names": np.array(master, dtype=str)}
+    for ds, names in sources.items():
+        if isinstance(names, dict) and all(isinstance(k, str) for k in names):
+            keys = np.array(sorted(names), dtype=str)
+            arrays[f"{ds}__keys"] = keys
+            arrays[f"{ds}__lut"] = np.array([name2idx.get(names[k], -1) for k in keys.tolist()],
+                                            dtype=np.int32)
+        else:
+            if not isinstance(names, dict):
+                names = dict(enumerate(names))
+            lut = np.full(max(names) + 1, -1, dtype=np.int32)
+            src_names = [""] * len(lut)
+            for k, n in names.items():
+                lut[k] = name2idx.get(n, -1)
+                src_names[k] = n
+            arrays[f"{ds}__lut"] = lut
+            arrays[f"{ds}__names"] = np.array(src_names, dtype=str)
+
+    h = hashlib.sha1()
+    for k in sorted(arrays):
+        h.update(k.encode())
+        h.update("\n".join(arrays[k].astype(str).tolist()).encode())
+    arrays["version"] = np.array(h.hexdigest()[:16])
+    return arrays
+
+
+class ClassMapping:
+    """Loaded class_mapping.npz."""
+
+    def __init__(self, path=MAPPING_PTH):
+        with np.load(path) as z:
+            self._arrays = {k: z[k] for k in z.files}
+        self.master_names = self._arrays["master_names"].tolist()
+        self.version = str(self._arrays["version"])
+
+    @property
+    def datasets(self):
+        return sorted(k[:-5] for k in self._arrays if k.endswith("__lut"))
+
+    def lut(self, dataset):
+        """Dense source id → master index table (int32, -1 = unmapped)."""
+        return self._arrays[f"{dataset}__lut"]
+
+    def keys(self, dataset):
+        return self._arrays[f"{dataset}__keys"]
+
+    def source_names(self, dataset):
+        """Source class name per id of an integer-keyed source ("" = unused id)."""
+        return self._arrays[f"{dataset}__names"]
+
+    def lookup(self, dataset, keys):
+        """Vectorized key → master index for string-keyed sources (-1 = unknown)."""
+        table, lut = self.keys(dataset), self.lut(dataset)
+        keys = np.asarray(keys, dtype=str)
+        if len(table) == 0 or keys.size == 0:
+            return np.full(keys.shape, -1, dtype=np.int32)
+        pos = np.minimum(np.searchsorted(table, keys), len(table) - 1)
+        return np.where(table[pos] == keys, lut[pos], -1).astype(np.int32)
+
+    def master_lookup(self, names):
+        """Vectorized normalized name → master index (-1 = not in master.names)."""
+        if not hasattr(self, "_master_sorted"):
+            master = np.array(self.master_names, dtype=str)
+            order = np.argsort(master, kind="stable")
+            self._master_sorted = (master[order], order.astype(np.int32))
+        table, idx = self._master_sorted
+        names = np.asarray(names, dtype=str)
+        if len(table) == 0 or names.size == 0:
+            return np.full(names.shape, -1, dtype=np.int32)
+        pos = np.minimum(np.searchsorted(table, names), len(table) - 1)
+        return np.where(table[pos] == names, idx[pos], -1).astype(np.int32)
+
+    def apply(self, dataset, ids):
+        """Vectorized integer source id → master index (-1 = unmapped/out of range)."""
+        lut = self.lut(dataset)
+        ids = np.asarray(ids, dtype=np.int64)
+        ok = (ids >= 0) & (ids < len(lut))
+        return np.where(ok, lut[np.where(ok, ids, 0)], -1).astype(np.int32)
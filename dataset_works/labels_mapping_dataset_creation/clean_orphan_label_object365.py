@@ -1,42 +1,28 @@
+# Drop unpaired images and labels from the converted Objects365 dataset.
+# Thin wrapper around dataset_integrity.py, which lists each directory once,
+# also validates the label rows and writes BASE/integrity_report.json.
 from pathlib import Path
-from tqdm import tqdm
+
+from dataset_integrity import check_dataset, print_report
 
 # Base path of your converted Objects365 dataset
 BASE = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/converted_datasets/Objects365")
 
 splits = ["train", "val"]
 
-total_images_kept = 0
-total_labels_kept = 0
-
-for split in splits:
-    img_dir = BASE / "images" / split
-    lbl_dir = BASE / "labels" / split
-
-    # Gather non-hidden stems
-    image_stems = {p.stem for p in img_dir.iterdir() if p.is_file() and not p.name.startswith('.')}
-    label_stems = {p.stem for p in lbl_dir.iterdir() if p.is_file() and p.suffix == ".txt" and not p.name.startswith('.')}
-
-    # Find paired stems
-    paired = image_stems & label_stems
+FIX_LABELS = False  # also clip out-of-range boxes and drop invalid/duplicate rows
 
-    # Remove unpaired images
-    for stem in tqdm(image_stems - paired, desc=f"{split} remove images", unit="img"):
-        for file in img_dir.glob(f"{stem}.*"):
-            file.unlink(missing_ok=True)
-
-    # Remove unpaired labels
-    for stem in tqdm(label_stems - paired, desc=f"{split} remove labels", unit="file"):
-        (lbl_dir / f"{stem}.txt").unlink(missing_ok=True)
+if __name__ == "__main__":
+    report, path = check_dataset(BASE, splits, fix=FIX_LABELS,
+                                 delete_orphan_labels=True, delete_unlabeled_images=True)
+    print_report(report)
 
     # Counts after pruning
-    images_count = len(paired)
-    labels_count = len(paired)  # same as images_count
-
-    print(f"{split}: {images_count} images, {labels_count} labels kept")
-
-    total_images_kept += images_count
-    total_labels_kept += labels_count
-
-# Overall summary
-print(f"Overall: {total_images_kept} images, {total_labels_kept} labels kept")
\ No newline at end of file
+    total_kept = 0
+    for split, r in report["splits"].items():
+        kept = r["labels"] - r["labels_without_image"]
+        print(f"{split}: {kept} images, {kept} labels kept")
+        total_kept += kept
+
+    # Overall summary
+    print(f"Overall: {total_kept} images, {total_kept} labels kept (report: {path})")
@@ -0,0 +1,176 @@
+# Streaming COCO annotation parsing with bounded memory
+#
+# json.load on instances_train2017.json (~450 MB) costs several GB of Python
+# objects. This module walks the top-level object incrementally with
+# json.JSONDecoder.raw_decode, yields the elements of the big arrays one at
+# a time and keeps only compact per-annotation arrays. Works for any
+# COCO-format file (COCO itself, Objects365's own COCO JSON, ...).
+import json
+from array import array
+from collections import namedtuple
+
+import numpy as np
+
+CHUNK_CHARS = 1 << 20
+
+# Per-image arrays are indexed by image index (file order); annotations are
+# sorted by image index, annotations of image i are [offsets[i], offsets[i+1])
+CocoArrays = namedtuple("CocoArrays", [
+    "image_ids",     # int64 (n_images,)
+    "file_names",    # list[str] (n_images,)
+    "widths",        # float64 (n_images,)
+    "heights",       # float64 (n_images,)
+    "ann_image",     # int32 (n_anns,) image index
+    "ann_category",  # int64 (n_anns,) raw category_id
+    "ann_bbox",      # float64 (n_anns, 4) COCO x_min, y_min, w, h
+    "offsets",       # int64 (n_images + 1,)
+    "categories",    # list[dict] sorted by id
+])
+
+
+class _Reader:
+    """Character buffer over a text file that refills on demand."""
+
+    def __init__(self, f, chunk_chars):
+        self.f = f
+        self.chunk_chars = chunk_chars
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        if self.pos > self.chunk_chars:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        data = self.f.read(self.chunk_chars)
+        if not data:
+            self.eof = True
+        self.buf += data
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, ch):
+        if self.peek() != ch:
+            raise ValueError(f"expected {ch!r} at offset {self.pos}, got {self.peek()!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self._fill()
+                continue
+            # a number cut at the buffer end would decode "successfully"
+            if end == len(self.buf) and not self.eof:
+                self._fill()
+                continue
+            self.pos = end
+            return obj
+
+
+def iter_top_level(path, array_keys, chunk_chars=CHUNK_CHARS):
+    """Yield (key, item) pairs from the top-level JSON object in `path`.
+
+    For keys in `array_keys` (arrays), every element is yielded separately
+    as (key, element); any other key is yielded once as (key, value).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        r = _Reader(f, chunk_chars)
+        r.expect("{")
+        if r.peek() == "}":
+            return
+        while True:
+            key = r.value()
+            r.expect(":")
+            if key in array_keys and r.peek() == "[":
+                r.expect("[")
+                if r.peek() == "]":
+                    r.pos += 1
+                else:
+                    while True:
+                        yield key, r.value()
+                        if r.peek() == ",":
+                            r.pos += 1
+                            continue
+                        r.expect("]")
+                        break
+            else:
+                yield key, r.value()
+            if r.peek() == ",":
+                r.pos += 1
+                continue
+            r.expect("}")
+            return
+
+
+def load_coco_compact(path, chunk_chars=CHUNK_CHARS) -> CocoArrays:
+    """Stream a COCO annotation file into CocoArrays.
+
+    Only image id / file name / size and annotation image id / category id /
+    bbox are kept, in typed arrays. Annotations of unknown images are dropped.
+    """
+    img_ids, img_w, img_h, file_names = array("q"), array("d"), array("d"), []
+    ann_img, ann_cat, ann_bbox = array("q"), array("q"), array("d")
+    categories = []
+
+    for key, item in iter_top_level(path, ("images", "annotations"), chunk_chars):
+        if key == "annotations":
+            ann_img.append(item["image_id"])
+            ann_cat.append(item["category_id"])
+            ann_bbox.extend(item["bbox"])
+        elif key == "images":
+            img_ids.append(item["id"])
+            file_names.append(item["file_name"])
+            img_w.append(item["width"])
+            img_h.append(item["height"])
+        elif key == "categories":
+            categories = sorted(item, key=lambda c: c["id"])
+
+    image_ids = np.frombuffer(img_ids, dtype=np.int64)
+    ann_img   = np.frombuffer(ann_img, dtype=np.int64)
+    ann_cat   = np.frombuffer(ann_cat, dtype=np.int64)
+    ann_bbox  = np.frombuffer(ann_bbox, dtype=np.float64).reshape(-1, 4)
+
+    # image_id → image index via a sorted lookup instead of a dict
+    order = np.argsort(image_ids, kind="stable")
+    pos = np.searchsorted(image_ids[order], ann_img)
+    pos = np.minimum(pos, max(len(order) - 1, 0))
+    known = (image_ids[order][pos] == ann_img) if len(order) else np.zeros(len(ann_img), bool)
+    ann_idx = order[pos[known]].astype(np.int32)
+
+    # group annotations by image index (stable keeps file order within an image)
+    by_img = np.argsort(ann_idx, kind="stable")
+    ann_idx = ann_idx[by_img]
+    offsets = np.zeros(len(image_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ann_idx, minlength=len(image_ids)), out=offsets[1:])
+
+    return CocoArrays(
+        image_ids    = image_ids,
+        file_names   = file_names,
+        widths       = np.frombuffer(img_w, dtype=np.float64),
+        heights      = np.frombuffer(img_h, dtype=np.float64),
+        ann_image    = ann_idx,
+        ann_category = ann_cat[known][by_img],
+        ann_bbox     = ann_bbox[known][by_img],
+        offsets      = offsets,
+        categories   = categories,
+    )
+
+
+def category_lut(categories):
+    """Dense category_id → contiguous index table (sorted-id order, -1 = unused)."""
+    ids = np.array([c["id"] for c in categories], dtype=np.int64)
+    lut = np.full(int(ids.max()) + 1 if len(ids) else 1, -1, dtype=np.int32)
+    lut[ids] = np.arange(len(ids), dtype=np.int32)
+    return lut
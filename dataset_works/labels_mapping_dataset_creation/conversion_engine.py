@@ -0,0 +1,367 @@
+# Process-pool conversion engine shared by the convert_*.py scripts
+#
+# Each converter only has to turn its annotation format into a list of
+# Sample(src, stem, ann) plus a small adapter `adapter(ann) -> [yolo lines]`
+# (or a batch adapter over a whole chunk of payloads, see convert_samples).
+# The engine shards the samples over a process pool in chunks, materializes
+# the image (see materialize.py), writes the label file and collects
+# per-sample errors. Optionally large images are downsized on the way in
+# (see ingest.py).
+#
+# Pool workers start from a fresh interpreter (forkserver, spawn where there
+# is none) rather than as a fork of the caller, which may be multithreaded
+# (pipeline.py runs several converters as threads of one process, and
+# forking while another thread holds a lock can deadlock the child). Module
+# constants changed at runtime reach the workers via set_worker_settings().
+import importlib
+import multiprocessing as mp
+import os
+import threading
+import traceback
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from ingest import IngestStats, ingest_image
+from materialize import LinkStats, materialize
+from stage_manifest import file_signature, is_current, payload_signature, remove_stale
+
+DEFAULT_WORKERS   = os.cpu_count() or 1
+DEFAULT_CHUNKSIZE = 256
+
+_MP_CONTEXT = mp.get_context("forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn")
+_worker_settings = {}  # module name → {constant: value}, replayed in every pool worker
+
+# src: source image path, stem: output file stem, ann: adapter payload,
+# split: optional output subdirectory (img_dst/<split>, lbl_dst/<split>)
+Sample = namedtuple("Sample", ["src", "stem", "ann", "split"], defaults=[None])
+
+_listeners = threading.local()
+
+
+@contextmanager
+def stream_outputs(fn):
+    """Call fn(status, [(image, label), ...]) for every sample converted in this thread.
+
+    The pairs are the outputs the sample has on disk: those written in this
+    run, or for an unchanged sample those of its manifest record (empty when
+    it was skipped). pipeline.py uses this to feed the merge while the
+    converters are still running.
+    """
+    prev = getattr(_listeners, "fn", None)
+    _listeners.fn = fn
+    try:
+        yield
+    finally:
+        _listeners.fn = prev
+
+
+def yolo_line(cls_idx, x_ctr, y_ctr, w, h) -> str:
+    return f"{cls_idx} {x_ctr:.6f} {y_ctr:.6f} {w:.6f} {h:.6f}"
+
+
+def yolo_lines(cls, xc, yc, w, h):
+    """Vectorized yolo_line: arrays → list of lines, in one C-level to_csv pass."""
+    df = pd.DataFrame({"cls": cls, "xc": xc, "yc": yc, "w": w, "h": h})
+    return df.to_csv(sep=" ", header=False, index=False,
+                     float_format="%.6f", lineterminator="\n").split("\n")[:-1]
+
+
+def group_lines(lines, group, n_groups):
+    """Split `lines` (ordered by their group index) into n_groups line lists."""
+    ends = np.cumsum(np.bincount(group, minlength=n_groups)).tolist()
+    return [lines[a:b] for a, b in zip([0] + ends[:-1], ends)]
+
+
+def passthrough(ann):
+    """Adapter for samples whose payload already is the list of YOLO lines."""
+    return ann
+
+
+def _chunks(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def set_worker_settings(module, settings):
+    """Set constants of an imported module, here and in the pool workers started afterwards."""
+    mod = importlib.import_module(module)
+    for key, value in settings.items():
+        setattr(mod, key, value)
+    _worker_settings.setdefault(module, {}).update(settings)
+
+
+def _init_worker(settings):
+    for module, values in settings.items():
+        mod = importlib.import_module(module)
+        for key, value in values.items():
+            setattr(mod, key, value)
+
+
+def _run_chunk(fn, chunk):
+    out = []
+    for item in chunk:
+        try:
+            out.append((fn(item), None))
+        except Exception:
+            out.append((None, traceback.format_exc()))
+    return out
+
+
+def run_pool(fn, items, workers=DEFAULT_WORKERS, chunksize=DEFAULT_CHUNKSIZE):
+    """Yield (item, result, error) for every item, in input order.
+
+    Items are submitted in chunks with at most 2*workers chunks in flight, so
+    a generator of millions of items never gets materialized in the task
+    queue. `fn` must be picklable (module-level function or partial) and,
+    as workers import the caller's modules afresh, scripts need an
+    `if __name__ == "__main__"` guard. `error` is the formatted traceback
+    when fn raised, else None.
+    """
+    if workers <= 1:
+        for chunk in _chunks(items, chunksize):
+            for item, (res, err) in zip(chunk, _run_chunk(fn, chunk)):
+                yield item, res, err
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_MP_CONTEXT,
+                             initializer=_init_worker, initargs=(dict(_worker_settings),)) as ex:
+        pending = deque()
+        for chunk in _chunks(items, chunksize):
+            pending.append((chunk, ex.submit(_run_chunk, fn, chunk)))
+            if len(pending) >= 2 * workers:
+                done_chunk, fut = pending.popleft()
+                for item, (res, err) in zip(done_chunk, fut.result()):
+                    yield item, res, err
+        while pending:
+            done_chunk, fut = pending.popleft()
+            for item, (res, err) in zip(done_chunk, fut.result()):
+                yield item, res, err
+
+
+def _out_dirs(sample, img_dst, lbl_dst):
+    if sample.split is None:
+        return img_dst, lbl_dst
+    return img_dst / sample.split, lbl_dst / sample.split
+
+
+def _outputs(sample, img_dst, lbl_dst):
+    img_dst, lbl_dst = _out_dirs(sample, img_dst, lbl_dst)
+    src = Path(sample.src)
+    return img_dst / src.name, lbl_dst / f"{sample.stem}.txt"
+
+
+def _write_sample(sample, lines, img_dst, lbl_dst, keep_empty, link_mode, variants=(), ingest=None):
+    """Materialize the image and write the labels of one sample.
+
+    Returns (status, strategy, nbytes, written output paths, resized), resized
+    being the size of the downsized image (None if ingest left it as-is).
+    With variants, `lines` holds one line list per destination (main first).
+    """
+    status, strategy, nbytes, written, resized = "skipped", None, 0, [], None
+    src_img = Path(sample.src)
+    for (i_dst, l_dst), ls in zip(((img_dst, lbl_dst), *variants),
+                                  lines if variants else (lines,)):
+        if not ls and not keep_empty:
+            continue
+        img_out, lbl_out = _outputs(sample, i_dst, l_dst)
+        n = ingest_image(src_img, img_out, ingest) if ingest is not None else None
+        if n is None:
+            strat, n = materialize(src_img, img_out, link_mode)
+        else:
+            strat, src_img, resized = "resized", img_out, n  # variants link the resized copy
+        ingest = None
+        n += lbl_out.write_text("\n".join(ls))
+        status, strategy, nbytes = "written", strategy or strat, nbytes + n
+        written += [str(img_out), str(lbl_out)]
+    return status, strategy, nbytes, written, resized
+
+
+def _convert_one(sample, adapter, **kw):
+    status, strategy, nbytes, written, resized = _write_sample(sample, adapter(sample.ann), **kw)
+    return status, strategy, nbytes, resized, written
+
+
+def _signature(sample, prev, version, hash_content, img_dst, lbl_dst, variants=(), ingest=None):
+    src = Path(sample.src)
+    sig = [file_signature(src, hash_content), payload_signature(sample.ann, hash_content)]
+    if ingest is not None:  # other resize settings → other image bytes
+        sig.append(list(ingest))
+    outputs = [str(o) for dst in ((img_dst, lbl_dst), *variants) for o in _outputs(sample, *dst)]
+    return is_current(prev, sig, version, outputs), sig
+
+
+def _record(prev, sig, status, strategy, nbytes, written, resized):
+    remove_stale(prev, written)
+    return status, strategy, nbytes, resized, (sig, written)
+
+
+def _convert_incremental(item, adapter, version, hash_content, **kw):
+    # item = (sample, previous manifest record or None); the signature is
+    # computed here so the stat/hash calls run in the workers too
+    sample, prev = item
+    current, sig = _signature(sample, prev, version, hash_content, kw["img_dst"], kw["lbl_dst"],
+                              kw.get("variants", ()), kw.get("ingest"))
+    if current:
+        return "unchanged", None, 0, None, None
+    return _record(prev, sig, *_write_sample(sample, adapter(sample.ann), **kw))
+
+
+def _convert_batch(chunk, adapter, version, hash_content, **kw):
+    """Batch-adapter counterpart of _convert_one/_convert_incremental.
+
+    Returns ([(result, error)] per item, counts). Unchanged samples are
+    filtered out before the adapter sees the batch.
+    """
+    results = [None] * len(chunk)
+    todo = []  # (index, sample, prev, sig)
+    for i, item in enumerate(chunk):
+        if version is None:
+            todo.append((i, item, None, None))
+            continue
+        sample, prev = item
+        try:
+            current, sig = _signature(sample, prev, version, hash_content, kw["img_dst"],
+                                      kw["lbl_dst"], kw.get("variants", ()), kw.get("ingest"))
+        except Exception:
+            results[i] = (None, traceback.format_exc())
+            continue
+        if current:
+            results[i] = (("unchanged", None, 0, None, None), None)
+        else:
+            todo.append((i, sample, prev, sig))
+
+    all_lines, counts = adapter([t[1].ann for t in todo]) if todo else ([], None)
+    for (i, sample, prev, sig), lines in zip(todo, all_lines):
+        if isinstance(lines, BaseException):
+            results[i] = (None, "".join(traceback.format_exception(lines)))
+            continue
+        try:
+            res = _write_sample(sample, lines, **kw)
+            results[i] = ((*res[:3], res[4], res[3]) if version is None else _record(prev, sig, *res),
+                          None)
+        except Exception:
+            results[i] = (None, traceback.format_exc())
+    return results, counts
+
+
+def _run_batches(fn, items, workers, chunksize, summary):
+    # one pool task per chunk; flattens back to run_pool's (item, result, error)
+    for chunk, res, err in run_pool(fn, _chunks(items, chunksize), workers, chunksize=1):
+        if err is not None:
+            for item in chunk:
+                yield item, None, err
+            continue
+        results, counts = res
+        if counts is not None:
+            summary["counts"] = counts if summary["counts"] is None else summary["counts"] + counts
+        for item, (r, e) in zip(chunk, results):
+            yield item, r, e
+
+
+def convert_samples(samples, adapter, img_dst, lbl_dst,
+                    workers=DEFAULT_WORKERS, chunksize=DEFAULT_CHUNKSIZE,
+                    desc="Converting", keep_empty=False, link_mode="auto", total=None,
+                    manifest=None, hash_content=False, on_result=None, batch=False,
+                    splits=(), variants=(), ingest=None):
+    """Convert samples to YOLO format in parallel.
+
+    For every sample, `adapter(sample.ann)` returns the YOLO label lines; the
+    image is materialized into img_dst with `link_mode` and the lines written
+    to lbl_dst/<stem>.txt. Samples without lines are skipped unless keep_empty
+    is set. Returns {"written": int, "skipped": int, "errors": [(src, traceback)],
+    "links": LinkStats} where LinkStats counts image and label bytes written.
+    `samples` may be a generator; pass `total` for a progress bar with ETA.
+
+    With a StageManifest, samples whose image, payload, mapping version and
+    outputs are unchanged since the recorded run are counted as "unchanged"
+    and not touched; everything processed is recorded as it completes.
+    `on_result(sample, status)` is called in the parent for every sample.
+    Samples with a `split` are written below img_dst/<split> and
+    lbl_dst/<split>; list the split names in `splits` so they are created.
+
+    `variants` are extra (img_dst, lbl_dst) pairs written from the same pass,
+    e.g. a second dataset with different boxes; the adapter then returns a
+    tuple of line lists, one per destination with the main one first, and
+    each destination skips or keeps empty samples on its own.
+
+    With batch=True the adapter is called once per chunk of `chunksize`
+    payloads, `adapter([ann, ...]) -> ([lines or exception per ann], counts)`,
+    so it can parse and remap a whole chunk with array operations. `counts`
+    (None or anything supporting +, e.g. a NumPy array) is summed over all
+    chunks into summary["counts"]. An adapter that raises fails its whole chunk.
+
+    With an ingest.Ingest, images larger than ingest.max_side are written
+    downsized and re-encoded instead of linked; summary["ingest"] (an
+    IngestStats) holds the bytes before and after of every image written.
+    """
+    img_dst, lbl_dst = Path(img_dst), Path(lbl_dst)
+    variants = tuple((Path(i), Path(l)) for i, l in variants)
+    for i_dst, l_dst in ((img_dst, lbl_dst), *variants):
+        for split in ("", *splits):
+            (i_dst / split).mkdir(parents=True, exist_ok=True)
+            (l_dst / split).mkdir(parents=True, exist_ok=True)
+
+    if total is None and hasattr(samples, "__len__"):
+        total = len(samples)
+    kw = dict(adapter=adapter, img_dst=img_dst, lbl_dst=lbl_dst,
+              keep_empty=keep_empty, link_mode=link_mode, variants=variants, ingest=ingest)
+    if manifest is not None:
+        samples = ((s, manifest.get(str(s.src))) for s in samples)
+
+    summary = {"written": 0, "skipped": 0, "unchanged": 0, "errors": [], "links": LinkStats(),
+               "counts": None, "ingest": IngestStats()}
+    if batch:
+        fn = partial(_convert_batch, version=manifest.version if manifest is not None else None,
+                     hash_content=hash_content, **kw)
+        results = _run_batches(fn, samples, workers, chunksize, summary)
+    elif manifest is None:
+        results = run_pool(partial(_convert_one, **kw), samples, workers, chunksize)
+    else:
+        fn = partial(_convert_incremental, version=manifest.version,
+                     hash_content=hash_content, **kw)
+        results = run_pool(fn, samples, workers, chunksize)
+
+    listener = getattr(_listeners, "fn", None)
+    for item, res, err in tqdm(results, total=total, desc=desc, unit="img"):
+        sample = item if manifest is None else item[0]
+        if err is not None:
+            summary["errors"].append((str(sample.src), err))
+            continue
+        *res, out = res  # written outputs, or the manifest record (None if unchanged)
+        if manifest is not None:
+            if out is not None:
+                manifest.record(str(sample.src), *out)
+            out = manifest.get(str(sample.src))["out"]
+        status, strategy, nbytes, resized = res
+        summary[status] += 1
+        if on_result is not None:
+            on_result(sample, status)
+        if listener is not None:
+            listener(status, list(zip(out[::2], out[1::2])))
+        if strategy is not None:
+            summary["links"].add(strategy, nbytes)
+        if ingest is not None and status == "written":
+            summary["ingest"].add(sample.src, resized)
+    return summary
+
+
+def print_summary(name, summary, max_errors=5):
+    unchanged = f"{summary['unchanged']} unchanged, " if summary["unchanged"] else ""
+    print(f"{name}: {summary['written']} written, {summary['skipped']} skipped, {unchanged}"
+          f"{len(summary['errors'])} errors, {summary['links'].report()}")
+    if summary["ingest"].resized:
+        print(f"  ingest: {summary['ingest'].report()}")
+    for src, err in summary["errors"][:max_errors]:
+        print(f"  ✗ {src}\n{err}")
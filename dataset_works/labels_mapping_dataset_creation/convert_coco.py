@@ -1,11 +1,45 @@
 import os
-import json
-import shutil
-from tqdm import tqdm
+
+from class_tables import ClassMapping
+from coco_stream import load_coco_compact
+from conversion_engine import DEFAULT_WORKERS, Sample, convert_samples, print_summary, yolo_line
+from stage_manifest import open_manifest
 
 # CONFIGURE THESE
 COCO_ROOT = "/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/data_sameer/coco"
 YOLO_ROOT = "/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/converted_datasets/coco"
+WORKERS   = DEFAULT_WORKERS
+# hardlink | reflink | symlink | copy | auto (hardlink → reflink → copy)
+LINK_MODE = "auto"
+# Only process inputs that changed since the last run (see stage_manifest.py)
+INCREMENTAL = True
+# Downsize images with a longer side above max_side on the way in (see ingest.py)
+INGEST      = None  # e.g. ingest.Ingest(max_side=1280, quality=90)
+# Compiled class tables written by class_mapping.py
+MAPPING_PTH = "./class_mapping.npz"
+
+# COCO category_id → master index
+mapping = ClassMapping(MAPPING_PTH)
+
+def coco_to_yolo(ann):
+    """ann = (w, h, cls_idx array, (n, 4) COCO bbox array) → YOLO lines."""
+    w, h, cls, bbox = ann
+    x_ctr = (bbox[:, 0] + bbox[:, 2]/2) / w
+    y_ctr = (bbox[:, 1] + bbox[:, 3]/2) / h
+    w_norm = bbox[:, 2] / w
+    h_norm = bbox[:, 3] / h
+    return [yolo_line(*row) for row in zip(cls.tolist(), x_ctr.tolist(), y_ctr.tolist(),
+                                           w_norm.tolist(), h_norm.tolist())]
+
+def iter_samples(coco, img_src_dir):
+    # Images without annotations still get an (empty) label file. Samples
+    # come out in image-index order, so every worker chunk is an image range.
+    cls_all = mapping.apply("coco", coco.ann_category)
+    for i, fn in enumerate(coco.file_names):
+        a, b = coco.offsets[i], coco.offsets[i + 1]
+        keep = cls_all[a:b] >= 0
+        yield Sample(os.path.join(img_src_dir, fn), os.path.splitext(fn)[0],
+                     (coco.widths[i], coco.heights[i], cls_all[a:b][keep], coco.ann_bbox[a:b][keep]))
 
 def convert_split(split):
     # Paths
@@ -17,46 +51,27 @@ def convert_split(split):
     os.makedirs(img_dst_dir, exist_ok=True)
     os.makedirs(lbl_dst_dir, exist_ok=True)
 
-    # Load COCO file
-    with open(ann_path, 'r') as f:
-        coco = json.load(f)
-
-    # Build image‐info and category‐mapping tables
-    images  = {img["id"]:(img["file_name"], img["width"], img["height"])
-               for img in coco["images"]}
-    cats    = sorted(coco["categories"], key=lambda c: c["id"])
-    cat2idx = {c["id"]:i for i,c in enumerate(cats)}
-
-    # Group annotations by image_id
-    ann_by_img = {}
-    for ann in coco["annotations"]:
-        ann_by_img.setdefault(ann["image_id"], []).append(ann)
-
-    # Process each image with a progress bar
-    for img_id, (fn, w, h) in tqdm(images.items(),
-                                   desc=f"Converting {split}",
-                                   unit="img"):
-        # 1) copy image
-        src = os.path.join(img_src_dir, fn)
-        dst = os.path.join(img_dst_dir, fn)
-        shutil.copy2(src, dst)
-
-        # 2) write label file
-        lines = []
-        for ann in ann_by_img.get(img_id, []):
-            x_min, y_min, bw, bh = ann["bbox"]
-            x_ctr = (x_min + bw/2) / w
-            y_ctr = (y_min + bh/2) / h
-            w_norm = bw / w
-            h_norm = bh / h
-            cls_idx = cat2idx[ann["category_id"]]
-            lines.append(f"{cls_idx} {x_ctr:.6f} {y_ctr:.6f} {w_norm:.6f} {h_norm:.6f}")
-
-        label_path = os.path.splitext(fn)[0] + ".txt"
-        with open(os.path.join(lbl_dst_dir, label_path), "w") as f:
-            f.write("\n".join(lines))
+    # Stream the COCO file into compact arrays (no json.load of the whole file)
+    coco = load_coco_compact(ann_path)
 
-if __name__ == "__main__":
+    manifest_path = os.path.join(YOLO_ROOT, ".manifests", f"{split}.jsonl")
+    with open_manifest(manifest_path, mapping.version, INCREMENTAL) as manifest:
+        summary = convert_samples(iter_samples(coco, img_src_dir), coco_to_yolo,
+                                  img_dst_dir, lbl_dst_dir,
+                                  workers=WORKERS, desc=f"Converting {split}",
+                                  keep_empty=True, link_mode=LINK_MODE,
+                                  total=len(coco.file_names), manifest=manifest,
+                                  ingest=INGEST)
+    print_summary(split, summary)
+    if INGEST is not None:
+        summary["ingest"].save(YOLO_ROOT, split, INGEST,
+                               summary["written"] + summary["unchanged"])
+
+def main():
     for split in ["train2017", "val2017"]:
         convert_split(split)
-    print("✅ Conversion complete!")
\ No newline at end of file
+    print("✅ Conversion complete!")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,38 @@
 import json
-import shutil
+import re
 from pathlib import Path
-from tqdm import tqdm
+
+import numpy as np
+
+from class_tables import ClassMapping
+from conversion_engine import (DEFAULT_WORKERS, Sample, convert_samples, group_lines,
+                               print_summary, yolo_lines)
+from image_meta import load_meta
+from stage_manifest import open_manifest
 
 # === CONFIGURATION ===
 # Path to the CrowdHuman root (contains annotation_train.odgt, annotation_val.odgt, and images/)
 DATA_ROOT        = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/data_sameer/crowdHuman")
 # path to write the converted YOLOv11 dataset
 OUTPUT_ROOT      = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/converted_datasets/crowdHuman")
-# Path to the master.names file
-MASTER_NAMES_PTH = Path("./master.names")
+# head-box variant (human_head class from the hbox of every person), written
+# in the same pass; None to skip it. Keep it outside converted_datasets:
+# merging_all.py merges every folder there, so the same images would enter
+# the merged set twice.
+HEAD_OUTPUT_ROOT = None  # e.g. Path(".../Sameer_dataset_from_smb/variants/crowdHuman_head")
+# Compiled class tables written by class_mapping.py
+MAPPING_PTH      = Path("./class_mapping.npz")
+# Person box: the first of these present on the annotation
+# ("fbox" full body, "vbox" visible region, "hbox" head)
+BOX_POLICY       = ("fbox", "vbox", "hbox")
+WORKERS          = DEFAULT_WORKERS
+BATCH_LINES      = 512  # odgt records per worker task
+# hardlink | reflink | symlink | copy | auto (hardlink → reflink → copy)
+LINK_MODE        = "auto"
+# Only process inputs that changed since the last run (see stage_manifest.py)
+INCREMENTAL      = True
+# Downsize images with a longer side above max_side on the way in (see ingest.py)
+INGEST           = None  # e.g. ingest.Ingest(max_side=1280, quality=90)
 
 # Splits mapping: split name -> odgt filename
 SPLITS = {
@@ -17,94 +40,131 @@ SPLITS = {
     "val":   "annotation_val.odgt",
 }
 
-def normalize(name: str) -> str:
-    return name.lower().strip().replace(" ", "_").replace("/", "_")
-
-# Load master.names into a name->index map
-master_names = [l.strip() for l in MASTER_NAMES_PTH.read_text().splitlines() if l.strip()]
-name2idx = {normalize(n): i for i, n in enumerate(master_names)}
-
-# Create output directories
-for split in SPLITS:
-    (OUTPUT_ROOT / "images" / split).mkdir(parents=True, exist_ok=True)
-    (OUTPUT_ROOT / "labels" / split).mkdir(parents=True, exist_ok=True)
-
-total_images = 0
-total_labels = 0
-
-# Process each split
-for split, odgt_fname in SPLITS.items():
-    odgt_path = DATA_ROOT / odgt_fname
-    img_src_dir = DATA_ROOT / "images"
-    img_dst_dir = OUTPUT_ROOT / "images" / split
-    lbl_dst_dir = OUTPUT_ROOT / "labels" / split
-
-    split_images = 0
-    split_labels = 0
-
-    # Read and convert each line in the .odgt file
-    with odgt_path.open('r') as f:
-        for line in tqdm(f, desc=f"Converting {split}", unit="img"):
+# CrowdHuman 'person' tag and head boxes → master index
+mapping = ClassMapping(MAPPING_PTH)
+PERSON_IDX, HEAD_IDX = mapping.lookup("crowdhuman", ["person", "head"]).tolist()
+
+_ID_RE = re.compile(r'"ID"\s*:\s*"([^"]+)"')
+
+
+def _image_size(data, src_img, size):
+    # Image dimensions from the annotation, else the header probe, fallback to PIL
+    w = data.get("img_w") or data.get("width")
+    h = data.get("img_h") or data.get("height")
+    if (w is None or h is None) and size is not None:
+        w, h = size
+    if w is None or h is None:
+        from PIL import Image
+        with Image.open(src_img) as im:
+            w, h = im.size
+    return w, h
+
+
+def _normalized_lines(cls_idx, boxes, rec, sizes, n_records):
+    """(x, y, w, h) pixel boxes of records `rec` → YOLO line lists per record."""
+    if cls_idx < 0 or not len(boxes):
+        return [[] for _ in range(n_records)]
+    b = np.asarray(boxes, dtype=np.float64)
+    wh = sizes[rec]
+    lines = yolo_lines(cls_idx,
+                       (b[:, 0] + b[:, 2] / 2) / wh[:, 0],
+                       (b[:, 1] + b[:, 3] / 2) / wh[:, 1],
+                       b[:, 2] / wh[:, 0],
+                       b[:, 3] / wh[:, 1])
+    return group_lines(lines, rec, n_records)
+
+
+def odgt_batch_to_yolo(anns):
+    """Batch adapter: [(odgt line, image path, header (w, h) or None)] → line lists.
+
+    JSON is parsed here, in the workers. Boxes of the whole batch are
+    normalized with one array operation per output dataset. Returns
+    (person lines, head lines) per record when the head variant is enabled.
+    """
+    out = [None] * len(anns)
+    sizes = np.ones((len(anns), 2))
+    person_rec, person_boxes, head_rec, head_boxes = [], [], [], []
+    for i, (line, src_img, size) in enumerate(anns):
+        try:
             data = json.loads(line)
-            img_id = data["ID"]
-
-            # Determine image file path
-            src_img = img_src_dir / f"{img_id}.jpg"
-            if not src_img.exists():
-                src_img = img_src_dir / f"{img_id}.png"
-                if not src_img.exists():
-                    continue  # image file not found
-
-            # Get image dimensions from annotation, fallback to PIL if needed
-            w = data.get("img_w") or data.get("width")
-            h = data.get("img_h") or data.get("height")
-            if w is None or h is None:
-                from PIL import Image
-                with Image.open(src_img) as im:
-                    w, h = im.size
-
-            # Build YOLO label lines
-            lines = []
-            for box in data.get("gtboxes", []):
-                if box.get("tag") != "person":
-                    continue  # skip masks or other tags
-                # Choose full-body box if available, else visible-region, else head
-                if "fbox" in box:
-                    x, y, bw, bh = box["fbox"]
-                elif "vbox" in box:
-                    x, y, bw, bh = box["vbox"]
-                elif "hbox" in box:
-                    x, y, bw, bh = box["hbox"]
-                else:
-                    continue
-
-                # Normalize coordinates for YOLO
-                x_center = (x + bw/2) / w
-                y_center = (y + bh/2) / h
-                w_norm = bw / w
-                h_norm = bh / h
-
-                cls_idx = name2idx.get("person")
-                if cls_idx is None:
-                    continue
-                lines.append(f"{cls_idx} {x_center:.6f} {y_center:.6f} {w_norm:.6f} {h_norm:.6f}")
-
-            if not lines:
-                continue  # skip images without person boxes
-
-            # Copy image to output
-            dst_img = img_dst_dir / src_img.name
-            shutil.copy2(src_img, dst_img)
-            split_images += 1
-
-            # Write label file
-            (lbl_dst_dir / f"{img_id}.txt").write_text("\n".join(lines))
-            split_labels += 1
-
-    print(f"{split}: images written: {split_images}, labels written: {split_labels}")
-
-    total_images += split_images
-    total_labels += split_labels
-
-# Overall summary
-print(f"\nOverall: {total_images} images, {total_labels} labels written for CrowdHuman")
+            sizes[i] = _image_size(data, src_img, size)
+        except Exception as e:
+            out[i] = e
+            continue
+        for box in data.get("gtboxes", []):
+            if box.get("tag") != "person":
+                continue  # skip masks or other tags
+            key = next((k for k in BOX_POLICY if k in box), None)
+            if key is not None:
+                person_rec.append(i)
+                person_boxes.append(box[key])
+            if "hbox" in box:
+                head_rec.append(i)
+                head_boxes.append(box["hbox"])
+
+    person = _normalized_lines(PERSON_IDX, person_boxes, np.array(person_rec, dtype=np.int64),
+                               sizes, len(anns))
+    head = _normalized_lines(HEAD_IDX, head_boxes, np.array(head_rec, dtype=np.int64),
+                             sizes, len(anns))
+    for i in range(len(anns)):
+        if out[i] is None:
+            out[i] = (person[i], head[i]) if HEAD_OUTPUT_ROOT is not None else person[i]
+    return out, None
+
+
+def read_samples(odgt_path: Path, img_src_dir: Path):
+    """Samples with the raw odgt line as payload; JSON is parsed in the workers."""
+    # one directory listing (+ header sizes, cached next to the images)
+    meta = load_meta(img_src_dir)
+    stems = {}
+    for name in meta.names:
+        stem, ext = name.rsplit(".", 1) if "." in name else (name, "")
+        if ext == "jpg" or (ext == "png" and stem not in stems):
+            stems[stem] = name
+    samples = []
+    with odgt_path.open('r') as f:
+        for line in f:
+            m = _ID_RE.search(line)
+            if m is None:
+                continue
+            name = stems.get(m.group(1))
+            if name is None:
+                continue  # image file not found
+            src_img = img_src_dir / name
+            samples.append(Sample(src_img, m.group(1), (line, src_img, meta.size(name))))
+    return samples
+
+
+def main():
+    total_images = 0
+    # box choice and the head variant change the outputs, so they version them
+    version = "-".join([mapping.version, *BOX_POLICY] + (["head"] if HEAD_OUTPUT_ROOT else []))
+
+    # Process each split
+    for split, odgt_fname in SPLITS.items():
+        samples = read_samples(DATA_ROOT / odgt_fname, DATA_ROOT / "images")
+        variants = ([(HEAD_OUTPUT_ROOT / "images" / split, HEAD_OUTPUT_ROOT / "labels" / split)]
+                    if HEAD_OUTPUT_ROOT is not None else [])
+        # images without person (resp. head) boxes are skipped by the engine
+        with open_manifest(OUTPUT_ROOT / ".manifests" / f"{split}.jsonl",
+                           version, INCREMENTAL) as manifest:
+            summary = convert_samples(samples, odgt_batch_to_yolo,
+                                      OUTPUT_ROOT / "images" / split,
+                                      OUTPUT_ROOT / "labels" / split,
+                                      workers=WORKERS, chunksize=BATCH_LINES,
+                                      desc=f"Converting {split}",
+                                      link_mode=LINK_MODE, manifest=manifest,
+                                      batch=True, variants=variants, ingest=INGEST)
+        print_summary(split, summary)
+        if INGEST is not None:
+            summary["ingest"].save(OUTPUT_ROOT, split, INGEST,
+                                   summary["written"] + summary["unchanged"])
+        total_images += summary["written"]
+
+    # Overall summary
+    print(f"\nOverall: {total_images} images written for CrowdHuman"
+          + (f" (+ head-box variant in {HEAD_OUTPUT_ROOT})" if HEAD_OUTPUT_ROOT else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,120 +1,134 @@
 #!/usr/bin/env python3
-import os
-import shutil
 from pathlib import Path
 
-from tqdm import tqdm
+import numpy as np
+
+from class_tables import ClassMapping
+from conversion_engine import (DEFAULT_CHUNKSIZE, DEFAULT_WORKERS, Sample, convert_samples,
+                               group_lines, print_summary, yolo_lines)
+from label_store import parse_label_text
+from stage_manifest import open_manifest
 
 # === CONFIGURATION ===
 # Root of your Objects365 dataset
 INPUT_ROOT   = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/data_sameer/Objects365/")
 # Where to write the converted YOLOv11 dataset
 OUTPUT_ROOT  = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/converted_datasets/")
-# Path to your master.names file
-MASTER_NAMES_PTH = Path("./master.names")
+# Compiled class tables written by class_mapping.py
+MAPPING_PTH  = Path("./class_mapping.npz")
 
 OBJECT_NAME = "Objects365"
+WORKERS     = DEFAULT_WORKERS
+# hardlink | reflink | symlink | copy | auto (hardlink → reflink → copy)
+LINK_MODE   = "auto"
+# Only process inputs that changed since the last run (see stage_manifest.py)
+INCREMENTAL = True
+# Downsize images with a longer side above max_side on the way in (see ingest.py)
+INGEST      = None  # e.g. ingest.Ingest(max_side=1280, quality=90)
+# "batch": parse BATCH_FILES label files at a time into one array and remap
+#          with a single LUT lookup (coordinates rewritten as %.6f)
+# "lines": per-row string remap, coordinates copied verbatim
+REMAP_MODE  = "batch"
+BATCH_FILES = 1024
+
+# Objects365 class id → master index (same table class_mapping.py built master from)
+mapping = ClassMapping(MAPPING_PTH)
+o365_lut = mapping.lut("objects365")
 
-# Load master.names → name2idx
-master_names = [ln.strip() for ln in MASTER_NAMES_PTH.read_text().splitlines() if ln.strip()]
-name2idx     = {name: idx for idx, name in enumerate(master_names)}
-
-# Raw Objects365 class list (original order)
-objects365_raw = [
-    "Person","Sneakers","Chair","Other Shoes","Hat","Car","Lamp","Glasses","Bottle","Desk",
-    "Cup","Street Lights","Cabinet/shelf","Handbag/Satchel","Bracelet","Plate","Picture/Frame",
-    "Helmet","Book","Gloves","Storage box","Boat","Leather Shoes","Flower","Bench","Potted Plant",
-    "Bowl/Basin","Flag","Pillow","Boots","Vase","Microphone","Necklace","Ring","SUV","Wine Glass",
-    "Belt","Monitor/TV","Backpack","Umbrella","Traffic Light","Speaker","Watch","Tie",
-    "Trash bin Can","Slippers","Bicycle","Stool","Barrel/bucket","Van","Couch","Sandals",
-    "Basket","Drum","Pen/Pencil","Bus","Wild Bird","High Heels","Motorcycle","Guitar","Carpet",
-    "Cell Phone","Bread","Camera","Canned","Truck","Traffic cone","Cymbal","Lifesaver","Towel",
-    "Stuffed Toy","Candle","Sailboat","Laptop","Awning","Bed","Faucet","Tent","Horse","Mirror",
-    "Power outlet","Sink","Apple","Air Conditioner","Knife","Hockey Stick","Paddle",
-    "Pickup Truck","Fork","Traffic Sign","Balloon","Tripod","Dog","Spoon","Clock","Pot","Cow",
-    "Cake","Dinning Table","Sheep","Hanger","Blackboard/Whiteboard","Napkin","Other Fish",
-    "Orange/Tangerine","Toiletry","Keyboard","Tomato","Lantern","Machinery Vehicle","Fan",
-    "Green Vegetables","Banana","Baseball Glove","Airplane","Mouse","Train","Pumpkin","Soccer",
-    "Skiboard","Luggage","Nightstand","Tea pot","Telephone","Trolley","Head Phone","Sports Car",
-    "Stop Sign","Dessert","Scooter","Stroller","Crane","Remote","Refrigerator","Oven","Lemon",
-    "Duck","Baseball Bat","Surveillance Camera","Cat","Jug","Broccoli","Piano","Pizza","Elephant",
-    "Skateboard","Surfboard","Gun","Skating and Skiing shoes","Gas stove","Donut","Bow Tie",
-    "Carrot","Toilet","Kite","Strawberry","Other Balls","Shovel","Pepper","Computer Box",
-    "Toilet Paper","Cleaning Products","Chopsticks","Microwave","Pigeon","Baseball",
-    "Cutting/chopping Board","Coffee Table","Side Table","Scissors","Marker","Pie","Ladder",
-    "Snowboard","Cookies","Radiator","Fire Hydrant","Basketball","Zebra","Grape","Giraffe",
-    "Potato","Sausage","Tricycle","Violin","Egg","Fire Extinguisher","Candy","Fire Truck",
-    "Billiards","Converter","Bathtub","Wheelchair","Golf Club","Briefcase","Cucumber",
-    "Cigar/Cigarette","Paint Brush","Pear","Heavy Truck","Hamburger","Extractor","Extension Cord",
-    "Tong","Tennis Racket","Folder","American Football","Earphone","Mask","Kettle","Tennis",
-    "Ship","Swing","Coffee Machine","Slide","Carriage","Onion","Green beans","Projector",
-    "Frisbee","Washing Machine/Drying Machine","Chicken","Printer","Watermelon","Saxophone",
-    "Tissue","Toothbrush","Ice cream","Hot-air balloon","Cello","French Fries","Scale","Trophy",
-    "Cabbage","Hot dog","Blender","Peach","Rice","Wallet/Purse","Volleyball","Deer","Goose",
-    "Tape","Tablet","Cosmetics","Trumpet","Pineapple","Golf Ball","Ambulance","Parking meter",
-    "Mango","Key","Hurdle","Fishing Rod","Medal","Flute","Brush","Penguin","Megaphone","Corn",
-    "Lettuce","Garlic","Swan","Helicopter","Green Onion","Sandwich","Nuts","Speed Limit Sign",
-    "Induction Cooker","Broom","Trombone","Plum","Rickshaw","Goldfish","Kiwi fruit",
-    "Router/modem","Poker Card","Toaster","Shrimp","Sushi","Cheese","Notepaper","Cherry","Pliers",
-    "CD","Pasta","Hammer","Cue","Avocado","Hamimelon","Flask","Mushroom","Screwdriver","Soap",
-    "Recorder","Bear","Eggplant","Board Eraser","Coconut","Tape Measure/Ruler","Pig","Showerhead",
-    "Globe","Chips","Steak","Crosswalk Sign","Stapler","Camel","Formula 1","Pomegranate",
-    "Dishwasher","Crab","Hoverboard","Meat ball","Rice Cooker","Tuba","Calculator","Papaya",
-    "Antelope","Parrot","Seal","Butterfly","Dumbbell","Donkey","Lion","Urinal","Dolphin",
-    "Electric Drill","Hair Dryer","Egg tart","Jellyfish","Treadmill","Lighter","Grapefruit",
-    "Game board","Mop","Radish","Baozi","Target","French","Spring Rolls","Monkey","Rabbit",
-    "Pencil Case","Yak","Red Cabbage","Binoculars","Asparagus","Barbell","Scallop","Noddles",
-    "Comb","Dumpling","Oyster","Table Tennis paddle","Cosmetics Brush/Eyeliner Pencil",
-    "Chainsaw","Eraser","Lobster","Durian","Okra","Lipstick","Cosmetics Mirror","Curling",
-    "Table Tennis"
-]
-
-
-def normalize(name: str) -> str:
-    return name.lower().strip().replace(" ", "_").replace("/", "_")
-
-objects365_names = [normalize(n) for n in objects365_raw]
-
-# Ensure output dirs exist
-for split in ("train", "val"):
-    (OUTPUT_ROOT / OBJECT_NAME / "images" / split).mkdir(parents=True, exist_ok=True)
-    (OUTPUT_ROOT / OBJECT_NAME / "labels" / split).mkdir(parents=True, exist_ok=True)
-
-# Process each split
-for split in ("train", "val"):
-    img_src = INPUT_ROOT / "images" / split
-    lbl_src = INPUT_ROOT / "labels" / split
-    img_dst = OUTPUT_ROOT / OBJECT_NAME / "images" / split
-    lbl_dst = OUTPUT_ROOT / OBJECT_NAME / "labels" / split
-
-    # Copy images (skip hidden files)
-    for img_path in tqdm(img_src.iterdir(), desc=f"{split} images", unit="img"):
-        if not img_path.is_file() or img_path.name.startswith('.'):
+def remap_labels(lbl_path: Path):
+    """Objects365 label file → YOLO lines with master.names indices."""
+    lines = []
+    for row in lbl_path.read_text().splitlines():
+        parts = row.split()
+        if not parts:
             continue
-        dst = img_dst / img_path.name
+        orig_cls = int(parts[0])
+        if 0 <= orig_cls < len(o365_lut) and o365_lut[orig_cls] >= 0:
+            lines.append(" ".join([str(o365_lut[orig_cls])] + parts[1:]))
+    return lines
+
+
+def remap_batch(lbl_paths):
+    """Batch adapter: label files → (YOLO lines per file, dropped boxes per source class).
+
+    All files of the batch are parsed into one (n, 5) array, remapped with one
+    LUT indexing operation and formatted in one pass. The dropped counts have
+    one slot per Objects365 id plus a last slot for out-of-range ids.
+    """
+    parsed = []
+    for p in lbl_paths:
         try:
-            os.link(img_path, dst)
-        except OSError:
-            shutil.copy2(img_path, dst)
+            parsed.append(parse_label_text(Path(p).read_text()))
+        except Exception as e:
+            parsed.append(e)
+    arrays = [a for a in parsed if not isinstance(a, Exception)]
+    counts = np.array([len(a) for a in arrays], dtype=np.int64)
+    rows = np.concatenate(arrays) if arrays else np.empty((0, 5))
+
+    src_cls = rows[:, 0].astype(np.int64)
+    cls = mapping.apply("objects365", src_cls)
+    keep = cls >= 0
+    in_range = (src_cls >= 0) & (src_cls < len(o365_lut))
+    dropped = np.bincount(np.where(in_range, src_cls, len(o365_lut))[~keep],
+                          minlength=len(o365_lut) + 1)
+
+    kept = rows[keep]
+    lines = yolo_lines(cls[keep], kept[:, 1], kept[:, 2], kept[:, 3], kept[:, 4])
+
+    # kept rows per file → slices of `lines`
+    file_idx = np.repeat(np.arange(len(arrays)), counts)
+    blocks = iter(group_lines(lines, file_idx[keep], len(arrays)))
+    return [a if isinstance(a, Exception) else next(blocks) for a in parsed], dropped
+
+
+def report_dropped(dropped):
+    if dropped is None:  # every file unchanged since the last run
+        return
+    if not dropped.any():
+        print("  no boxes dropped by the class mapping")
+        return
+    names = mapping.source_names("objects365").tolist() + ["<out of range id>"]
+    print(f"  {int(dropped.sum())} boxes dropped by the class mapping:")
+    for i in np.argsort(dropped)[::-1]:
+        if dropped[i] == 0:
+            break
+        print(f"    {names[i] or i}: {int(dropped[i])}")
+
+
+def list_samples(img_src: Path, lbl_src: Path):
+    # Pair images and .txt labels by stem (skip hidden files); images without
+    # a label never get copied, so no orphans are produced
+    images = {p.stem: p for p in img_src.iterdir()
+              if p.is_file() and not p.name.startswith('.')}
+    return [Sample(images[p.stem], p.stem, p) for p in lbl_src.iterdir()
+            if p.is_file() and not p.name.startswith('.')
+            and p.suffix.lower() == '.txt' and p.stem in images]
+
+
+def main():
+    # Process each split
+    for split in ("train", "val"):
+        samples = list_samples(INPUT_ROOT / "images" / split, INPUT_ROOT / "labels" / split)
+        batch = REMAP_MODE == "batch"
+        # the two modes format coordinates differently, so they version separately
+        with open_manifest(OUTPUT_ROOT / OBJECT_NAME / ".manifests" / f"{split}.jsonl",
+                           f"{mapping.version}-{REMAP_MODE}", INCREMENTAL) as manifest:
+            summary = convert_samples(samples, remap_batch if batch else remap_labels,
+                                      OUTPUT_ROOT / OBJECT_NAME / "images" / split,
+                                      OUTPUT_ROOT / OBJECT_NAME / "labels" / split,
+                                      workers=WORKERS, desc=f"{split} images",
+                                      chunksize=BATCH_FILES if batch else DEFAULT_CHUNKSIZE,
+                                      link_mode=LINK_MODE, manifest=manifest, batch=batch,
+                                      ingest=INGEST)
+        print_summary(split, summary)
+        if INGEST is not None:
+            summary["ingest"].save(OUTPUT_ROOT / OBJECT_NAME, split, INGEST,
+                                   summary["written"] + summary["unchanged"])
+        if batch:
+            report_dropped(summary["counts"])
+
+    print("✅ Objects365 conversion complete—hidden files skipped!")
 
-    # Remap labels (skip hidden .txt files)
-    for lbl_path in tqdm(lbl_src.iterdir(), desc=f"{split} labels", unit="file"):
-        if not lbl_path.is_file() or lbl_path.name.startswith('.'):
-            continue
-        # ensure it's a .txt
-        if lbl_path.suffix.lower() != '.txt':
-            continue
 
-        lines = []
-        for row in lbl_path.read_text().splitlines():
-            parts = row.split()
-            orig_cls = int(parts[0])
-            if 0 <= orig_cls < len(objects365_names):
-                nm = objects365_names[orig_cls]
-                new_idx = name2idx.get(nm)
-                if new_idx is not None:
-                    lines.append(" ".join([str(new_idx)] + parts[1:]))
-        if lines:
-            (lbl_dst / lbl_path.name).write_text("\n".join(lines))
-
-print("✅ Objects365 conversion complete—hidden files skipped!")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,114 @@
-import os
-import shutil
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
+
+from class_tables import ClassMapping
+from conversion_engine import DEFAULT_WORKERS, Sample, convert_samples, passthrough, print_summary
+from stage_manifest import open_manifest
 
 # === PATHS ===
 DATA_ROOT        = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/data_sameer/open-images-v6")
 OUTPUT_ROOT      = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/converted_datasets/open-images-v6")
-MASTER_NAMES_PTH = Path("./master.names")
+MAPPING_PTH      = Path("./class_mapping.npz")  # written by class_mapping.py
 
 SPLITS = ["train", "validation", "test"]
-
-def load_master_names(pth):
-    names = [x.strip() for x in pth.read_text().splitlines() if x.strip()]
-    return {n: i for i, n in enumerate(names)}
-
-def normalize(name: str) -> str:
-    return name.lower().strip().replace(" ", "_").replace("/", "_")
-
-# Load unified name→index map
-name2idx = load_master_names(MASTER_NAMES_PTH)
+WORKERS = DEFAULT_WORKERS
+# hardlink | reflink | symlink | copy | auto (hardlink → reflink → copy)
+LINK_MODE = "auto"
+# Only process inputs that changed since the last run (see stage_manifest.py)
+INCREMENTAL = True
+# Downsize images with a longer side above max_side on the way in (see ingest.py)
+INGEST      = None  # e.g. ingest.Ingest(max_side=1280, quality=90)
+# detections.csv rows held in memory at once
+CHUNK_ROWS = 2_000_000
+
+# Load compiled MID → master index table
+mapping = ClassMapping(MAPPING_PTH)
+
+def load_mid2idx(classes_csv: Path) -> pd.Series:
+    """classes.csv → Series LabelName (MID) → master index, unmapped MIDs dropped."""
+    cls_df = pd.read_csv(classes_csv, header=None,
+                         names=["LabelName","DisplayName"], dtype=str)
+    idx = mapping.lookup("openimages", cls_df["LabelName"].to_numpy())
+    mid2idx = pd.Series(idx, index=cls_df["LabelName"])
+    return mid2idx[mid2idx >= 0]
+
+def chunk_to_blocks(chunk: pd.DataFrame, mid2idx: pd.Series):
+    """Map, filter and format one chunk of detections.
+
+    Returns (image ids, list of per-image YOLO line lists), one entry per
+    contiguous ImageID group after a stable sort.
+    """
+    cls = chunk["LabelName"].map(mid2idx)
+    keep = cls.notna().to_numpy()
+    chunk = chunk.loc[keep]
+    if chunk.empty:
+        return np.empty(0, dtype=object), []
+    chunk = chunk.assign(cls=cls[keep].astype(np.int32)).sort_values("ImageID", kind="stable")
+
+    x0, x1 = chunk["XMin"].to_numpy(), chunk["XMax"].to_numpy()
+    y0, y1 = chunk["YMin"].to_numpy(), chunk["YMax"].to_numpy()
+    yolo = pd.DataFrame({
+        "cls": chunk["cls"].to_numpy(),
+        "xc":  (x0 + x1) / 2.0,
+        "yc":  (y0 + y1) / 2.0,
+        "w":   x1 - x0,
+        "h":   y1 - y0,
+    })
+    # one C-level formatting pass for the whole chunk
+    lines = yolo.to_csv(sep=" ", header=False, index=False,
+                        float_format="%.6f", lineterminator="\n").split("\n")[:-1]
+
+    ids = chunk["ImageID"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    ends = np.r_[starts[1:], len(ids)]
+    return ids[starts], [lines[a:b] for a, b in zip(starts, ends)]
+
+def iter_samples(lbl_csv: Path, mid2idx: pd.Series, id2path: dict, late: dict):
+    """Stream Samples from detections.csv in CHUNK_ROWS-sized pieces.
+
+    The last image of every chunk is carried over to the next one, so an
+    image split across a chunk boundary still gets one label file. Rows of an
+    image that reappear later (CSV not grouped by ImageID) are collected in
+    `late` and appended once the engine is done.
+    """
+    reader = pd.read_csv(
+        lbl_csv,
+        usecols=["ImageID","LabelName","XMin","XMax","YMin","YMax"],
+        dtype={
+            "ImageID": str,
+            "LabelName": str,
+            "XMin": float,
+            "XMax": float,
+            "YMin": float,
+            "YMax": float,
+        },
+        chunksize=CHUNK_ROWS,
+    )
+    seen  = set()
+    carry = None
+    for chunk in reader:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        last_id = chunk["ImageID"].iat[-1]
+        tail = (chunk["ImageID"] == last_id).to_numpy()
+        carry, chunk = chunk.loc[tail], chunk.loc[~tail]
+        yield from _blocks_to_samples(chunk, mid2idx, id2path, seen, late)
+    if carry is not None:
+        yield from _blocks_to_samples(carry, mid2idx, id2path, seen, late)
+
+def _blocks_to_samples(chunk, mid2idx, id2path, seen, late):
+    ids, blocks = chunk_to_blocks(chunk, mid2idx)
+    for img_id, block in zip(ids, blocks):
+        src_p = id2path.get(img_id)
+        if src_p is None:
+            continue
+        if img_id in seen:
+            late.setdefault(img_id, []).extend(block)
+            continue
+        seen.add(img_id)
+        yield Sample(src_p, img_id, block)
 
 def convert_split(split: str):
     print(f"\n→ Converting {split} (fast mode)")
@@ -41,70 +129,40 @@ def convert_split(split: str):
             img_id = p.name.split(".", 1)[0]
             id2path[img_id] = p
 
-    # Read classes.csv to map LabelName → normalized DisplayName
-    cls_df = pd.read_csv(classes_csv, header=None,
-                         names=["LabelName","DisplayName"], dtype=str)
-    mid2name = {
-        row.LabelName: normalize(row.DisplayName)
-        for _, row in cls_df.iterrows()
-    }
-
-    # Read only required columns (speeds up CSV parsing)
-    df = pd.read_csv(
-        lbl_csv,
-        usecols=["ImageID","LabelName","XMin","XMax","YMin","YMax"],
-        dtype={
-            "ImageID": str,
-            "LabelName": str,
-            "XMin": float,
-            "XMax": float,
-            "YMin": float,
-            "YMax": float,
-        },
-        low_memory=False
-    )
+    # Map LabelName → master index once, as a lookup Series
+    mid2idx = load_mid2idx(classes_csv)
 
-    # Prepare output directories
-    img_dst_dir = OUTPUT_ROOT / "images" / split
+    # Label files (and images) only for images with mapped annotations
     lbl_dst_dir = OUTPUT_ROOT / "labels" / split
-    img_dst_dir.mkdir(parents=True, exist_ok=True)
-    lbl_dst_dir.mkdir(parents=True, exist_ok=True)
-
-    # Process each image's detections
-    for img_id, group in tqdm(df.groupby("ImageID"), desc=split, unit="img"):
-        src_p = id2path.get(img_id)
-        if not src_p:
-            continue
+    late = {}
+    written = set()
+
+    def track_written(sample, status):
+        if status == "written":
+            written.add(sample.stem)
+
+    with open_manifest(OUTPUT_ROOT / ".manifests" / f"{split}.jsonl",
+                       mapping.version, INCREMENTAL) as manifest:
+        summary = convert_samples(iter_samples(lbl_csv, mid2idx, id2path, late), passthrough,
+                                  OUTPUT_ROOT / "images" / split, lbl_dst_dir,
+                                  workers=WORKERS, desc=split, link_mode=LINK_MODE,
+                                  manifest=manifest, ingest=INGEST,
+                                  on_result=track_written)
+    # rows of non-contiguous images, only for label files rewritten in this run
+    for img_id in late.keys() & written:
+        block = late[img_id]
+        with open(lbl_dst_dir / f"{img_id}.txt", "a") as f:
+            f.write("\n" + "\n".join(block))
+    print_summary(split, summary)
+    if INGEST is not None:
+        summary["ingest"].save(OUTPUT_ROOT, split, INGEST,
+                               summary["written"] + summary["unchanged"])
+
+def main():
+    for split in SPLITS:
+        convert_split(split)
+    print("\n✅ Conversion complete (fast)!")
 
-        dst_img = img_dst_dir / src_p.name
-        if not dst_img.exists():
-            try:
-                os.link(src_p, dst_img)
-            except OSError:
-                shutil.copyfile(src_p, dst_img)
-
-        # Build YOLO label lines
-        lines = []
-        for _, row in group.iterrows():
-            nm = mid2name.get(row.LabelName)
-            if nm is None:
-                continue
-            cls_idx = name2idx.get(nm)
-            if cls_idx is None:
-                continue
-            x0, x1 = row.XMin, row.XMax
-            y0, y1 = row.YMin, row.YMax
-            x_ctr  = (x0 + x1) / 2.0
-            y_ctr  = (y0 + y1) / 2.0
-            w      = x1 - x0
-            h      = y1 - y0
-            lines.append(f"{cls_idx} {x_ctr:.6f} {y_ctr:.6f} {w:.6f} {h:.6f}")
-
-        # Write label file only if there are annotations
-        if lines:
-            (lbl_dst_dir / f"{img_id}.txt").write_text("\n".join(lines))
 
 if __name__ == "__main__":
-    for split in SPLITS:
-        convert_split(split)
-    print("\n✅ Conversion complete (fast)!")
\ No newline at end of file
+    main()
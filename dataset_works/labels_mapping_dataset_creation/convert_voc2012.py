@@ -1,102 +1,146 @@
 #!/usr/bin/env python3
-import random
-import shutil
+# Pascal VOC-format → YOLO converter (VOC2012 and our own VOC-format sources)
+#
+# Lists the image directory once, parses the XML files in the conversion
+# engine's process pool and writes every sample as soon as it is parsed.
+# The train/val split is a hash of the file stem, so it is the same on
+# every run and needs no global shuffle.
+import hashlib
+import os
+from functools import partial
 from pathlib import Path
 import xml.etree.ElementTree as ET
 
+from class_tables import ClassMapping, normalize
+from conversion_engine import DEFAULT_WORKERS, Sample, convert_samples, print_summary, yolo_line
+from stage_manifest import open_manifest
+
 # === PATHs ===
-random.seed(42)  # for reproducibility
 VOC_ROOT     = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/data_sameer/voc2012")
 OUTPUT_ROOT  = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/converted_datasets/voc2012_split")
-MASTER_NAMES = Path("./master.names")  # adjust path as needed
+MAPPING_PTH  = Path("./class_mapping.npz")  # written by class_mapping.py
+
+# VOC-format sources to convert. "classes" is the class table in
+# class_mapping.npz, or "master" to match object names against master.names
+# directly (for sources without their own table).
+SOURCES = [
+    dict(name="voc2012", root=VOC_ROOT, out=OUTPUT_ROOT, classes="voc",
+         ann_dir="Annotations", img_dir="images"),
+    # dict(name="agco_field", root=Path("/media/.../agco_voc"),
+    #      out=Path("/media/.../converted_datasets/agco_field"), classes="master",
+    #      ann_dir="Annotations", img_dir="JPEGImages"),
+]
 
 SPLIT_RATIO = 0.8  # 80% train, 20% val
-
-def normalize(name: str) -> str:
-    return name.lower().strip().replace(" ", "_")
-
-def load_master(pth: Path):
-    return {
-        normalize(line): idx
-        for idx, line in enumerate(pth.read_text().splitlines())
-        if line.strip()
-    }
-
-# load mapping
-name2idx = load_master(MASTER_NAMES)
-
-# prepare output directories
-for split in ("train", "val"):
-    (OUTPUT_ROOT / "images" / split).mkdir(parents=True, exist_ok=True)
-    (OUTPUT_ROOT / "labels" / split).mkdir(parents=True, exist_ok=True)
-
-# collect all valid image-label pairs
-samples = []
-ann_dir = VOC_ROOT / "Annotations"
-img_dir = VOC_ROOT / "images"
-
-for xml_file in ann_dir.glob("*.xml"):
-    stem = xml_file.stem
-    # find corresponding image
-    img_file = None
-    for ext in (".jpg", ".jpeg", ".png"):
-        cand = img_dir / f"{stem}{ext}"
-        if cand.exists():
-            img_file = cand
-            break
-    if img_file is None:
-        continue
-
-    # parse xml
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-    size = root.find("size")
-    w = float(size.find("width").text)
-    h = float(size.find("height").text)
-
+IMG_EXTS    = (".jpg", ".jpeg", ".png")  # preference order when a stem has several
+WORKERS     = DEFAULT_WORKERS
+# hardlink | reflink | symlink | copy | auto (hardlink → reflink → copy)
+LINK_MODE   = "auto"
+# Only process inputs that changed since the last run (see stage_manifest.py)
+INCREMENTAL = True
+# Downsize images with a longer side above max_side on the way in (see ingest.py)
+INGEST      = None  # e.g. ingest.Ingest(max_side=1280, quality=90)
+
+# load mapping: VOC class name → master index
+mapping = ClassMapping(MAPPING_PTH)
+
+
+def split_of(stem: str) -> str:
+    """Deterministic train/val assignment from a hash of the stem."""
+    h = int.from_bytes(hashlib.blake2b(stem.encode(), digest_size=8).digest(), "big")
+    return "train" if h < SPLIT_RATIO * 2**64 else "val"
+
+
+def index_images(img_dir: Path):
+    """stem → image path from one listing, preferring IMG_EXTS order."""
+    rank = {ext: i for i, ext in enumerate(IMG_EXTS)}
+    best = {}
+    with os.scandir(img_dir) as it:
+        for e in it:
+            stem, ext = os.path.splitext(e.name)
+            r = rank.get(ext.lower())
+            if r is not None and (stem not in best or r < best[stem][0]):
+                best[stem] = (r, e.path)
+    return {stem: path for stem, (_, path) in best.items()}
+
+
+def xml_to_yolo(xml_file, classes="voc"):
+    """Pascal VOC annotation file → YOLO lines for the mapped classes."""
+    w = h = None
+    names, boxes = [], []
+    # incremental parse; each finished <object> is read and dropped
+    for _, elem in ET.iterparse(xml_file, events=("end",)):
+        if elem.tag == "size":
+            w = float(elem.findtext("width"))
+            h = float(elem.findtext("height"))
+        elif elem.tag == "object":
+            b = elem.find("bndbox")
+            names.append(normalize(elem.findtext("name")))
+            boxes.append([float(b.findtext(k)) for k in ("xmin", "ymin", "xmax", "ymax")])
+            elem.clear()
+
+    cls_idx = (mapping.master_lookup(names) if classes == "master"
+               else mapping.lookup(classes, names))
     yolo_lines = []
-    for obj in root.findall("object"):
-        cls = normalize(obj.find("name").text)
-        if cls not in name2idx:
+    for idx, (xmin, ymin, xmax, ymax) in zip(cls_idx.tolist(), boxes):
+        if idx < 0:
             continue
-        idx = name2idx[cls]
-        b = obj.find("bndbox")
-        xmin = float(b.find("xmin").text)
-        ymin = float(b.find("ymin").text)
-        xmax = float(b.find("xmax").text)
-        ymax = float(b.find("ymax").text)
         x_center = ((xmin + xmax) / 2) / w
         y_center = ((ymin + ymax) / 2) / h
         bw = (xmax - xmin) / w
         bh = (ymax - ymin) / h
-        yolo_lines.append(f"{idx} {x_center:.6f} {y_center:.6f} {bw:.6f} {bh:.6f}")
-
-    if not yolo_lines:
-        continue
-
-    samples.append((stem, img_file, yolo_lines))
-
-# shuffle and split
-random.shuffle(samples)
-n_train = int(len(samples) * SPLIT_RATIO)
-train_samples = samples[:n_train]
-val_samples   = samples[n_train:]
-
-# helper to write a batch
-def write_samples(batch, split):
-    img_out = OUTPUT_ROOT / "images" / split
-    lbl_out = OUTPUT_ROOT / "labels" / split
-    for stem, img_file, yolo_lines in batch:
-        # copy image
-        shutil.copy2(img_file, img_out / img_file.name)
-        # write label
-        (lbl_out / f"{stem}.txt").write_text("\n".join(yolo_lines))
-
-# write train and val
-write_samples(train_samples, "train")
-write_samples(val_samples,   "val")
-
-# prints
-print(f"Total images: {len(samples)}")
-print(f"Train: {len(train_samples)} images")
-print(f"Val:   {len(val_samples)} images")
+        yolo_lines.append(yolo_line(idx, x_center, y_center, bw, bh))
+    return yolo_lines
+
+
+def list_samples(ann_dir: Path, img_dir: Path):
+    """Samples for every XML with an image, tagged with their split."""
+    images = index_images(img_dir)
+    samples = []
+    with os.scandir(ann_dir) as it:
+        for e in it:
+            stem, ext = os.path.splitext(e.name)
+            if ext == ".xml" and stem in images:
+                samples.append(Sample(images[stem], stem, e.path, split_of(stem)))
+    return samples
+
+
+def convert_source(src):
+    print(f"\n→ Converting {src['name']}")
+    root, out = Path(src["root"]), Path(src["out"])  # str when set from pipeline.yaml
+    samples = list_samples(root / src["ann_dir"], root / src["img_dir"])
+    in_split = {"train": 0, "val": 0}  # written or already up to date
+
+    def count_split(sample, status):
+        if status in ("written", "unchanged"):
+            in_split[sample.split] += 1
+
+    # one manifest for both splits so a sample that moves between splits has
+    # its old outputs removed
+    with open_manifest(out / ".manifests" / "all.jsonl",
+                       mapping.version, INCREMENTAL) as manifest:
+        summary = convert_samples(samples, partial(xml_to_yolo, classes=src["classes"]),
+                                  out / "images", out / "labels",
+                                  workers=WORKERS, desc=f"Converting {src['name']}",
+                                  link_mode=LINK_MODE, manifest=manifest,
+                                  on_result=count_split, splits=("train", "val"),
+                                  ingest=INGEST)
+    print_summary(src["name"], summary)
+    if INGEST is not None:
+        summary["ingest"].save(out, "all", INGEST,
+                               summary["written"] + summary["unchanged"])
+
+    # prints
+    print(f"Total images: {in_split['train'] + in_split['val']} "
+          f"({summary['written']} written, {summary['unchanged']} unchanged)")
+    print(f"Train: {in_split['train']} images")
+    print(f"Val:   {in_split['val']} images")
+
+
+def main():
+    for src in SOURCES:
+        convert_source(src)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,16 @@
 #!/usr/bin/env python3
-import random
+# Static, copied subset of the merged dataset. Training no longer samples
+# from it (training/subset_sampler.py draws a fresh class-aware subset of the
+# full dataset every epoch), but its val split is still the fixed validation
+# set of training/merged_dataset.yaml. Also used for small fixed eval sets.
+import os
 from pathlib import Path
-import shutil
-from tqdm import tqdm
+
+import numpy as np
+
+from label_store import LabelStore, build_store, pairs_from_dirs
+from materialize import LinkStats
+from transfer import TransferStats, transfer
 
 # ───  PATHS ───────────────────────────────────────────
 # Original merged YOLO dataset
@@ -11,76 +19,168 @@ ORIG_ROOT    = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/m
 OUT_ROOT     = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/merged_dataset_quarter")
 # My unified class list
 MASTER_NAMES = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/script/master.names")
+# Packed labels of ORIG_ROOT (label_store.py); built here if missing
+STORE_ROOT   = ORIG_ROOT / "label_store"
 # ────────────────────────────────────────────────────────────────
 
-SPLITS       = ["train", "val"]
-SAMPLE_RATIO = 0.25  # keep 25% of images, plus extras to cover all classes
-
-# Load class names
-names = [l.strip() for l in MASTER_NAMES.read_text().splitlines() if l.strip()]
-nc = len(names)
-print(f"Found {nc} classes in {MASTER_NAMES}\n")
-
-for split in SPLITS:
-    print(f"→ Processing split: {split}")
-    img_src = ORIG_ROOT / "images" / split
-    lbl_src = ORIG_ROOT / "labels" / split
-    img_dst = OUT_ROOT / "images" / split
-    lbl_dst = OUT_ROOT / "labels" / split
-    img_dst.mkdir(parents=True, exist_ok=True)
-    lbl_dst.mkdir(parents=True, exist_ok=True)
-
-    # 1) Gather all images
-    all_imgs = [p for p in img_src.iterdir() if p.is_file()]
-    N = len(all_imgs)
-    k = int(N * SAMPLE_RATIO)
-    print(f"  Total images: {N}, initial sample size: {k}")
-
-    # 2) Randomly pick 25%
-    sampled = set(random.sample(all_imgs, k))
-
-    # 3) Map each image → its set of class‐indices
-    img2cls = {}
-    for img in tqdm(all_imgs, desc="  Scanning labels", unit="img"):
-        cls_set = set()
-        lbl = lbl_src / f"{img.stem}.txt"
-        if lbl.exists():
-            for line in lbl.read_text().splitlines():
-                if not line: continue
-                cls_set.add(int(line.split()[0]))
-        img2cls[img] = cls_set
-
-    # 4) Compute which classes are present in the sample
-    present = set().union(*(img2cls[i] for i in sampled))
-    missing = set(range(nc)) - present
-    print(f"  Classes covered: {len(present)} / {nc}, missing {len(missing)}")
-
-    # 5) For each missing class, add one image that contains it
-    for cls in missing:
-        for img, cls_set in img2cls.items():
-            if cls in cls_set and img not in sampled:
-                sampled.add(img)
-                break
-
-    # 6) Final coverage
-    present_final = set().union(*(img2cls[i] for i in sampled))
-    print(f"  Final coverage: {len(present_final)} / {nc} classes")
-    print(f"  Final sample size: {len(sampled)} images")
-
-    # 7) Copy files
-    copied = 0
-    for img in tqdm(sampled, desc="  Copying files", unit="img"):
-        shutil.copy2(img, img_dst / img.name)
-        lbl = lbl_src / f"{img.stem}.txt"
-        if lbl.exists():
-            shutil.copy2(lbl, lbl_dst / lbl.name)
-        copied += 1
-    print(f"  Split '{split}': copied {copied} images + labels\n")
-
-print("✅ Subsampling complete!")
-
-
-# Output:
+SPLITS        = ["train", "val"]
+SAMPLE_RATIO  = 0.25  # total budget as a fraction of the split
+BUDGET        = None  # or a fixed number of images (overrides SAMPLE_RATIO)
+MIN_PER_CLASS = 10    # at least this many images per class (when available)
+SEED          = 0
+# hardlink | reflink | symlink | copy | auto (hardlink → reflink → copy)
+LINK_MODE     = "auto"
+MAX_CANDIDATES = 50_000  # images scored per class during the cover phase
+
+
+def inverted_index(pair_img, pair_cls, nc):
+    """class → images as CSR: images of class c are cls_imgs[cls_off[c]:cls_off[c+1]]."""
+    order = np.argsort(pair_cls, kind="stable")
+    cls_off = np.zeros(nc + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pair_cls, minlength=nc), out=cls_off[1:])
+    return pair_img[order], cls_off
+
+
+def gather_ranges(starts, ends):
+    """Concatenated aranges [s, e) for every pair, without a Python loop."""
+    lens = ends - starts
+    idx = np.repeat(ends - np.cumsum(lens), lens) + np.arange(lens.sum())
+    return idx, lens
+
+
+def select_subset(pair_img, pair_cls, n_images, nc, budget, min_per_class, seed):
+    """Choose a subset of images: greedy cover of min_per_class, then random fill.
+
+    pair_img / pair_cls are the unique (image, class) pairs sorted by image.
+    Classes are covered rarest first; for each class still short of its
+    target, the candidates that also cover the most other still-short classes
+    are taken. The remaining budget is filled uniformly at random. Returns a
+    bool mask over images.
+    """
+    rng = np.random.default_rng(seed)
+    cls_imgs, cls_off = inverted_index(pair_img, pair_cls, nc)
+    img_off = np.zeros(n_images + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pair_img, minlength=n_images), out=img_off[1:])
+
+    n_per_class = np.diff(cls_off)
+    deficit = np.minimum(n_per_class, min_per_class)
+    selected = np.zeros(n_images, dtype=bool)
+
+    for c in np.argsort(n_per_class, kind="stable"):
+        if deficit[c] <= 0:
+            continue
+        cands = cls_imgs[cls_off[c]:cls_off[c + 1]]
+        cands = cands[~selected[cands]]
+        if len(cands) > MAX_CANDIDATES:
+            cands = rng.choice(cands, MAX_CANDIDATES, replace=False)
+        else:
+            cands = rng.permutation(cands)  # random tie-break
+        # gain = number of still-short classes the candidate would help
+        idx, lens = gather_ranges(img_off[cands], img_off[cands + 1])
+        short = (deficit[pair_cls[idx]] > 0).astype(np.int64)
+        gain = np.add.reduceat(short, np.r_[0, np.cumsum(lens)[:-1]]) if len(idx) else np.zeros(0)
+        take = cands[np.argsort(-gain, kind="stable")[:deficit[c]]]
+        selected[take] = True
+        idx, _ = gather_ranges(img_off[take], img_off[take + 1])
+        deficit -= np.bincount(pair_cls[idx], minlength=nc)
+
+    remaining = budget - int(selected.sum())
+    if remaining > 0:
+        pool = np.flatnonzero(~selected)
+        selected[rng.choice(pool, min(remaining, len(pool)), replace=False)] = True
+    return selected
+
+
+def dir_fingerprint(d: Path):
+    """Entry count and mtime of a directory; both change when files are added, removed or replaced."""
+    with os.scandir(d) as it:
+        entries = sum(1 for _ in it)
+    return {"entries": entries, "mtime_ns": d.stat().st_mtime_ns}
+
+
+def load_or_build_store(split):
+    """Packed labels of a split, rebuilt when the merged dataset changed since they were built."""
+    store_dir = STORE_ROOT / split
+    img_dir = ORIG_ROOT / "images" / split
+    lbl_dir = ORIG_ROOT / "labels" / split
+    source = {"images": dir_fingerprint(img_dir), "labels": dir_fingerprint(lbl_dir)}
+    if (store_dir / "meta.json").exists():
+        store = LabelStore(store_dir)
+        if store.meta.get("source") == source:
+            return store
+        print(f"  {ORIG_ROOT} changed since {store_dir} was built, rebuilding")
+    names, label_paths = pairs_from_dirs(img_dir, lbl_dir)
+    return build_store(names, label_paths, store_dir,
+                       meta={"images_dir": str(img_dir), "labels_dir": str(lbl_dir), "source": source})
+
+
+if __name__ == "__main__":
+    # Load class names
+    names = [l.strip() for l in MASTER_NAMES.read_text().splitlines() if l.strip()]
+    nc = len(names)
+    print(f"Found {nc} classes in {MASTER_NAMES}\n")
+
+    for split in SPLITS:
+        print(f"→ Processing split: {split}")
+        img_src = ORIG_ROOT / "images" / split
+        lbl_src = ORIG_ROOT / "labels" / split
+        img_dst = OUT_ROOT / "images" / split
+        lbl_dst = OUT_ROOT / "labels" / split
+        img_dst.mkdir(parents=True, exist_ok=True)
+        lbl_dst.mkdir(parents=True, exist_ok=True)
+
+        # 1) Packed labels → unique (image, class) pairs
+        store = load_or_build_store(split)
+        N = len(store)
+        pair_img, pair_cls = store.image_class_pairs()
+        valid = (pair_cls >= 0) & (pair_cls < nc)
+        if not valid.all():
+            bad = np.unique(pair_cls[~valid])
+            print(f"  ⚠️  {np.count_nonzero(~valid)} (image, class) pairs with class ids outside "
+                  f"0..{nc - 1} ignored, e.g. {bad[:5].tolist()} (see dataset_integrity.py)")
+            pair_img, pair_cls = pair_img[valid], pair_cls[valid]
+        k = BUDGET if BUDGET is not None else int(N * SAMPLE_RATIO)
+        available = np.bincount(pair_cls, minlength=nc)
+        print(f"  Total images: {N}, budget: {k}, classes present in split: "
+              f"{np.count_nonzero(available)} / {nc}")
+
+        # 2) Greedy class cover + seeded random fill
+        selected = select_subset(pair_img, pair_cls, N, nc, k, MIN_PER_CLASS, SEED)
+
+        # 3) Coverage report
+        per_class = np.bincount(pair_cls[selected[pair_img]], minlength=nc)
+        target = np.minimum(available, MIN_PER_CLASS)
+        print(f"  Final coverage: {np.count_nonzero(per_class)} / {nc} classes, "
+              f"{np.count_nonzero((per_class >= target) & (available > 0))} at target "
+              f"min({MIN_PER_CLASS}, available)")
+        print(f"  Final sample size: {int(selected.sum())} images"
+              + (" (cover exceeded budget)" if selected.sum() > k else ""))
+
+        # 4) Copy files (and an image list usable as a data YAML entry)
+        chosen = np.flatnonzero(selected)
+        (OUT_ROOT / f"{split}.txt").write_text(
+            "".join(f"{img_dst / store.name(i)}\n" for i in chosen))
+        jobs = []
+        for i in chosen:
+            img = img_src / store.name(i)
+            jobs.append((img, img_dst / img.name))
+            if store.has_label[i]:
+                lbl = lbl_src / f"{img.stem}.txt"
+                jobs.append((lbl, lbl_dst / lbl.name))
+        # copies (e.g. OUT_ROOT on another disk) are read in on-disk order, see transfer.py
+        link_stats = LinkStats()
+        transfer_stats = TransferStats()
+        for result in transfer(jobs, LINK_MODE, stats=transfer_stats, desc="  Copying files"):
+            if isinstance(result, Exception):
+                raise result
+            link_stats.add(*result)
+        print(f"  Split '{split}': copied {len(chosen)} images + labels, {link_stats.report()}")
+        print(f"  Transfer: {transfer_stats.report()}\n")
+
+    print("✅ Subsampling complete!")
+
+
+# Output (previous random-sample version):
 
 #   Scanning labels: 100%|████████████████████████████████████| 2276114/2276114 [13:34<00:00, 2795.83img/s]
 #   Classes covered: 722 / 801, missing 79
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# Integrity check (and optional fix-up) for any YOLO dataset root
+#
+# Per split, images/ and labels/ are listed once and paired by stem with set
+# arithmetic. Label files are then read in the conversion engine's process
+# pool and every row is validated in vectorized batches:
+#
+#   malformed     not exactly 5 numeric columns
+#   bad_class     class id not an integer in [0, nc) (nc from master.names)
+#   out_of_range  box reaches outside [0, 1]
+#   zero_area     w or h <= 0 (after clipping)
+#   duplicate     same class and coordinates as an earlier row of the file
+#
+# --fix clips out-of-range boxes and drops the other bad rows; the workers
+# write the new file next to the old one and os.replace() it, so a label that
+# is hardlinked into another dataset is never modified in place. Orphan labels
+# (no image) and images without a label (background for YOLO, so kept by
+# default) can be deleted as well. The counts, and a few example files per
+# issue, go to <root>/integrity_report.json:
+#
+#   python dataset_integrity.py /media/.../merged_dataset --fix --delete-orphan-labels
+import argparse
+import json
+import os
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from conversion_engine import DEFAULT_WORKERS, run_pool
+from label_store import IMG_EXTS, read_label_rows
+
+MASTER_NAMES = Path("./master.names")
+SPLITS       = ["train", "val"]
+WORKERS      = DEFAULT_WORKERS
+BATCH_SIZE   = 2048  # label files per worker task
+REPORT_NAME  = "integrity_report.json"
+N_EXAMPLES   = 20    # example file names per issue in the report
+EPS          = 1e-6  # slack for the 6-decimal rounding of the .txt format
+
+ISSUES = ("unreadable", "malformed", "bad_class", "out_of_range", "zero_area", "duplicate")
+
+
+def pair_split(img_dir: Path, lbl_dir: Path):
+    """One listing per directory → (stem → image names, label stems)."""
+    images = {}
+    if img_dir.exists():
+        with os.scandir(img_dir) as it:
+            for e in it:
+                stem, ext = os.path.splitext(e.name)
+                if not e.name.startswith(".") and ext.lower() in IMG_EXTS:
+                    images.setdefault(stem, []).append(e.name)
+    labels = set()
+    if lbl_dir.exists():
+        with os.scandir(lbl_dir) as it:
+            labels = {e.name[:-4] for e in it if e.name.endswith(".txt") and not e.name.startswith(".")}
+    return images, labels
+
+
+def validate_rows(rows, file_idx, nc):
+    """Per-row issue masks for rows (n, 5) of several files, plus the clipped xywh.
+
+    file_idx gives the file of every row, sorted (rows of a file are contiguous).
+    """
+    cls, xc, yc, w, h = rows.T
+    bad_class = (cls != np.round(cls)) | (cls < 0) | (cls >= nc)
+    x1, y1, x2, y2 = xc - w / 2, yc - h / 2, xc + w / 2, yc + h / 2
+    out_of_range = (x1 < -EPS) | (y1 < -EPS) | (x2 > 1 + EPS) | (y2 > 1 + EPS)
+    cx1, cy1 = np.clip(x1, 0, 1), np.clip(y1, 0, 1)
+    cx2, cy2 = np.clip(x2, 0, 1), np.clip(y2, 0, 1)
+    clipped = np.stack([(cx1 + cx2) / 2, (cy1 + cy2) / 2, cx2 - cx1, cy2 - cy1], axis=1)
+    clipped = np.where(out_of_range[:, None], clipped, rows[:, 1:])
+    zero_area = (np.round(clipped[:, 2], 6) <= 0) | (np.round(clipped[:, 3], 6) <= 0)
+
+    # duplicates: equal (file, row) at 6 decimals, the first occurrence is kept
+    key = np.column_stack([file_idx, np.round(rows, 6)])
+    duplicate = np.zeros(len(rows), dtype=bool)
+    if len(rows):
+        order = np.lexsort(key.T[::-1])
+        same = (key[order[1:]] == key[order[:-1]]).all(axis=1)
+        duplicate[order[1:][same]] = True
+    return {"bad_class": bad_class, "out_of_range": out_of_range,
+            "zero_area": zero_area & ~bad_class, "duplicate": duplicate & ~bad_class}, clipped
+
+
+def _write_label(path, rows):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write("".join(f"{int(c)} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n" for c, x, y, w, h in rows))
+    os.replace(tmp, path)  # new inode: hardlinked copies keep their content
+
+
+def _check_batch(label_paths, nc, fix):
+    """Issue counts (n_files, len(ISSUES)), row counts and whether each file was rewritten."""
+    counts = np.zeros((len(label_paths), len(ISSUES)), dtype=np.int64)
+    n_rows = np.zeros(len(label_paths), dtype=np.int64)
+    parts, idx = [], []
+    for i, p in enumerate(label_paths):
+        try:
+            with open(p, "r") as f:
+                rows, counts[i, ISSUES.index("malformed")] = read_label_rows(f.read())
+        except (OSError, UnicodeDecodeError):
+            counts[i, 0] = 1
+            continue
+        n_rows[i] = len(rows)
+        parts.append(rows)
+        idx.append(np.full(len(rows), i, dtype=np.int64))
+    rows = np.concatenate(parts) if parts else np.empty((0, 5))
+    file_idx = np.concatenate(idx) if idx else np.empty(0, dtype=np.int64)
+
+    masks, clipped = validate_rows(rows, file_idx, nc)
+    for name, m in masks.items():
+        counts[:, ISSUES.index(name)] = np.bincount(file_idx[m], minlength=len(label_paths))
+
+    fixed = np.zeros(len(label_paths), dtype=bool)
+    if fix:
+        keep = ~(masks["bad_class"] | masks["zero_area"] | masks["duplicate"])
+        new = np.column_stack([rows[:, 0], clipped])
+        needs = counts[:, 1:].any(axis=1)  # unreadable files are left alone
+        bounds = np.searchsorted(file_idx, np.arange(len(label_paths) + 1))
+        for i in np.flatnonzero(needs):
+            a, b = bounds[i], bounds[i + 1]
+            _write_label(label_paths[i], new[a:b][keep[a:b]])
+            fixed[i] = True
+    return counts, n_rows, fixed
+
+
+def _unlink_batch(paths):
+    for p in paths:
+        try:
+            os.unlink(p)
+        except FileNotFoundError:
+            pass
+    return len(paths)
+
+
+def _examples(names, mask):
+    return [names[i] for i in np.flatnonzero(mask)[:N_EXAMPLES]]
+
+
+def check_split(root: Path, split, nc, fix=False, delete_orphan_labels=False,
+                delete_unlabeled_images=False, workers=WORKERS):
+    """Report dict for one split (paths, label rows, optional fixes)."""
+    img_dir, lbl_dir = root / "images" / split, root / "labels" / split
+    images, labels = pair_split(img_dir, lbl_dir)
+    unlabeled = sorted(images.keys() - labels)
+    orphans = sorted(labels - images.keys())
+    checked = sorted(labels & images.keys())
+    report = {"images": sum(len(v) for v in images.values()), "labels": len(labels),
+              "images_without_label": len(unlabeled), "labels_without_image": len(orphans),
+              "same_stem_images": sum(len(v) > 1 for v in images.values())}
+
+    label_paths = [str(lbl_dir / f"{s}.txt") for s in checked]
+    counts = np.zeros((len(checked), len(ISSUES)), dtype=np.int64)
+    n_rows = np.zeros(len(checked), dtype=np.int64)
+    fixed = np.zeros(len(checked), dtype=bool)
+    starts = range(0, len(label_paths), BATCH_SIZE)
+    results = run_pool(partial(_check_batch, nc=nc, fix=fix),
+                       (label_paths[a:a + BATCH_SIZE] for a in starts), workers, chunksize=1)
+    for a, (_, res, err) in tqdm(zip(starts, results), total=len(starts),
+                                 desc=f"  {split} labels", unit="batch"):
+        if err is not None:
+            raise RuntimeError(f"label check failed:\n{err}")
+        counts[a:a + BATCH_SIZE], n_rows[a:a + BATCH_SIZE], fixed[a:a + BATCH_SIZE] = res
+
+    report["rows"] = int(n_rows.sum())
+    report["files_with_issues"] = int(counts.any(axis=1).sum())
+    report.update({name: int(counts[:, j].sum()) for j, name in enumerate(ISSUES)})
+    report["fixed_files"] = int(fixed.sum())
+
+    # deletions through the same pool, in batches
+    doomed = []
+    if delete_orphan_labels:
+        doomed += [str(lbl_dir / f"{s}.txt") for s in orphans]
+    if delete_unlabeled_images:
+        doomed += [str(img_dir / n) for s in unlabeled for n in images[s]]
+    batches = [doomed[a:a + BATCH_SIZE] for a in range(0, len(doomed), BATCH_SIZE)]
+    report["deleted_files"] = sum(res for _, res, err in run_pool(_unlink_batch, batches, workers, chunksize=1)
+                                  if err is None)
+
+    report["examples"] = {name: _examples(checked, counts[:, j] > 0) for j, name in enumerate(ISSUES)}
+    report["examples"]["labels_without_image"] = orphans[:N_EXAMPLES]
+    report["examples"]["images_without_label"] = unlabeled[:N_EXAMPLES]
+    return report
+
+
+def check_dataset(root, splits=SPLITS, names_file=MASTER_NAMES, fix=False,
+                  delete_orphan_labels=False, delete_unlabeled_images=False,
+                  workers=WORKERS, report_path=None):
+    """Check every split of a YOLO dataset root and write the JSON report."""
+    root = Path(root)
+    nc = len([l for l in Path(names_file).read_text().splitlines() if l.strip()])
+    report = {"root": str(root), "nc": nc, "fix": fix,
+              "delete_orphan_labels": delete_orphan_labels,
+              "delete_unlabeled_images": delete_unlabeled_images, "splits": {}}
+    for split in splits:
+        report["splits"][split] = check_split(root, split, nc, fix, delete_orphan_labels,
+                                              delete_unlabeled_images, workers)
+    path = Path(report_path) if report_path else root / REPORT_NAME
+    path.write_text(json.dumps(report, indent=2))
+    return report, path
+
+
+def print_report(report):
+    for split, r in report["splits"].items():
+        print(f"{split}: {r['images']} images, {r['labels']} labels, {r['rows']} boxes")
+        print(f"  unpaired: {r['images_without_label']} images without label, "
+              f"{r['labels_without_image']} labels without image"
+              + (f", {r['deleted_files']} files deleted" if r["deleted_files"] else ""))
+        issues = ", ".join(f"{name} {r[name]}" for name in ISSUES if r[name])
+        print(f"  label issues: {issues or 'none'} in {r['files_with_issues']} files"
+              + (f", {r['fixed_files']} rewritten" if r["fixed_files"] else ""))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Check (and fix) the images/labels of a YOLO dataset")
+    ap.add_argument("root", type=Path, help="dataset root with images/<split> and labels/<split>")
+    ap.add_argument("--splits", nargs="+", default=SPLITS)
+    ap.add_argument("--names", type=Path, default=MASTER_NAMES, help="class names file (nc)")
+    ap.add_argument("--fix", action="store_true", help="clip boxes and drop invalid/duplicate rows")
+    ap.add_argument("--delete-orphan-labels", action="store_true")
+    ap.add_argument("--delete-unlabeled-images", action="store_true")
+    ap.add_argument("--workers", type=int, default=WORKERS)
+    ap.add_argument("--report", type=Path, default=None, help=f"default <root>/{REPORT_NAME}")
+    args = ap.parse_args()
+
+    report, path = check_dataset(args.root, args.splits, args.names, args.fix,
+                                 args.delete_orphan_labels, args.delete_unlabeled_images,
+                                 args.workers, args.report)
+    print_report(report)
+    print(f"✅ Report written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# Dataset statistics for a merged YOLO dataset, cached in Parquet
+#
+# Label files are parsed in the conversion engine's process pool and the
+# results are kept next to the dataset,
+#
+#   <root>/.stats/files.parquet   split, name, source, mtime_ns, size, n_boxes
+#   <root>/.stats/boxes.parquet   cls, w, h of every box, in files.parquet order
+#
+# On a rerun only label files whose mtime or size changed are parsed again
+# (removed files are dropped), so the plots need one directory listing per
+# split instead of reading 2.4M files. n_boxes is -1 for unparseable files.
+#
+# The source dataset of a file is the <dataset>_ prefix merging_all.py
+# gives it.
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from conversion_engine import DEFAULT_WORKERS, run_pool
+from label_store import IMG_EXTS, parse_label_text
+
+# === PATHS ===
+DATASET_ROOT = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/merged_dataset")
+MASTER_NAMES = Path("./master.names")
+SPLITS       = ["train", "val"]
+# converted dataset names = merge prefixes; the longest match wins
+SOURCES      = ("coco", "crowdHuman", "Objects365",
+                "open-images-v6", "voc2012_split")
+WORKERS      = DEFAULT_WORKERS
+BATCH_SIZE   = 2048  # label files per worker task
+STATS_DIR    = ".stats"
+
+SIZE_BINS   = np.linspace(0, 1, 51)     # sqrt(w * h), normalized
+ASPECT_BINS = np.linspace(-4, 4, 33)    # log2(w / h)
+PER_IMAGE_MAX = 100                     # boxes-per-image histogram, last bin is ">= max"
+
+
+def source_of(name):
+    for src in sorted(SOURCES, key=len, reverse=True):
+        if name.startswith(src + "_"):
+            return src
+    return "other"
+
+
+def _stats_batch(label_paths):
+    n_boxes = np.full(len(label_paths), -1, dtype=np.int64)
+    parts = []
+    for i, p in enumerate(label_paths):
+        try:
+            with open(p, "r") as f:
+                rows = parse_label_text(f.read())
+        except (OSError, ValueError):
+            continue
+        n_boxes[i] = len(rows)
+        parts.append(rows)
+    rows = np.concatenate(parts) if parts else np.empty((0, 5))
+    return n_boxes, rows[:, 0].astype(np.int16), rows[:, 3].astype(np.float32), rows[:, 4].astype(np.float32)
+
+
+def list_labels(lbl_dir: Path):
+    """names, mtime_ns, size of the .txt files of one directory (one listing)."""
+    names, mtime, size = [], [], []
+    if lbl_dir.exists():
+        with os.scandir(lbl_dir) as it:
+            for e in it:
+                if e.name.endswith(".txt") and not e.name.startswith("."):
+                    st = e.stat()
+                    names.append(e.name)
+                    mtime.append(st.st_mtime_ns)
+                    size.append(st.st_size)
+    return names, np.array(mtime, dtype=np.int64), np.array(size, dtype=np.int64)
+
+
+def count_images(img_dir: Path):
+    """Image count per source dataset for one split."""
+    counts = {}
+    if img_dir.exists():
+        with os.scandir(img_dir) as it:
+            for e in it:
+                if os.path.splitext(e.name)[1].lower() in IMG_EXTS:
+                    src = source_of(e.name)
+                    counts[src] = counts.get(src, 0) + 1
+    return counts
+
+
+def _empty_cache():
+    files = pd.DataFrame({"split": pd.Series(dtype=str), "name": pd.Series(dtype=str),
+                          "source": pd.Series(dtype=str),
+                          "mtime_ns": pd.Series(dtype=np.int64), "size": pd.Series(dtype=np.int64),
+                          "n_boxes": pd.Series(dtype=np.int64)})
+    boxes = pd.DataFrame({"cls": pd.Series(dtype=np.int16), "w": pd.Series(dtype=np.float32),
+                          "h": pd.Series(dtype=np.float32)})
+    return files, boxes
+
+
+def _load_cache(stats_dir: Path):
+    try:
+        files = pd.read_parquet(stats_dir / "files.parquet")
+        boxes = pd.read_parquet(stats_dir / "boxes.parquet")
+    except (FileNotFoundError, OSError):
+        return _empty_cache()
+    # the two files are replaced one after the other; an interrupted save
+    # leaves boxes that no longer line up with the per-file box counts
+    if len(boxes) != files["n_boxes"].clip(lower=0).sum():
+        print(f"⚠️  {stats_dir}: boxes.parquet does not match files.parquet, rebuilding")
+        return _empty_cache()
+    return files, boxes
+
+
+def _save_cache(stats_dir: Path, files, boxes):
+    stats_dir.mkdir(parents=True, exist_ok=True)
+    for name, df in (("boxes.parquet", boxes), ("files.parquet", files)):
+        tmp = stats_dir / f".{name}.tmp"
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, stats_dir / name)
+
+
+def update(root: Path = DATASET_ROOT, splits=SPLITS, workers=WORKERS):
+    """Bring the Parquet cache up to date; returns (files, boxes, image counts)."""
+    root = Path(root)
+    stats_dir = root / STATS_DIR
+    files, boxes = _load_cache(stats_dir)
+    box_file = np.repeat(np.arange(len(files)), np.maximum(files["n_boxes"].to_numpy(), 0))
+    keep = np.ones(len(files), dtype=bool)
+    new_files, new_boxes, images = [], [], {}
+
+    for split in splits:
+        images[split] = count_images(root / "images" / split)
+        lbl_dir = root / "labels" / split
+        names, mtime, size = list_labels(lbl_dir)
+        cur = pd.DataFrame({"name": names, "mtime_ns": mtime, "size": size})
+
+        in_split = (files["split"] == split).to_numpy()
+        old = files[in_split].reset_index()  # "index" = row in files
+        both = cur.merge(old, on="name", how="left", suffixes=("", "_old"))
+        same = ((both["mtime_ns"] == both["mtime_ns_old"]) & (both["size"] == both["size_old"])).to_numpy()
+        # rows to drop: changed and removed files of this split
+        unchanged_rows = both.loc[same, "index"].to_numpy().astype(np.int64)
+        drop = in_split.copy()
+        drop[unchanged_rows] = False
+        keep &= ~drop
+
+        todo = both.loc[~same, ["name", "mtime_ns", "size"]].reset_index(drop=True)
+        removed = int(in_split.sum()) - int(both["index"].notna().sum())
+        print(f"{split}: {len(cur)} label files, {len(todo)} new/changed, {removed} removed")
+        if not len(todo):
+            continue
+        paths = [str(lbl_dir / n) for n in todo["name"]]
+        batches = [paths[i:i + BATCH_SIZE] for i in range(0, len(paths), BATCH_SIZE)]
+        n_boxes = []
+        for _, res, err in tqdm(run_pool(_stats_batch, batches, workers, chunksize=1),
+                                total=len(batches), desc=f"  Parsing {split}", unit="batch"):
+            if err is not None:
+                raise RuntimeError(err)
+            n_boxes.append(res[0])
+            new_boxes.append(pd.DataFrame({"cls": res[1], "w": res[2], "h": res[3]}))
+        todo["split"] = split
+        todo["source"] = [source_of(n) for n in todo["name"]]
+        todo["n_boxes"] = np.concatenate(n_boxes)
+        new_files.append(todo[files.columns])
+
+    files = pd.concat([files[keep]] + new_files, ignore_index=True)
+    boxes = pd.concat([boxes[keep[box_file]]] + new_boxes, ignore_index=True)
+    _save_cache(stats_dir, files, boxes)
+    return files, boxes, images
+
+
+def summarize(files, boxes, images, names):
+    """All statistics as plain DataFrames / arrays (cheap, from the cache)."""
+    nc = len(names)
+    n_boxes = np.maximum(files["n_boxes"].to_numpy(), 0)
+    box_file = np.repeat(np.arange(len(files)), n_boxes)
+    cls = boxes["cls"].to_numpy().astype(np.int64)
+    valid = (cls >= 0) & (cls < nc)
+
+    # per-class box counts and the number of label files containing the class
+    pair = np.unique(box_file[valid].astype(np.int64) * nc + cls[valid])
+    classes = pd.DataFrame({"class": names,
+                            "count": np.bincount(cls[valid], minlength=nc),
+                            "images": np.bincount(pair % nc, minlength=nc)})
+
+    box_src = files["source"].to_numpy()[box_file]
+    src_boxes = pd.crosstab(box_src[valid], cls[valid]) if valid.any() else pd.DataFrame()
+    sources = pd.DataFrame({
+        "images": pd.Series({s: sum(c.get(s, 0) for c in images.values())
+                             for s in sorted({s for c in images.values() for s in c})}, dtype=np.int64),
+        "label_files": files.groupby("source").size(),
+        "boxes": files.groupby("source")["n_boxes"].apply(lambda x: int(x.clip(lower=0).sum())),
+        "classes": (src_boxes > 0).sum(axis=1) if len(src_boxes) else pd.Series(dtype=np.int64),
+    }).fillna(0).astype(np.int64)
+
+    w, h = boxes["w"].to_numpy(), boxes["h"].to_numpy()
+    ok = (w > 0) & (h > 0)
+    per_image = np.bincount(np.minimum(n_boxes, PER_IMAGE_MAX), minlength=PER_IMAGE_MAX + 1)
+    return {
+        "classes": classes,
+        "sources": sources,
+        "images_per_split": {s: int(sum(c.values())) for s, c in images.items()},
+        "label_files": int(len(files)),
+        "unparseable": int((files["n_boxes"] < 0).sum()),
+        "boxes": int(n_boxes.sum()),
+        "invalid_class": int((~valid).sum()),
+        "size_hist": np.histogram(np.sqrt(w[ok] * h[ok]), SIZE_BINS)[0],
+        "aspect_hist": np.histogram(np.log2(w[ok] / h[ok]), ASPECT_BINS)[0],
+        "boxes_per_image": per_image,
+        "boxes_per_image_by_source": {s: np.bincount(np.minimum(g.clip(lower=0).to_numpy(), PER_IMAGE_MAX),
+                                                     minlength=PER_IMAGE_MAX + 1)
+                                      for s, g in files.groupby("source")["n_boxes"]},
+    }
+
+
+def plot(stats, out_dir=None, top=20):
+    """Top-classes bar, person-vs-others pie, size/aspect and boxes-per-image plots."""
+    import matplotlib.pyplot as plt
+
+    df = stats["classes"].sort_values("count", ascending=False)
+    figs = {}
+    fig, ax = plt.subplots(figsize=(12, 6))
+    ax.bar(df["class"][:top], df["count"][:top])
+    ax.tick_params(axis="x", rotation=90)
+    ax.set_title(f"Top {top} Classes by Annotation Count")
+    figs["top_classes"] = fig
+
+    person = int(df.loc[df["class"] == "person", "count"].sum())
+    fig, ax = plt.subplots(figsize=(6, 6))
+    ax.pie([person, stats["boxes"] - person], labels=["person", "others"],
+           autopct="%1.1f%%", startangle=90)
+    ax.set_title("Person vs Others Distribution")
+    figs["person_vs_others"] = fig
+
+    fig, axes = plt.subplots(1, 2, figsize=(12, 4))
+    axes[0].stairs(stats["size_hist"], SIZE_BINS)
+    axes[0].set_xlabel("sqrt(w·h), normalized")
+    axes[1].stairs(stats["aspect_hist"], ASPECT_BINS)
+    axes[1].set_xlabel("log2(w / h)")
+    for a in axes:
+        a.set_ylabel("boxes")
+    fig.suptitle("Box size and aspect ratio")
+    figs["box_shapes"] = fig
+
+    # boxes-per-image distribution per source, as box plots from the histograms
+    by_src = stats["boxes_per_image_by_source"]
+    fig, ax = plt.subplots(figsize=(10, 4))
+    ax.bxp([_hist_box(h, s) for s, h in by_src.items()], showfliers=False)
+    ax.set_ylabel(f"boxes per image (capped at {PER_IMAGE_MAX})")
+    ax.set_title("Boxes per Image by Source")
+    figs["boxes_per_image"] = fig
+
+    if out_dir is not None:
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+        for name, fig in figs.items():
+            fig.tight_layout()
+            fig.savefig(Path(out_dir) / f"{name}.png")
+    return figs
+
+
+def _hist_box(hist, label):
+    # quartiles / whiskers (5th-95th percentile) of an integer histogram
+    cdf = np.cumsum(hist) / max(hist.sum(), 1)
+    q = [int(np.searchsorted(cdf, p)) for p in (0.05, 0.25, 0.5, 0.75, 0.95)]
+    return {"label": label, "whislo": q[0], "q1": q[1], "med": q[2], "q3": q[3], "whishi": q[4]}
+
+
+def print_summary(stats, top=40):
+    print("\n=== Dataset Summary ===")
+    print(f"Total images        : {sum(stats['images_per_split'].values())}")
+    print(f"Total label files   : {stats['label_files']}"
+          + (f"  ({stats['unparseable']} unparseable)" if stats["unparseable"] else ""))
+    print(f"Total annotations   : {stats['boxes']}"
+          + (f"  ({stats['invalid_class']} with a class id outside master.names)"
+             if stats["invalid_class"] else ""))
+    print("\n=== Images per split ===")
+    for split, n in stats["images_per_split"].items():
+        print(f"  {split}: {n}")
+    print("\n=== Per source dataset ===")
+    print(stats["sources"].to_string())
+    print(f"\n=== Top {top} Classes by Annotation Count ===")
+    df = stats["classes"].sort_values("count", ascending=False)
+    print(df.head(top).to_string(index=False))
+
+
+def main(root=DATASET_ROOT):
+    names = [ln.strip() for ln in MASTER_NAMES.read_text().splitlines() if ln.strip()]
+    stats = summarize(*update(root), names)
+    print_summary(stats)
+    out = Path(root) / STATS_DIR
+    stats["classes"].to_csv(out / "classes.csv", index=False)
+    (out / "summary.json").write_text(json.dumps({
+        "images_per_split": stats["images_per_split"], "label_files": stats["label_files"],
+        "boxes": stats["boxes"], "unparseable": stats["unparseable"],
+        "sources": stats["sources"].to_dict(orient="index"),
+    }, indent=2))
+    print(f"\n✅ Statistics cached in {out}")
+
+
+if __name__ == "__main__":
+    main(Path(sys.argv[1]) if len(sys.argv) > 1 else DATASET_ROOT)
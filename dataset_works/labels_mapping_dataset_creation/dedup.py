@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# Duplicate and near-duplicate images across the converted datasets
+#
+# COCO, Objects365, Open Images and VOC share Flickr images, so after
+# merging_all.py (which only prefixes names) the same picture can be in the
+# merged set several times, including once in train and once in val. For
+# every image we compute, in the conversion engine's process pool,
+#
+#   content hash   blake2b-128 of the file bytes      → exact copies
+#   dHash          64-bit gradient hash of a 9x8 thumb → re-encoded/resized copies
+#
+# and keep them in a sidecar per image directory (<img_dir>/.image_hash.npz,
+# reused while mtime and size are unchanged). Near-duplicates are found with
+# multi-index hashing instead of comparing all pairs: the 64 bits are cut
+# into MAX_DIST + 1 chunks, and two hashes within MAX_DIST bits must agree
+# exactly on at least one chunk, so only images sharing a chunk value are
+# compared. Matches are joined into clusters (union-find) and each cluster
+# keeps one image: a val copy if there is one (no train/val leak), then the
+# largest one. merging_all.py skips the others (DEDUP = True).
+#
+# Running this module writes <INPUT_ROOT>/.dedup/duplicates.csv for review.
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from conversion_engine import DEFAULT_WORKERS, run_pool
+from image_meta import load_meta
+from label_store import IMG_EXTS
+
+# === PATHS ===
+# Root of the individual converted YOLO datasets
+INPUT_ROOT = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/converted_datasets")
+SPLITS     = ["train", "val"]
+DATASETS   = None  # dataset folder names (None = every folder under INPUT_ROOT)
+MAX_DIST   = 3     # dHash bits that may differ between near-duplicates
+WORKERS    = DEFAULT_WORKERS
+BATCH_SIZE = 256   # images per worker task
+
+SIDECAR_NAME = ".image_hash.npz"
+REPORT_DIR   = ".dedup"
+SPLIT_PRIORITY = {"val": 0, "test": 1, "train": 2}  # which copy of a cluster is kept
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount64(x):
+    """Set bits of every uint64 in x."""
+    x = np.ascontiguousarray(x, dtype=np.uint64)
+    return _POPCOUNT8[x.view(np.uint8).reshape(-1, 8)].sum(axis=1, dtype=np.int64)
+
+
+def dhash(im):
+    """64-bit difference hash of a PIL image: sign of horizontal gradients of a 9x8 thumb."""
+    from PIL import Image
+
+    if im.format == "JPEG":
+        im.draft("L", (64, 64))  # decode at 1/8 scale, the thumbnail needs no more
+    px = np.asarray(im.convert("L").resize((9, 8), Image.BILINEAR, reducing_gap=2.0), dtype=np.int16)
+    bits = (px[:, 1:] > px[:, :-1]).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def _hash_batch(paths):
+    import hashlib
+    from PIL import Image
+
+    content = np.zeros((len(paths), 2), dtype=np.uint64)
+    phash = np.zeros(len(paths), dtype=np.uint64)
+    ok = np.zeros(len(paths), dtype=bool)
+    for i, p in enumerate(paths):
+        try:
+            with open(p, "rb") as f:
+                data = f.read()
+            content[i] = np.frombuffer(hashlib.blake2b(data, digest_size=16).digest(), dtype=np.uint64)
+            with Image.open(p) as im:
+                phash[i] = dhash(im)
+            ok[i] = True
+        except Exception:
+            pass  # unreadable / truncated: left out of the index
+    return content, phash, ok
+
+
+def load_hashes(img_dir: Path, workers=WORKERS):
+    """names, content (n, 2), dhash (n,), ok (n,) for one image directory, via the sidecar."""
+    img_dir = Path(img_dir)
+    names, mtime, size = [], [], []
+    with os.scandir(img_dir) as it:
+        for e in it:
+            if not e.name.startswith(".") and os.path.splitext(e.name)[1].lower() in IMG_EXTS:
+                st = e.stat()
+                names.append(e.name)
+                mtime.append(st.st_mtime_ns)
+                size.append(st.st_size)
+    mtime = np.array(mtime, dtype=np.int64)
+    size = np.array(size, dtype=np.int64)
+    content = np.zeros((len(names), 2), dtype=np.uint64)
+    phash = np.zeros(len(names), dtype=np.uint64)
+    ok = np.zeros(len(names), dtype=bool)
+
+    sidecar = img_dir / SIDECAR_NAME
+    todo = np.ones(len(names), dtype=bool)
+    if sidecar.exists():
+        with np.load(sidecar) as z:
+            old = {n: i for i, n in enumerate(z["names"].tolist())}
+            j = np.array([old.get(n, -1) for n in names], dtype=np.int64)
+            hit = j >= 0
+            hit[hit] = (z["mtime_ns"][j[hit]] == mtime[hit]) & (z["size"][j[hit]] == size[hit])
+            content[hit], phash[hit], ok[hit] = z["content"][j[hit]], z["phash"][j[hit]], z["ok"][j[hit]]
+            todo = ~hit
+
+    if todo.any():
+        idx = np.flatnonzero(todo)
+        batches = [idx[i:i + BATCH_SIZE] for i in range(0, len(idx), BATCH_SIZE)]
+        results = run_pool(_hash_batch, ([str(img_dir / names[i]) for i in b] for b in batches),
+                           workers, chunksize=1)
+        for b, (_, res, err) in tqdm(zip(batches, results), total=len(batches),
+                                     desc=f"  hashing {img_dir.parent.parent.name}/{img_dir.name}",
+                                     unit="batch"):
+            if err is None:
+                content[b], phash[b], ok[b] = res
+        tmp = img_dir / (SIDECAR_NAME + ".tmp.npz")
+        try:
+            np.savez(tmp, names=np.array(names, dtype=str), mtime_ns=mtime, size=size,
+                     content=content, phash=phash, ok=ok)
+            os.replace(tmp, sidecar)
+        except OSError as e:  # read-only dataset directory: work without a cache
+            print(f"⚠️  could not write {sidecar}: {e}", file=sys.stderr)
+    return names, content, phash, ok
+
+
+def near_pairs(hashes, max_dist=MAX_DIST):
+    """(i, j) index pairs (i < j) of hashes at most max_dist bits apart (multi-index hashing)."""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    n = len(hashes)
+    m = max_dist + 1
+    widths = [64 // m + (k < 64 % m) for k in range(m)]
+    found = []
+    shift = 0
+    for width in widths:
+        key = (hashes >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+        shift += width
+        order = np.argsort(key, kind="stable")
+        ks = key[order]
+        # end of the run of equal keys for every sorted position
+        starts = np.flatnonzero(np.r_[True, ks[1:] != ks[:-1]])
+        end = np.repeat(np.r_[starts[1:], n], np.diff(np.r_[starts, n]))
+        pos = np.arange(n)
+        o = 1
+        while True:
+            pos = pos[end[pos] - pos > o]  # positions that still have a partner o further on
+            if not len(pos):
+                break
+            i, j = order[pos], order[pos + o]
+            close = popcount64(hashes[i] ^ hashes[j]) <= max_dist
+            found.append(np.stack([np.minimum(i, j)[close], np.maximum(i, j)[close]], axis=1))
+            o += 1
+    if not found:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(found), axis=0)
+
+
+def components(n, pairs):
+    """Union-find over n nodes: root label (smallest member) per node."""
+    parent = np.arange(n)
+    a, b = pairs[:, 0], pairs[:, 1]
+    while True:
+        ra, rb = parent[a], parent[b]
+        if np.array_equal(ra, rb):
+            return parent
+        low = np.minimum(ra, rb)
+        np.minimum.at(parent, ra, low)
+        np.minimum.at(parent, rb, low)
+        while True:  # pointer jumping until every node points at its root
+            nxt = parent[parent]
+            if np.array_equal(nxt, parent):
+                break
+            parent = nxt
+
+
+def dataset_dirs(root: Path = INPUT_ROOT, datasets=DATASETS):
+    for d in sorted(Path(root).iterdir()):
+        if d.is_dir() and not d.name.startswith(".") and (datasets is None or d.name in datasets):
+            yield d
+
+
+def find_duplicates(root: Path = INPUT_ROOT, splits=SPLITS, datasets=DATASETS,
+                    max_dist=MAX_DIST, workers=WORKERS):
+    """One row per image in a duplicate cluster: cluster, dataset, split, name, kind, keep."""
+    cols = {"dataset": [], "split": [], "name": []}
+    content, phash = [], []
+    for d in dataset_dirs(root, datasets):
+        for split in splits:
+            img_dir = d / "images" / split
+            if not img_dir.exists():
+                continue
+            names, c, h, ok = load_hashes(img_dir, workers)
+            names = np.array(names, dtype=object)[ok]
+            cols["dataset"] += [d.name] * len(names)
+            cols["split"] += [split] * len(names)
+            cols["name"] += names.tolist()
+            content.append(c[ok])
+            phash.append(h[ok])
+    n = len(cols["name"])
+    content = np.concatenate(content) if content else np.zeros((0, 2), dtype=np.uint64)
+    phash = np.concatenate(phash) if phash else np.zeros(0, dtype=np.uint64)
+
+    # identical bytes and identical dHash are joined directly; near dHashes via the index
+    _, c_first, c_inv = np.unique(content, axis=0, return_index=True, return_inverse=True)
+    u_hash, h_first, h_inv = np.unique(phash, return_index=True, return_inverse=True)
+    near = near_pairs(u_hash, max_dist)
+    idx = np.arange(n)
+    pairs = np.concatenate([np.stack([idx, c_first[c_inv.ravel()]], axis=1),
+                            np.stack([idx, h_first[h_inv]], axis=1),
+                            h_first[near]]).astype(np.int64)
+    root_of = components(n, pairs)
+
+    sizes = np.bincount(root_of, minlength=n)
+    dup = sizes[root_of] > 1
+    df = pd.DataFrame({k: np.array(v, dtype=object)[dup] for k, v in cols.items()})
+    df["cluster"] = root_of[dup]
+    n_contents = pd.Series(c_inv.ravel()[dup]).groupby(df["cluster"].to_numpy()).nunique()
+    df["kind"] = np.where(n_contents.loc[df["cluster"]].to_numpy() == 1, "exact", "near")
+
+    # keep one per cluster: val over train, then the most pixels
+    pixels = np.zeros(len(df), dtype=np.int64)
+    for (ds, split), g in df.groupby(["dataset", "split"]):
+        meta = load_meta(Path(root) / ds / "images" / split, names=g["name"].tolist())
+        pixels[g.index] = [np.prod(meta.size(nm) or (0, 0)) for nm in g["name"]]
+    df["pixels"] = pixels
+    df["rank"] = df["split"].map(SPLIT_PRIORITY).fillna(len(SPLIT_PRIORITY))
+    df = df.sort_values(["cluster", "rank", "pixels", "dataset", "name"],
+                        ascending=[True, True, False, True, True], kind="stable")
+    df["keep"] = ~df["cluster"].duplicated()
+    return df.drop(columns="rank").reset_index(drop=True)
+
+
+def drop_set(dups):
+    """{(dataset, split, name)} of the images to leave out of the merge."""
+    d = dups[~dups["keep"]]
+    return set(zip(d["dataset"], d["split"], d["name"]))
+
+
+def print_summary(dups):
+    if dups.empty:
+        print("No duplicates found.")
+        return
+    clusters = dups.groupby("cluster")
+    kinds = clusters["kind"].first().value_counts()
+    leaks = clusters["split"].nunique().gt(1).sum()
+    print(f"{clusters.ngroups} duplicate clusters ({kinds.get('exact', 0)} exact, "
+          f"{kinds.get('near', 0)} near), {len(dups)} images, {int((~dups['keep']).sum())} to drop")
+    print(f"Clusters spanning splits (train/val leaks): {leaks}")
+    dropped = dups[~dups["keep"]].groupby(["dataset", "split"]).size().unstack(fill_value=0)
+    print("Dropped per dataset:")
+    print(dropped.to_string())
+
+
+def main():
+    dups = find_duplicates()
+    out = INPUT_ROOT / REPORT_DIR / "duplicates.csv"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    dups.to_csv(out, index=False)
+    print_summary(dups)
+    print(f"✅ Report written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# Header-only image dimensions (JPEG SOF / PNG IHDR), batched and cached
+#
+# Reads width/height (and the JPEG EXIF orientation) from the file header
+# without decoding pixels, probes many files over a thread pool and keeps a
+# sidecar cache per image directory:
+#
+#   <img_dir>/.image_meta.npz   names, mtime_ns, width, height, orientation
+#
+# Entries are reused while the file's mtime is unchanged, so a rerun over
+# millions of images only stats the directory. Other formats fall back to
+# PIL (which also only reads the header).
+import os
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+SIDECAR_NAME  = ".image_meta.npz"
+PROBE_THREADS = 32    # header reads are I/O bound
+PROBE_BATCH   = 4096  # files per thread-pool task
+
+# JPEG start-of-frame markers carrying the frame size (not DHT/JPG/DAC)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# markers without a length field
+_STANDALONE  = {0x01, *range(0xD0, 0xDA)}
+
+
+def _exif_orientation(app1: bytes) -> int:
+    """Orientation tag (0x0112) of an APP1 Exif payload, 1 if absent."""
+    if not app1.startswith(b"Exif\0\0") or len(app1) < 14:
+        return 1
+    tiff = app1[6:]
+    endian = "<" if tiff[:2] == b"II" else ">"
+    try:
+        ifd = struct.unpack(endian + "I", tiff[4:8])[0]
+        n = struct.unpack(endian + "H", tiff[ifd:ifd + 2])[0]
+        for i in range(n):
+            entry = tiff[ifd + 2 + 12 * i: ifd + 14 + 12 * i]
+            tag, typ = struct.unpack(endian + "HH", entry[:4])
+            if tag == 0x0112 and typ == 3:
+                return struct.unpack(endian + "H", entry[8:10])[0]
+    except struct.error:
+        pass
+    return 1
+
+
+def _probe_jpeg(f):
+    orientation = 1
+    while True:
+        b = f.read(1)
+        while b == b"\xff":  # fill bytes before the marker code
+            b = f.read(1)
+        if not b:
+            raise ValueError("no SOF marker before end of file")
+        marker = b[0]
+        if marker in _STANDALONE:
+            continue
+        (length,) = struct.unpack(">H", f.read(2))
+        if marker in _SOF_MARKERS:
+            _, h, w = struct.unpack(">BHH", f.read(5))
+            return w, h, orientation
+        if marker == 0xE1 and orientation == 1:
+            orientation = _exif_orientation(f.read(length - 2))
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+        b = f.read(1)
+        if b != b"\xff":
+            raise ValueError("corrupt JPEG marker stream")
+        f.seek(-1, os.SEEK_CUR)
+
+
+def probe(path):
+    """(width, height, exif orientation) of one image, reading only its header."""
+    with open(path, "rb") as f:
+        head = f.read(24)
+        if head[:2] == b"\xff\xd8":
+            f.seek(2)
+            return _probe_jpeg(f)
+        if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+            w, h = struct.unpack(">II", head[16:24])
+            return w, h, 1
+    from PIL import Image
+    with Image.open(path) as im:
+        orientation = im.getexif().get(0x0112, 1) if im.format == "JPEG" else 1
+        return im.size[0], im.size[1], orientation
+
+
+def _probe_batch(paths):
+    out = np.full((len(paths), 3), -1, dtype=np.int32)
+    for i, p in enumerate(paths):
+        try:
+            out[i] = probe(p)
+        except Exception:
+            pass  # unreadable / truncated: stays -1
+    return out
+
+
+def probe_many(paths, threads=PROBE_THREADS):
+    """(n, 3) int32 array of width, height, orientation; -1 rows for failures."""
+    paths = list(paths)
+    if not paths:
+        return np.empty((0, 3), dtype=np.int32)
+    batches = [paths[i:i + PROBE_BATCH] for i in range(0, len(paths), PROBE_BATCH)]
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        return np.concatenate(list(ex.map(_probe_batch, batches)))
+
+
+class ImageMeta:
+    """Dimensions of the images of one directory, looked up by file name."""
+
+    def __init__(self, names, width, height, orientation):
+        self.names = names
+        self.width, self.height, self.orientation = width, height, orientation
+        self._index = {n: i for i, n in enumerate(names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def size(self, name, exif_transpose=False):
+        """(width, height) of a file, or None when unknown/unreadable.
+
+        exif_transpose=True swaps the sides of EXIF-rotated JPEGs (orientation
+        5-8), matching what cv2.imread and Ultralytics see.
+        """
+        i = self._index.get(name)
+        if i is None or self.width[i] < 0:
+            return None
+        w, h = int(self.width[i]), int(self.height[i])
+        if exif_transpose and self.orientation[i] >= 5:
+            w, h = h, w
+        return w, h
+
+
+def load_meta(img_dir, names=None, threads=PROBE_THREADS, cache=True):
+    """ImageMeta for img_dir (all files, or only `names`), using the sidecar cache."""
+    img_dir = Path(img_dir)
+    wanted = None if names is None else set(names)
+    cur_names, cur_mtime = [], []
+    with os.scandir(img_dir) as it:
+        for e in it:
+            if e.name.startswith(".") or (wanted is not None and e.name not in wanted):
+                continue
+            if e.is_file():
+                cur_names.append(e.name)
+                cur_mtime.append(e.stat().st_mtime_ns)
+    cur_mtime = np.array(cur_mtime, dtype=np.int64)
+    meta = np.full((len(cur_names), 3), -1, dtype=np.int32)
+
+    sidecar = img_dir / SIDECAR_NAME
+    todo = np.ones(len(cur_names), dtype=bool)
+    if cache and sidecar.exists():
+        with np.load(sidecar) as z:
+            old_index = {n: i for i, n in enumerate(z["names"].tolist())}
+            old_mtime, old_meta = z["mtime_ns"], z["meta"]
+        for i, n in enumerate(cur_names):
+            j = old_index.get(n)
+            if j is not None and old_mtime[j] == cur_mtime[i]:
+                meta[i] = old_meta[j]
+                todo[i] = False
+
+    if todo.any():
+        idx = np.flatnonzero(todo)
+        meta[idx] = probe_many([os.path.join(img_dir, cur_names[i]) for i in idx], threads)
+        if cache:
+            _save_sidecar(sidecar, cur_names, cur_mtime, meta)
+    return ImageMeta(cur_names, meta[:, 0], meta[:, 1], meta[:, 2])
+
+
+def _save_sidecar(sidecar, names, mtime, meta):
+    # a subset (names=...) only adds to what is already cached
+    if sidecar.exists():
+        with np.load(sidecar) as z:
+            keep = ~np.isin(z["names"], names)
+            names = np.concatenate([z["names"][keep], np.array(names, dtype=str)])
+            mtime = np.concatenate([z["mtime_ns"][keep], mtime])
+            meta = np.concatenate([z["meta"][keep], meta])
+    tmp = sidecar.with_name(sidecar.name + ".tmp.npz")
+    try:
+        np.savez(tmp, names=np.array(names, dtype=str), mtime_ns=mtime, meta=meta)
+        os.replace(tmp, sidecar)
+    except OSError as e:  # read-only dataset directory: work without a cache
+        print(f"⚠️  could not write {sidecar}: {e}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    for d in sys.argv[1:]:
+        m = load_meta(d)
+        bad = int((m.width < 0).sum())
+        print(f"{d}: {len(m)} images probed" + (f", {bad} unreadable" if bad else ""))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# Resize-at-ingest: downsize large source images while converting
+#
+# With convert_samples(..., ingest=Ingest(max_side, quality)) every image
+# whose longer side exceeds max_side is decoded (JPEGs at a reduced DCT
+# scale via PIL's draft mode), resized and re-encoded at `quality` instead
+# of being linked. Smaller images are linked as usual. YOLO labels are
+# normalized, so they stay valid; the EXIF block (orientation) and ICC
+# profile are carried over, so every reader sees the image the same way.
+#
+# Each converter writes <OUTPUT_ROOT>/ingest_report.json; running this
+# module prints the size reduction per converted dataset:
+#
+#   python ingest.py /media/.../converted_datasets
+import json
+import os
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+from materialize import format_bytes
+
+# max_side: longest side in pixels after ingest; quality: JPEG quality
+Ingest = namedtuple("Ingest", ["max_side", "quality"], defaults=[90])
+
+REPORT_NAME = "ingest_report.json"
+
+
+def ingest_image(src, dst, ingest):
+    """Write a downsized copy of src to dst; returns bytes written, None if small enough."""
+    from PIL import Image
+
+    with Image.open(src) as im:
+        w, h = im.size
+        if max(w, h) <= ingest.max_side:
+            return None
+        r = ingest.max_side / max(w, h)
+        size = (max(1, round(w * r)), max(1, round(h * r)))
+        fmt = "JPEG" if im.format == "MPO" else im.format  # MPO: multi-picture JPEG
+        info = {k: im.info[k] for k in ("exif", "icc_profile") if im.info.get(k)}
+        if fmt == "JPEG":
+            im.draft(im.mode, size)  # decode at 1/2, 1/4 or 1/8 scale where possible
+        out = im.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+    # write next to dst and rename: dst may be a hardlink to a source image
+    tmp = f"{dst}.ingest.tmp"
+    if fmt == "JPEG":
+        out.save(tmp, "JPEG", quality=ingest.quality, **info)
+    else:
+        out.save(tmp, fmt, **({"icc_profile": info["icc_profile"]} if "icc_profile" in info else {}))
+    os.replace(tmp, dst)
+    return os.path.getsize(dst)
+
+
+class IngestStats:
+    """Bytes in/out of the images that were resized (the rest is linked as-is).
+
+    Kept per source image, so save() can merge a partial rerun into the
+    figures of earlier runs.
+    """
+
+    def __init__(self):
+        self.files = {}  # src → (src bytes, out bytes), None if written without resizing
+
+    def add(self, src, out_bytes):
+        """One written image; out_bytes is None if it was linked, not resized."""
+        self.files[str(src)] = None if out_bytes is None else (os.path.getsize(src), out_bytes)
+
+    @property
+    def resized(self):
+        return sum(v is not None for v in self.files.values())
+
+    @property
+    def src_bytes(self):
+        return sum(v[0] for v in self.files.values() if v is not None)
+
+    @property
+    def out_bytes(self):
+        return sum(v[1] for v in self.files.values() if v is not None)
+
+    def report(self):
+        if not self.resized:
+            return "no images resized"
+        return (f"{self.resized} resized, {format_bytes(self.src_bytes)} → "
+                f"{format_bytes(self.out_bytes)} ({self.out_bytes / self.src_bytes:.0%})")
+
+    def save(self, out_root, name, ingest, images_total):
+        """Merge this run into <out_root>/ingest_report.json under `name` (e.g. the split).
+
+        The resized images of earlier runs are kept in
+        <out_root>/.manifests/ingest_<name>.json and updated with the images
+        this run wrote, so the entry covers the whole dataset after partial
+        reruns too. images_total is the number of images in the output
+        (written + unchanged). Changed resize settings start over.
+        """
+        path = Path(out_root) / REPORT_NAME
+        files_path = Path(out_root) / ".manifests" / f"ingest_{name}.json"
+        report = json.loads(path.read_text()) if path.exists() else {}
+        prev = report.get(name, {})
+        files = {}
+        if (prev.get("max_side"), prev.get("quality")) == tuple(ingest) and files_path.exists():
+            files = json.loads(files_path.read_text())
+        for src, sizes in self.files.items():
+            if sizes is None:
+                files.pop(src, None)
+            else:
+                files[src] = sizes
+        report[name] = {"max_side": ingest.max_side, "quality": ingest.quality,
+                        "images": images_total, "resized": len(files),
+                        "src_bytes": sum(v[0] for v in files.values()),
+                        "out_bytes": sum(v[1] for v in files.values())}
+        files_path.parent.mkdir(parents=True, exist_ok=True)
+        files_path.write_text(json.dumps(files))
+        path.write_text(json.dumps(report, indent=2))
+
+
+def print_reports(root):
+    """Size reduction per converted dataset under root, from their reports."""
+    print(f"{'dataset':<20}{'images':>10}{'resized':>10}{'before':>12}{'after':>12}{'ratio':>8}")
+    for report in sorted(Path(root).glob(f"*/{REPORT_NAME}")):
+        runs = json.loads(report.read_text()).values()
+        n = sum(r["images"] for r in runs)
+        k = sum(r["resized"] for r in runs)
+        a = sum(r["src_bytes"] for r in runs)
+        b = sum(r["out_bytes"] for r in runs)
+        print(f"{report.parent.name:<20}{n:>10}{k:>10}{format_bytes(a):>12}{format_bytes(b):>12}"
+              f"{b / a if a else 1:>8.0%}")
+
+
+if __name__ == "__main__":
+    for root in sys.argv[1:]:
+        print_reports(root)
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# Packed, memory-mapped YOLO label store
+#
+# Packs every label file of a split into one binary store so anything that
+# needs label contents (subsampling, statistics, ...) memory-maps a few files
+# instead of opening millions of .txt files:
+#
+#   <store>/boxes.bin      BOX_DTYPE records (cls, xc, yc, w, h), image order
+#   <store>/offsets.npy    int64 (n_images + 1,), boxes of image i are
+#                          boxes[offsets[i]:offsets[i+1]]
+#   <store>/names.npy      bytes (n_images,), image file name (or full path
+#                          when built from a manifest)
+#   <store>/has_label.npy  bool (n_images,), whether a .txt existed at all
+#   <store>/meta.json      counts, dtype and the source directories
+#
+# float32 coordinates round-trip the 6-decimal .txt format exactly, so the
+# store can re-emit the label files when the trainer needs them.
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from conversion_engine import DEFAULT_WORKERS, run_pool
+
+# ───  PATHS ───────────────────────────────────────────
+DATASET_ROOT = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/merged_dataset")
+STORE_ROOT   = DATASET_ROOT / "label_store"
+SPLITS       = ["train", "val"]
+WORKERS      = DEFAULT_WORKERS
+# ────────────────────────────────────────────────────────────────
+
+BOX_DTYPE  = np.dtype([("cls", "<i4"), ("xc", "<f4"), ("yc", "<f4"), ("w", "<f4"), ("h", "<f4")])
+BATCH_SIZE = 2048  # label files per worker task
+
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+
+
+def _fast_rows(lines):
+    """All rows in one float parse, or None unless every non-empty line has 5 tokens."""
+    if not all(len(r) in (0, 5) for r in lines):
+        return None
+    try:
+        return np.array([v for r in lines for v in r], dtype=np.float64).reshape(-1, 5)
+    except ValueError:
+        return None
+
+
+def parse_label_text(text):
+    """YOLO label text → float64 (n, 5) array; extra columns are ignored."""
+    lines = [ln.split() for ln in text.splitlines()]
+    rows = _fast_rows(lines)  # the normal case: one float parse per file
+    if rows is not None:
+        return rows
+    rows = [r[:5] for r in lines if len(r) >= 5]
+    if not rows:
+        return np.empty((0, 5), dtype=np.float64)
+    return np.array(rows, dtype=np.float64)
+
+
+def read_label_rows(text):
+    """Strict parse for validation: float64 (n, 5) rows and the number of malformed lines.
+
+    A line is malformed unless it has exactly 5 finite numbers.
+    """
+    lines = [ln.split() for ln in text.splitlines()]
+    rows = _fast_rows(lines)
+    if rows is not None:
+        finite = np.isfinite(rows).all(axis=1)
+        return rows[finite], int((~finite).sum())
+    rows, bad = [], 0
+    for r in lines:
+        if not r:
+            continue
+        try:
+            if len(r) != 5:
+                raise ValueError
+            row = [float(v) for v in r]
+            if not np.isfinite(row).all():
+                raise ValueError
+            rows.append(row)
+        except ValueError:
+            bad += 1
+    return np.array(rows, dtype=np.float64).reshape(-1, 5), bad
+
+
+def _parse_batch(label_paths):
+    counts = np.zeros(len(label_paths), dtype=np.int64)
+    has_label = np.zeros(len(label_paths), dtype=bool)
+    parts = []
+    for i, p in enumerate(label_paths):
+        if p is None:
+            continue
+        try:
+            with open(p, "r") as f:
+                arr = parse_label_text(f.read())
+        except FileNotFoundError:
+            continue
+        has_label[i] = True
+        counts[i] = len(arr)
+        parts.append(arr)
+    rows = np.concatenate(parts) if parts else np.empty((0, 5))
+    boxes = np.empty(len(rows), dtype=BOX_DTYPE)
+    boxes["cls"] = rows[:, 0].astype(np.int32)
+    for j, col in enumerate(("xc", "yc", "w", "h"), start=1):
+        boxes[col] = rows[:, j]
+    return counts, has_label, boxes
+
+
+def pairs_from_dirs(img_dir: Path, lbl_dir: Path):
+    """(image names, label paths or None) from one listing per directory."""
+    label_stems = {e.name[:-4] for e in os.scandir(lbl_dir) if e.name.endswith(".txt")} \
+        if lbl_dir.exists() else set()
+    names = sorted(e.name for e in os.scandir(img_dir)
+                   if e.is_file() and os.path.splitext(e.name)[1].lower() in IMG_EXTS)
+    labels = []
+    for n in names:
+        stem = os.path.splitext(n)[0]
+        labels.append(str(lbl_dir / f"{stem}.txt") if stem in label_stems else None)
+    return names, labels
+
+
+def pairs_from_manifest(list_file: Path):
+    """(image paths, label paths) from a merging_all.py manifest (<split>.txt)."""
+    names = [ln.strip() for ln in Path(list_file).read_text().splitlines() if ln.strip()]
+    labels = []
+    for n in names:
+        head, sep, tail = n.rpartition(f"{os.sep}images{os.sep}")
+        lbl = f"{head}{os.sep}labels{os.sep}{tail}" if sep else n
+        labels.append(os.path.splitext(lbl)[0] + ".txt")
+    return names, labels
+
+
+def build_store(names, label_paths, out_dir: Path, workers=WORKERS, meta=None):
+    """Parse all label files in parallel and write the packed store to out_dir."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    n = len(names)
+    counts = np.zeros(n, dtype=np.int64)
+    has_label = np.zeros(n, dtype=bool)
+
+    batches = [(i, label_paths[i:i + BATCH_SIZE]) for i in range(0, n, BATCH_SIZE)]
+    with open(out_dir / "boxes.bin", "wb") as fb:
+        results = run_pool(_parse_batch, (b for _, b in batches), workers, chunksize=1)
+        for (start, _), (_, res, err) in tqdm(zip(batches, results), total=len(batches),
+                                              desc="  Packing labels", unit="batch"):
+            if err is not None:
+                raise RuntimeError(f"failed to parse label batch at image {start}:\n{err}")
+            c, h, boxes = res
+            counts[start:start + len(c)] = c
+            has_label[start:start + len(h)] = h
+            fb.write(boxes.tobytes())
+
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    np.save(out_dir / "offsets.npy", offsets)
+    np.save(out_dir / "has_label.npy", has_label)
+    np.save(out_dir / "names.npy", np.array([s.encode("utf-8") for s in names], dtype=bytes))
+    (out_dir / "meta.json").write_text(json.dumps({
+        "n_images": n,
+        "n_boxes": int(offsets[-1]),
+        "box_dtype": BOX_DTYPE.descr,
+        **(meta or {}),
+    }, indent=2))
+    return LabelStore(out_dir)
+
+
+class LabelStore:
+    """Read-only, memory-mapped view of a store written by build_store()."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.meta = json.loads((self.root / "meta.json").read_text())
+        self.offsets = np.load(self.root / "offsets.npy", mmap_mode="r")
+        self.has_label = np.load(self.root / "has_label.npy", mmap_mode="r")
+        self.names = np.load(self.root / "names.npy", mmap_mode="r")
+        n_boxes = int(self.offsets[-1])
+        self.boxes = (np.memmap(self.root / "boxes.bin", dtype=BOX_DTYPE, mode="r", shape=(n_boxes,))
+                      if n_boxes else np.empty(0, dtype=BOX_DTYPE))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def name(self, i):
+        return self.names[i].decode("utf-8")
+
+    def labels(self, i):
+        return self.boxes[self.offsets[i]:self.offsets[i + 1]]
+
+    def boxes_per_image(self):
+        return np.diff(self.offsets)
+
+    def box_image_index(self):
+        """Image index of every box, (n_boxes,) int32."""
+        return np.repeat(np.arange(len(self), dtype=np.int32), self.boxes_per_image())
+
+    def class_counts(self, nc):
+        return np.bincount(self.boxes["cls"], minlength=nc)
+
+    def image_class_pairs(self):
+        """Unique (image index, class) pairs as two int arrays, sorted by image."""
+        key = self.box_image_index().astype(np.int64) << 32 | self.boxes["cls"].astype(np.int64)
+        key = np.unique(key)
+        return (key >> 32).astype(np.int32), (key & 0xFFFFFFFF).astype(np.int32)
+
+    def emit_txt(self, out_dir, workers=WORKERS):
+        """Re-create the YOLO .txt label files (one per image that had one)."""
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        ranges = [(a, min(a + BATCH_SIZE, len(self))) for a in range(0, len(self), BATCH_SIZE)]
+        tasks = ((str(self.root), str(out_dir), a, b) for a, b in ranges)
+        written = 0
+        for _, res, err in tqdm(run_pool(_emit_range, tasks, workers, chunksize=1),
+                                total=len(ranges), desc="  Writing labels", unit="batch"):
+            if err is not None:
+                raise RuntimeError(err)
+            written += res
+        return written
+
+
+def _emit_range(task):
+    root, out_dir, a, b = task
+    store = LabelStore(root)
+    boxes = store.boxes[store.offsets[a]:store.offsets[b]]
+    lines = [f"{c} {x:.6f} {y:.6f} {w:.6f} {h:.6f}" for c, x, y, w, h in
+             zip(boxes["cls"].tolist(), boxes["xc"].tolist(), boxes["yc"].tolist(),
+                 boxes["w"].tolist(), boxes["h"].tolist())]
+    base = store.offsets[a]
+    written = 0
+    for i in range(a, b):
+        if not store.has_label[i]:
+            continue
+        stem = os.path.splitext(os.path.basename(store.name(i)))[0]
+        s, e = store.offsets[i] - base, store.offsets[i + 1] - base
+        Path(out_dir, f"{stem}.txt").write_text("\n".join(lines[s:e]))
+        written += 1
+    return written
+
+
+if __name__ == "__main__":
+    for split in SPLITS:
+        print(f"→ Building label store for split: {split}")
+        img_dir = DATASET_ROOT / "images" / split
+        lbl_dir = DATASET_ROOT / "labels" / split
+        names, label_paths = pairs_from_dirs(img_dir, lbl_dir)
+        store = build_store(names, label_paths, STORE_ROOT / split,
+                            meta={"images_dir": str(img_dir), "labels_dir": str(lbl_dir)})
+        print(f"  {len(store)} images, {store.meta['n_boxes']} boxes → {STORE_ROOT / split}\n")
+    print("✅ Label store complete!")
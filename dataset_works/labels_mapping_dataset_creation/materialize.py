@@ -0,0 +1,134 @@
+# Zero-copy file materialization: hardlink / reflink / symlink / copy
+#
+# Converting, merging and subsampling used to copy the same image bytes three
+# times. materialize() places a file at dst using the cheapest strategy the
+# filesystem allows and reports how many bytes were actually written, so
+# producing a new merged or subsampled variant costs metadata operations.
+import errno
+import fcntl
+import os
+import shutil
+from collections import Counter
+
+# "auto" tries hardlink → reflink → copy; the other modes use exactly one
+# strategy, falling back to a copy only when the filesystem can't do it
+LINK_MODES = ("auto", "hardlink", "reflink", "symlink", "copy")
+
+FICLONE = 0x40049409  # ioctl from linux/fs.h (btrfs, XFS with reflink=1, ...)
+
+# Errors meaning "this filesystem / device pair can't do it", as opposed to
+# real failures like a missing source file
+_UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY,
+                errno.EINVAL, errno.EMLINK, errno.ENOSYS}
+
+# (strategy, src dir, dst dir) pairs that already failed in this process
+_known_unsupported = set()
+
+
+def _hardlink(src, dst):
+    os.link(src, dst)
+    return 0
+
+
+def _symlink(src, dst):
+    os.symlink(os.path.abspath(src), dst)
+    return 0
+
+
+def _reflink(src, dst):
+    with open(src, "rb") as fs, open(dst, "wb") as fd:
+        try:
+            fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+        except OSError:
+            fd.close()
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+    return 0
+
+
+def _copy(src, dst):
+    shutil.copy2(src, dst)
+    return os.path.getsize(dst)
+
+
+_STRATEGIES = {
+    "hardlink": _hardlink,
+    "reflink":  _reflink,
+    "symlink":  _symlink,
+    "copy":     _copy,
+}
+
+
+def _remove_existing(src, dst, mode):
+    """Clear dst so it can be replaced; returns True if dst already is src."""
+    try:
+        if os.path.samefile(src, dst) and mode != "copy":
+            return True
+    except FileNotFoundError:
+        if os.path.islink(dst):  # dangling symlink
+            os.unlink(dst)
+        return False
+    os.unlink(dst)
+    return False
+
+
+def try_link(src, dst, mode="auto"):
+    """materialize() without the copy: (strategy, 0), or None if dst needs a real copy.
+
+    On None, dst has been cleared for the caller to write (see transfer.py).
+    """
+    if mode not in LINK_MODES:
+        raise ValueError(f"unknown link mode {mode!r}, expected one of {LINK_MODES}")
+    src, dst = os.fspath(src), os.fspath(dst)
+    if _remove_existing(src, dst, mode):
+        return "existing", 0
+
+    order = ("hardlink", "reflink") if mode == "auto" else () if mode == "copy" else (mode,)
+    key_dirs = (os.path.dirname(src), os.path.dirname(dst))
+    for strategy in order:
+        key = (strategy, *key_dirs)
+        if key in _known_unsupported:
+            continue
+        try:
+            return strategy, _STRATEGIES[strategy](src, dst)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+            _known_unsupported.add(key)
+    return None
+
+
+def materialize(src, dst, mode="auto"):
+    """Place src at dst using `mode`; returns (strategy used, bytes written).
+
+    An existing dst is replaced, unless it already links to src (in "copy"
+    mode a link is replaced by a real copy).
+    """
+    linked = try_link(src, dst, mode)
+    if linked is not None:
+        return linked
+    return "copy", _copy(os.fspath(src), os.fspath(dst))
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if abs(n) < 1024 or unit == "TB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n} B"
+        n /= 1024
+
+
+class LinkStats:
+    """Accumulates strategies used and bytes written across many files."""
+
+    def __init__(self):
+        self.files = Counter()
+        self.bytes_written = 0
+
+    def add(self, strategy, nbytes):
+        self.files[strategy] += 1
+        self.bytes_written += nbytes
+
+    def report(self):
+        methods = ", ".join(f"{k}: {v}" for k, v in sorted(self.files.items())) or "none"
+        return f"{format_bytes(self.bytes_written)} written ({methods})"
@@ -1,59 +1,315 @@
-import shutil
+import csv
+import os
 from pathlib import Path
+
+import yaml
 from tqdm import tqdm
 
+from dedup import REPORT_DIR, drop_set, find_duplicates, print_summary
+from materialize import LinkStats, materialize
+from stage_manifest import file_signature, is_current, open_manifest, remove_stale
+from transfer import TransferStats, transfer
+
 # === PATHs ===
 # Root of the individual converted YOLO datasets
 INPUT_ROOT  = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/converted_datasets")
 # Destination for the merged dataset
 MERGED_ROOT = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/merged_dataset")
+MASTER_NAMES = Path("./master.names")
 SPLITS      = ["train", "val"]
+# hardlink | reflink | symlink | copy | auto (hardlink → reflink → copy)
+LINK_MODE   = "auto"
+# "copy": physically merge into MERGED_ROOT/images|labels (files renamed <dataset>_<name>)
+# "manifest": only write MERGED_ROOT/<split>.txt image lists + provenance.csv + data.yaml
+MERGE_MODE  = "copy"
+# Dataset folder names to merge (None = every folder under INPUT_ROOT)
+DATASETS    = None
+# Copy mode: only re-link images whose image/label changed since the last run
+INCREMENTAL = True
+MERGE_VERSION = "prefix-v1"  # bump when the merged naming scheme changes
+# Leave out duplicate / near-duplicate images across datasets and splits,
+# keeping one copy per cluster (see dedup.py)
+DEDUP       = True
+
+
+def dataset_dirs():
+    for dataset_dir in sorted(INPUT_ROOT.iterdir()):
+        if not dataset_dir.is_dir():
+            continue
+        if DATASETS is not None and dataset_dir.name not in DATASETS:
+            continue
+        yield dataset_dir
+
+
+def duplicates_to_drop():
+    """(dataset, split, name) of the duplicate images to skip; empty without DEDUP."""
+    if not DEDUP:
+        return set()
+    print("Finding duplicate images ...")
+    dups = find_duplicates(INPUT_ROOT, SPLITS, DATASETS)
+    out = MERGED_ROOT / REPORT_DIR / "duplicates.csv"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    dups.to_csv(out, index=False)
+    print_summary(dups)
+    return drop_set(dups)
+
+
+def merge_file(ds_name, split, img_path, lbl_path, link_stats, manifest=None, drop=frozenset(),
+               pending=None):
+    """Link/copy one image (and its label, if any) into MERGED_ROOT.
+
+    Returns (status, has_label), status is "dropped", "unchanged" or "merged".
+    With a pending list the transfer is deferred: the file is appended to it
+    for finish_pending() and the status is "pending".
+    """
+    img_dst = MERGED_ROOT / "images" / split
+    lbl_dst = MERGED_ROOT / "labels" / split
+    if (ds_name, split, img_path.name) in drop:
+        if manifest is not None:
+            # unlink what an earlier run merged; the marker relinks it once it is no duplicate
+            key = str(img_path)
+            prev = manifest.get(key)
+            sig = [file_signature(img_path), "duplicate"]
+            if not is_current(prev, sig, manifest.version, []):
+                remove_stale(prev, [])
+                manifest.record(key, sig, [])
+        return "dropped", False
+
+    has_label = lbl_path.exists()
+    outputs = [str(img_dst / f"{ds_name}_{img_path.name}")]
+    if has_label:
+        outputs.append(str(lbl_dst / f"{ds_name}_{img_path.stem}.txt"))
+    if manifest is not None:
+        key = str(img_path)
+        prev = manifest.get(key)
+        sig = [file_signature(img_path), file_signature(lbl_path) if has_label else None]
+        if is_current(prev, sig, manifest.version, outputs):
+            return "unchanged", has_label
+    else:
+        key = prev = sig = None
+
+    if pending is not None:
+        pending.append((key, prev, sig, [img_path, lbl_path][:len(outputs)], outputs))
+        return "pending", has_label
+    link_stats.add(*materialize(img_path, outputs[0], LINK_MODE))
+    if has_label:
+        link_stats.add(*materialize(lbl_path, outputs[1], LINK_MODE))
+    if manifest is not None:
+        remove_stale(prev, outputs)
+        manifest.record(key, sig, outputs)
+    return "merged", has_label
 
-# Ensure merged directories exist
-for split in SPLITS:
-    (MERGED_ROOT / "images" / split).mkdir(parents=True, exist_ok=True)
-    (MERGED_ROOT / "labels" / split).mkdir(parents=True, exist_ok=True)
 
-# Track overall counts
-overall_counts = {split: {"images": 0, "labels": 0} for split in SPLITS}
+def finish_pending(pending, link_stats, manifest=None, transfer_stats=None, desc="Copying"):
+    """Transfer the files merge_file() deferred, in disk order; returns (failed images, failed labels).
 
-# Iterate each dataset folder under INPUT_ROOT
-for dataset_dir in sorted(INPUT_ROOT.iterdir()):
-    if not dataset_dir.is_dir():
-        continue
+    An image is only recorded in the manifest once all its files arrived,
+    so a failed one (and its label) is retried on the next run.
+    """
+    jobs = [(src, dst) for *_, srcs, outputs in pending for src, dst in zip(srcs, outputs)]
+    results = iter(transfer(jobs, LINK_MODE, stats=transfer_stats, desc=desc))
+    failed = failed_labels = 0
+    for key, prev, sig, srcs, outputs in pending:
+        done = [next(results) for _ in srcs]
+        errors = [r for r in done if isinstance(r, Exception)]
+        if errors:
+            print(f"  ✗ {srcs[0]}: {errors[0]}")
+            failed += 1
+            failed_labels += len(srcs) > 1
+            continue
+        for strategy, nbytes in done:
+            link_stats.add(strategy, nbytes)
+        if manifest is not None:
+            remove_stale(prev, outputs)
+            manifest.record(key, sig, outputs)
+    return failed, failed_labels
+
+
+def merge_split_copy(dataset_dir, split, link_stats, manifest=None, drop=frozenset(),
+                     transfer_stats=None):
+    """Link/copy one dataset split into MERGED_ROOT.
+
+    Returns (images, labels, unchanged images, unchanged labels, dropped);
+    images and labels count everything now in MERGED_ROOT, unchanged included.
+
+    Links are made per file; whatever needs a real copy goes through
+    transfer.py, which reads the sources in on-disk order.
+    """
     ds_name = dataset_dir.name
-    print(f"\nDataset '{ds_name}':")
+    img_src = dataset_dir / "images" / split
+    lbl_src = dataset_dir / "labels" / split
+
+    img_count = 0
+    lbl_count = 0
+    unchanged = 0
+    unchanged_lbl = 0
+    dropped = 0
+
+    if not (img_src.exists() and lbl_src.exists()):
+        return img_count, lbl_count, unchanged, unchanged_lbl, dropped
+
+    # Collect images and their labels, then transfer what changed
+    pending = []
+    for img_path in tqdm(img_src.iterdir(), desc=f"  {split} images", unit="img"):
+        if not img_path.is_file() or img_path.name.startswith("."):
+            continue  # skip sidecars such as .image_meta.npz
+        lbl_path = lbl_src / f"{img_path.stem}.txt"
+        status, has_label = merge_file(ds_name, split, img_path, lbl_path, link_stats, manifest, drop,
+                                       pending)
+        if status == "dropped":
+            dropped += 1
+            continue
+        img_count += 1
+        lbl_count += has_label
+        unchanged += status == "unchanged"
+        unchanged_lbl += status == "unchanged" and has_label
+
+    failed, failed_lbl = finish_pending(pending, link_stats, manifest, transfer_stats,
+                                        desc=f"  {split} transfer")
+    return img_count - failed, lbl_count - failed_lbl, unchanged, unchanged_lbl, dropped
+
+
+def stream_merge(pairs):
+    """Merge converted (image, label) paths as they arrive, e.g. from pipeline.py.
+
+    Records into the same manifest as merge_copy(), so the full pass that
+    follows only stats what was merged here. Duplicates are dropped by that
+    pass, which sees all datasets.
+    """
+    if MERGE_MODE != "copy":
+        for _ in pairs:  # manifest mode writes lists only, nothing to stream
+            pass
+        return
     for split in SPLITS:
-        img_src = dataset_dir / "images" / split
-        lbl_src = dataset_dir / "labels" / split
-        img_dst = MERGED_ROOT / "images" / split
-        lbl_dst = MERGED_ROOT / "labels" / split
-
-        img_count = 0
-        lbl_count = 0
-
-        if img_src.exists() and lbl_src.exists():
-            # Copy images and their labels
-            for img_path in tqdm(img_src.iterdir(), desc=f"  {split} images", unit="img"):
-                if not img_path.is_file():
-                    continue
-                new_img_name = f"{ds_name}_{img_path.name}"
-                shutil.copy2(img_path, img_dst / new_img_name)
-                img_count += 1
-                overall_counts[split]["images"] += 1
-
-                lbl_path = lbl_src / f"{img_path.stem}.txt"
-                if lbl_path.exists():
-                    new_lbl_name = f"{ds_name}_{img_path.stem}.txt"
-                    shutil.copy2(lbl_path, lbl_dst / new_lbl_name)
-                    lbl_count += 1
-                    overall_counts[split]["labels"] += 1
-
-        print(f"  {split}: {img_count} images copied, {lbl_count} labels copied")
-
-# Print overall merged counts
-print("\nOverall merged counts:")
-for split in SPLITS:
-    imgs = overall_counts[split]["images"]
-    lbls = overall_counts[split]["labels"]
-    print(f"  {split}: {imgs} images, {lbls} labels")
\ No newline at end of file
+        (MERGED_ROOT / "images" / split).mkdir(parents=True, exist_ok=True)
+        (MERGED_ROOT / "labels" / split).mkdir(parents=True, exist_ok=True)
+    link_stats = LinkStats()
+    merged = 0
+    with open_manifest(MERGED_ROOT / ".manifests" / "merge.jsonl",
+                       MERGE_VERSION, INCREMENTAL) as manifest:
+        for img_path, lbl_path in pairs:
+            img_path, lbl_path = Path(img_path), Path(lbl_path)
+            split, dataset_dir = img_path.parent.name, img_path.parents[2]
+            if (split not in SPLITS or dataset_dir.parent != INPUT_ROOT
+                    or (DATASETS is not None and dataset_dir.name not in DATASETS)):
+                continue  # not part of the merge
+            status, _ = merge_file(dataset_dir.name, split, img_path, lbl_path, link_stats, manifest)
+            merged += status == "merged"
+    print(f"Streamed into {MERGED_ROOT}: {merged} images merged, {link_stats.report()}")
+
+
+def merge_copy():
+    # Ensure merged directories exist
+    for split in SPLITS:
+        (MERGED_ROOT / "images" / split).mkdir(parents=True, exist_ok=True)
+        (MERGED_ROOT / "labels" / split).mkdir(parents=True, exist_ok=True)
+
+    # Track overall counts
+    overall_counts = {split: {"images": 0, "labels": 0} for split in SPLITS}
+    link_stats = LinkStats()
+    transfer_stats = TransferStats()
+    drop = duplicates_to_drop()
+
+    with open_manifest(MERGED_ROOT / ".manifests" / "merge.jsonl",
+                       MERGE_VERSION, INCREMENTAL) as manifest:
+        # Iterate each dataset folder under INPUT_ROOT
+        for dataset_dir in dataset_dirs():
+            print(f"\nDataset '{dataset_dir.name}':")
+            for split in SPLITS:
+                img_count, lbl_count, unchanged, unchanged_lbl, dropped = merge_split_copy(
+                    dataset_dir, split, link_stats, manifest, drop, transfer_stats)
+                overall_counts[split]["images"] += img_count
+                overall_counts[split]["labels"] += lbl_count
+                print(f"  {split}: {img_count - unchanged} images copied, "
+                      f"{lbl_count - unchanged_lbl} labels copied"
+                      + (f" ({unchanged} unchanged since last run)" if unchanged else "")
+                      + (f", {dropped} duplicates skipped" if dropped else ""))
+
+    print(f"\nTransfer: {transfer_stats.report()}")
+    return overall_counts, link_stats
+
+
+def merge_manifest():
+    """Virtual merge: image-list manifests pointing into the converted datasets.
+
+    Ultralytics resolves each label by swapping /images/ for /labels/ in the
+    image path, so the lists can be used directly as train/val in a data
+    YAML. provenance.csv maps every entry back to its source dataset and to
+    the <dataset>_<name> it would have in a physical merge.
+    """
+    MERGED_ROOT.mkdir(parents=True, exist_ok=True)
+    overall_counts = {split: {"images": 0, "labels": 0} for split in SPLITS}
+    drop = duplicates_to_drop()
+    list_files = {split: open(MERGED_ROOT / f"{split}.txt", "w") for split in SPLITS}
+
+    with open(MERGED_ROOT / "provenance.csv", "w", newline="") as prov_f:
+        prov = csv.writer(prov_f)
+        prov.writerow(["split", "dataset", "image", "label", "merged_name"])
+        for dataset_dir in dataset_dirs():
+            ds_name = dataset_dir.name
+            print(f"\nDataset '{ds_name}':")
+            for split in SPLITS:
+                img_src = (dataset_dir / "images" / split).resolve()
+                lbl_src = (dataset_dir / "labels" / split).resolve()
+                img_count = 0
+                lbl_count = 0
+                dropped = 0
+
+                if img_src.exists() and lbl_src.exists():
+                    # One listing per directory instead of an exists() per image
+                    label_stems = {e.name[:-4] for e in os.scandir(lbl_src)
+                                   if e.name.endswith(".txt")}
+                    for entry in sorted(os.scandir(img_src), key=lambda e: e.name):
+                        if not entry.is_file() or entry.name.startswith("."):
+                            continue
+                        if (ds_name, split, entry.name) in drop:
+                            dropped += 1
+                            continue
+                        stem = os.path.splitext(entry.name)[0]
+                        has_label = stem in label_stems
+                        list_files[split].write(f"{entry.path}\n")
+                        prov.writerow([split, ds_name, entry.path,
+                                       str(lbl_src / f"{stem}.txt") if has_label else "",
+                                       f"{ds_name}_{entry.name}"])
+                        img_count += 1
+                        lbl_count += has_label
+
+                overall_counts[split]["images"] += img_count
+                overall_counts[split]["labels"] += lbl_count
+                print(f"  {split}: {img_count} images listed, {lbl_count} with labels"
+                      + (f", {dropped} duplicates skipped" if dropped else ""))
+
+    for f in list_files.values():
+        f.close()
+
+    # Data YAML pointing at the manifests
+    names = [l.strip() for l in MASTER_NAMES.read_text().splitlines() if l.strip()]
+    data = {split: str((MERGED_ROOT / f"{split}.txt").resolve()) for split in SPLITS}
+    data.update(nc=len(names), names=names)
+    (MERGED_ROOT / "data.yaml").write_text(yaml.safe_dump(data, sort_keys=False))
+
+    return overall_counts, None
+
+
+def main():
+    if MERGE_MODE == "copy":
+        overall_counts, link_stats = merge_copy()
+    elif MERGE_MODE == "manifest":
+        overall_counts, link_stats = merge_manifest()
+    else:
+        raise ValueError(f"unknown MERGE_MODE {MERGE_MODE!r}, expected 'copy' or 'manifest'")
+
+    # Print overall merged counts
+    print("\nOverall merged counts:")
+    for split in SPLITS:
+        imgs = overall_counts[split]["images"]
+        lbls = overall_counts[split]["labels"]
+        print(f"  {split}: {imgs} images, {lbls} labels")
+    if link_stats is not None:
+        print(f"Materialized: {link_stats.report()}")
+    else:
+        print(f"Manifests written to {MERGED_ROOT} (train with data={MERGED_ROOT / 'data.yaml'})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+# One entry point for the dataset build: class mapping → converters → merge → checks
+#
+# pipeline.yaml lists the stages, their dependencies (a DAG) and the paths
+# the individual scripts otherwise hardcode (set as module constants before
+# the stage runs). Every stage whose dependencies are done runs right away,
+# at most `parallel` at a time; stages with a WORKERS constant get
+# workers // parallel processes each, so concurrent converters share the CPU.
+# Module stages run as threads of this process; their process pools start
+# fresh workers (see conversion_engine.run_pool), never a fork of it.
+#
+# A stage with `stream_from` consumes the outputs of its sources while they
+# are produced: every image/label pair a converter writes (or finds
+# unchanged) goes through a bounded queue into e.g. merging_all.stream_merge().
+# A full queue blocks the converter, so memory stays bounded and the merge
+# links files while they are still in the page cache. After the sources are
+# done the stage's regular call runs (the full merge pass, which then only
+# stats what was streamed, drops duplicates and reports).
+#
+# Every `report_every` seconds one line shows the items/s of every running
+# stage, queue depths and the disk read/write rate (/proc/diskstats). Stage
+# output goes to <log_dir>/<stage>.log, the run summary to
+# <log_dir>/last_run.json.
+#
+#   python pipeline.py [pipeline.yaml]
+import importlib
+import json
+import os
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from pathlib import Path
+
+import yaml
+
+CONFIG = Path("./pipeline.yaml")
+
+_DONE = object()  # end-of-stream marker
+_DISK_RE = re.compile(r"(sd[a-z]+|vd[a-z]+|xvd[a-z]+|nvme\d+n\d+|mmcblk\d+)$")
+
+
+def disk_bytes():
+    """(read, written) bytes of the whole disks in /proc/diskstats, None if unavailable."""
+    try:
+        lines = Path("/proc/diskstats").read_text().splitlines()
+    except OSError:
+        return None
+    read = written = 0
+    for ln in lines:
+        f = ln.split()
+        if len(f) >= 10 and _DISK_RE.match(f[2]):
+            read += int(f[5]) * 512
+            written += int(f[9]) * 512
+    return read, written
+
+
+def _fill(value, paths):
+    """Substitute {data}, {converted}, ... in every string of a config value."""
+    if isinstance(value, str):
+        return value.format(**paths)
+    if isinstance(value, list):
+        return [_fill(v, paths) for v in value]
+    if isinstance(value, dict):
+        return {k: _fill(v, paths) for k, v in value.items()}
+    return value
+
+
+class _ThreadLog:
+    """sys.stdout/stderr stand-in: each stage thread writes to its own log file."""
+
+    def __init__(self, console):
+        self.console = console
+        self.files = {}
+
+    @contextmanager
+    def to(self, f):
+        ident = threading.get_ident()
+        self.files[ident] = f
+        try:
+            yield
+        finally:
+            del self.files[ident]
+
+    def write(self, s):
+        return self.files.get(threading.get_ident(), self.console).write(s)
+
+    def flush(self):
+        self.files.get(threading.get_ident(), self.console).flush()
+
+    def isatty(self):
+        return False
+
+
+class Stage:
+    def __init__(self, name, cfg, paths):
+        self.name = name
+        self.script, self.module = cfg.get("script"), cfg.get("module")
+        if (self.script is None) == (self.module is None):
+            raise ValueError(f"stage {name!r}: set exactly one of 'script' and 'module'")
+        self.call = cfg.get("call", "main")
+        self.args = _fill(cfg.get("args", {}), paths)
+        self.settings = _fill(cfg.get("set", {}), paths)
+        self.after = list(cfg.get("after", []))
+        self.stream_from = list(cfg.get("stream_from", []))
+        self.stream = cfg.get("stream")
+        if self.stream_from and (self.module is None or self.stream is None):
+            raise ValueError(f"stage {name!r}: stream_from needs a module and its 'stream' function")
+        self.enabled = cfg.get("enabled", True)
+
+        self.status = "waiting"
+        self.items = 0
+        self.start = self.end = None
+        self.error = None
+        self.done = threading.Event()
+        self.consumers = []   # stages streaming from this one
+        self.queue = None     # input queue when streaming
+        self.accepting = True
+
+    @property
+    def deps(self):
+        return self.after + self.stream_from
+
+    def elapsed(self):
+        if self.start is None:
+            return 0.0
+        return (self.end or time.time()) - self.start
+
+
+def check_dag(stages):
+    """Unknown dependencies, cycles and stream setups that could block forever."""
+    for s in stages.values():
+        for d in s.deps:
+            if d not in stages:
+                raise ValueError(f"stage {s.name!r} depends on unknown stage {d!r}")
+    ancestors = {}
+
+    def visit(name, path=()):
+        if name in path:
+            raise ValueError(f"dependency cycle: {' → '.join(path + (name,))}")
+        if name not in ancestors:
+            acc = set()
+            for d in stages[name].deps:
+                acc |= {d} | visit(d, path + (name,))
+            ancestors[name] = acc
+        return ancestors[name]
+
+    for name in stages:
+        visit(name)
+    for s in stages.values():
+        # the consumer only starts once its `after` stages are done; if one of
+        # them waits for a source, that source blocks on the full queue
+        for d in s.after:
+            blocked = (ancestors[d] | {d}) & set(s.stream_from)
+            if blocked:
+                raise ValueError(f"stage {s.name!r}: 'after' stage {d!r} depends on "
+                                 f"streamed stage(s) {sorted(blocked)}")
+
+
+class Pipeline:
+    def __init__(self, config_path):
+        cfg = yaml.safe_load(Path(config_path).read_text())
+        self.config_path = Path(config_path)
+        self.paths = cfg["paths"]
+        self.workers = cfg.get("workers", os.cpu_count() or 1)
+        self.parallel = cfg.get("parallel", 4)
+        self.queue_size = cfg.get("queue_size", 10000)
+        self.report_every = cfg.get("report_every", 30)
+        self.log_dir = Path(_fill(cfg.get("log_dir", "{merged}/.pipeline"), self.paths))
+        self.stages = {name: Stage(name, scfg or {}, self.paths) for name, scfg in cfg["stages"].items()}
+        check_dag(self.stages)
+        for s in self.stages.values():
+            if s.stream_from:
+                s.queue = queue.Queue(maxsize=self.queue_size)
+                for src in s.stream_from:
+                    self.stages[src].consumers.append(s)
+        self.slots = threading.Semaphore(self.parallel)
+        self.finished = threading.Event()
+        self.console = sys.stdout
+
+    # ── stage execution ───────────────────────────────────────────
+    def _load(self, stage):
+        from conversion_engine import set_worker_settings
+
+        mod = importlib.import_module(stage.module)
+        settings = dict(stage.settings)
+        if hasattr(mod, "WORKERS") and "WORKERS" not in settings:
+            settings["WORKERS"] = max(1, self.workers // self.parallel)
+        for key, value in settings.items():
+            if not hasattr(mod, key):
+                raise AttributeError(f"stage {stage.name!r}: {stage.module} has no setting {key!r}")
+            current = getattr(mod, key)
+            if (isinstance(current, Path) or key.endswith("_ROOT")) and value is not None:
+                value = Path(value)
+            elif key == "INGEST" and value is not None:
+                from ingest import Ingest
+                value = Ingest(**value) if isinstance(value, dict) else Ingest(*value)
+            settings[key] = value
+        # pool workers are fresh interpreters: they get the settings replayed
+        set_worker_settings(stage.module, settings)
+        return mod
+
+    def _listener(self, stage):
+        def on_output(status, pairs):
+            stage.items += 1
+            for c in stage.consumers:
+                if c.accepting:
+                    for pair in pairs:
+                        c.queue.put(pair)  # blocks while the consumer is behind
+        return on_output
+
+    def _stream_items(self, stage):
+        while True:
+            item = stage.queue.get()
+            if item is _DONE:
+                return
+            stage.items += 1
+            yield item
+
+    def _stop_stream(self, stage):
+        # unblock producers of a consumer that will not read any more
+        stage.accepting = False
+        try:
+            while True:
+                stage.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _consume(self, stage, mod, log, errors):
+        with self.log.to(log):
+            try:
+                getattr(mod, stage.stream)(self._stream_items(stage))
+            except Exception:
+                traceback.print_exc(file=log)
+                errors.append(f"{stage.stream}() failed")
+                self._stop_stream(stage)
+
+    def _execute(self, stage, log):
+        if stage.script is not None:
+            log.flush()
+            subprocess.run([sys.executable, stage.script], stdout=log, stderr=subprocess.STDOUT, check=True)
+            return
+        mod = self._load(stage)
+        fn = getattr(mod, stage.call)
+        if stage.consumers:
+            from conversion_engine import stream_outputs
+            with stream_outputs(self._listener(stage)):
+                fn(**stage.args)
+        else:
+            fn(**stage.args)
+
+    def _run(self, stage):
+        try:
+            for d in stage.after:
+                self.stages[d].done.wait()
+            if not stage.enabled:
+                stage.status = "disabled"
+                if stage.queue is not None:
+                    self._stop_stream(stage)
+                return
+            failed = [d for d in stage.after if self.stages[d].status not in ("done", "disabled")]
+            if failed:
+                stage.status, stage.error = "skipped", f"upstream {failed} did not finish"
+                if stage.queue is not None:
+                    self._stop_stream(stage)
+                return
+
+            with open(self.log_dir / f"{stage.name}.log", "w") as log, self.log.to(log):
+                stage.start = time.time()
+                if stage.stream_from:
+                    stage.status = "streaming"
+                    errors = []
+                    consumer = threading.Thread(target=self._consume, name=f"{stage.name}-stream",
+                                                args=(stage, self._load(stage), log, errors))
+                    consumer.start()
+                    for src in stage.stream_from:
+                        self.stages[src].done.wait()
+                    stage.queue.put(_DONE)
+                    consumer.join()
+                    bad = [s for s in stage.stream_from if self.stages[s].status not in ("done", "disabled")]
+                    if errors or bad:
+                        stage.status = "failed" if errors else "skipped"
+                        stage.error = "; ".join(errors) or f"upstream {bad} did not finish"
+                        return
+                with self.slots:
+                    stage.status = "running"
+                    try:
+                        self._execute(stage, log)
+                    except Exception:
+                        traceback.print_exc(file=log)
+                        stage.status, stage.error = "failed", f"see {log.name}"
+                        return
+                stage.status = "done"
+        except Exception:  # e.g. a module that fails to import: never leave others waiting
+            stage.status, stage.error = "failed", traceback.format_exc()
+            if stage.queue is not None:
+                self._stop_stream(stage)
+        finally:
+            if stage.start is not None:
+                stage.end = time.time()
+            stage.done.set()
+            if stage.status != "waiting":
+                mark = {"done": "✓", "disabled": "–", "skipped": "–"}.get(stage.status, "✗")
+                print(f"{mark} {stage.name}: {stage.status} in {stage.elapsed():.0f}s"
+                      + (f" ({stage.items} items)" if stage.items else "")
+                      + (f" — {stage.error}" if stage.error else ""), file=self.console, flush=True)
+
+    # ── reporting ─────────────────────────────────────────────────
+    def _status_line(self, prev, t0):
+        now = time.time()
+        dt = max(now - prev["t"], 1e-9)
+        parts = []
+        for s in self.stages.values():
+            if s.status in ("running", "streaming"):
+                rate = (s.items - prev["items"].get(s.name, 0)) / dt
+                part = f"{s.name} {s.items} ({rate:.0f}/s)" if s.items else f"{s.name} …"
+                if s.queue is not None:
+                    part += f" q {s.queue.qsize()}/{self.queue_size}"
+                parts.append(part)
+            prev["items"][s.name] = s.items
+        disk = disk_bytes()
+        if disk is not None and prev["disk"] is not None:
+            parts.append(f"disk r {(disk[0] - prev['disk'][0]) / dt / 1e6:.0f} MB/s "
+                         f"w {(disk[1] - prev['disk'][1]) / dt / 1e6:.0f} MB/s")
+        prev["t"], prev["disk"] = now, disk
+        return f"[{now - t0:7.0f}s] " + (" | ".join(parts) or "waiting")
+
+    def _report_loop(self, t0):
+        prev = {"t": t0, "items": {}, "disk": disk_bytes()}
+        while not self.finished.wait(self.report_every):
+            print(self._status_line(prev, t0), file=self.console, flush=True)
+
+    def run(self):
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        os.environ.setdefault("TQDM_DISABLE", "1")  # the report line replaces the bars
+        self.log = _ThreadLog(self.console)
+        t0 = time.time()
+        disk0 = disk_bytes()
+        threads = [threading.Thread(target=self._run, args=(s,), name=s.name) for s in self.stages.values()]
+        reporter = threading.Thread(target=self._report_loop, args=(t0,), daemon=True)
+        sys.stdout = sys.stderr = self.log
+        try:
+            reporter.start()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            self.finished.set()
+            sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        return self._summary(time.time() - t0, disk0)
+
+    def _summary(self, elapsed, disk0):
+        disk = disk_bytes()
+        summary = {"config": str(self.config_path.resolve()), "elapsed_s": round(elapsed, 1), "stages": {}}
+        print(f"\n{'stage':<18}{'status':<10}{'time':>9}{'items':>11}{'items/s':>10}")
+        for s in self.stages.values():
+            rate = s.items / s.elapsed() if s.elapsed() else 0.0
+            print(f"{s.name:<18}{s.status:<10}{s.elapsed():>8.0f}s{s.items:>11}{rate:>10.0f}")
+            summary["stages"][s.name] = {"status": s.status, "seconds": round(s.elapsed(), 1),
+                                         "items": s.items, "items_per_s": round(rate, 1),
+                                         "error": s.error}
+        if disk is not None and disk0 is not None:
+            r, w = (disk[0] - disk0[0]) / elapsed / 1e6, (disk[1] - disk0[1]) / elapsed / 1e6
+            summary["disk_read_mb_s"], summary["disk_write_mb_s"] = round(r, 1), round(w, 1)
+            print(f"Disk: {r:.0f} MB/s read, {w:.0f} MB/s written on average")
+        (self.log_dir / "last_run.json").write_text(json.dumps(summary, indent=2))
+        ok = all(s.status in ("done", "disabled") for s in self.stages.values())
+        print(f"{'✅ Pipeline complete' if ok else '⚠️  Pipeline finished with failed stages'} "
+              f"in {elapsed:.0f}s (logs in {self.log_dir})")
+        return ok
+
+
+def main():
+    config = Path(sys.argv[1] if len(sys.argv) > 1 else CONFIG).resolve()
+    os.chdir(Path(__file__).resolve().parent)  # stages use ./class_mapping.npz, ./master.names
+    sys.exit(0 if Pipeline(config).run() else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# Incremental, resumable stages: per-dataset manifest of processed inputs
+#
+# Every converter (through the conversion engine) and merging_all.py record,
+# for each input, a signature (size + mtime, or a content hash), the output
+# paths and the class-mapping version. On rerun only new or changed inputs,
+# inputs whose outputs disappeared and outputs of an outdated mapping are
+# processed again. Records are appended to a JSON-lines file as work
+# completes, so a crash at image 1.8M of 2.2M resumes at 1.8M.
+import hashlib
+import json
+import os
+import pickle
+from contextlib import nullcontext
+from pathlib import Path
+
+FLUSH_EVERY = 1000
+
+
+def file_version(path) -> str:
+    """Short content hash of a file, e.g. master.names as the mapping version."""
+    return hashlib.sha1(Path(path).read_bytes()).hexdigest()[:16]
+
+
+def file_signature(path, hash_content=False):
+    st = os.stat(path)
+    if not hash_content:
+        return [st.st_size, st.st_mtime_ns]
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return [st.st_size, h.hexdigest()]
+
+
+def payload_signature(ann, hash_content=False):
+    """Signature of an adapter payload: file signature for paths, else a digest."""
+    if isinstance(ann, (str, Path)) and os.path.isfile(ann):
+        return file_signature(ann, hash_content)
+    return hashlib.blake2b(pickle.dumps(ann, protocol=4), digest_size=16).hexdigest()
+
+
+def is_current(prev, sig, version, outputs):
+    """Whether a previous record still covers this input.
+
+    `outputs` are all paths the input may produce; prev["out"] are the ones
+    it did produce (a subset, e.g. a sample with no boxes for one of several
+    output datasets). prev["out"] == [] means the input produced nothing last
+    time (e.g. no mapped boxes), which stays valid as long as the signature
+    matches.
+    """
+    if prev is None or prev["sig"] != sig or prev["map"] != version:
+        return False
+    if not prev["out"]:
+        return True
+    return set(prev["out"]) <= set(outputs) and all(os.path.exists(o) for o in prev["out"])
+
+
+def remove_stale(prev, outputs):
+    """Delete outputs of a previous record that the new run did not rewrite."""
+    if prev is None:
+        return
+    for o in prev["out"]:
+        if o not in outputs:
+            try:
+                os.unlink(o)
+            except FileNotFoundError:
+                pass
+
+
+class StageManifest:
+    """JSON-lines manifest: one {"key", "sig", "out", "map"} record per input.
+
+    Later lines win, so records are appended during the run and the file is
+    compacted to one line per key on close().
+    """
+
+    def __init__(self, path, version):
+        self.path = Path(path)
+        self.version = version
+        self.records = {}
+        torn = False
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except json.JSONDecodeError:
+                        torn = True  # last line cut by a crash
+                        break
+                    self.records[rec.pop("key")] = rec
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if torn:
+            self._rewrite()
+        self._f = open(self.path, "a")
+        self._pending = 0
+
+    def get(self, key):
+        return self.records.get(key)
+
+    def record(self, key, sig, outputs):
+        rec = {"sig": sig, "out": outputs, "map": self.version}
+        self.records[key] = rec
+        self._f.write(json.dumps({"key": key, **rec}) + "\n")
+        self._pending += 1
+        if self._pending >= FLUSH_EVERY:
+            self._f.flush()
+            self._pending = 0
+
+    def close(self):
+        self._f.close()
+        self._rewrite()
+
+    def _rewrite(self):
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp, "w") as f:
+            for key, rec in self.records.items():
+                f.write(json.dumps({"key": key, **rec}) + "\n")
+        os.replace(tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_manifest(path, version, enabled=True):
+    """StageManifest context, or a no-op context yielding None when disabled."""
+    return StageManifest(path, version) if enabled else nullcontext()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# Disk-order file transfer for HDD-backed dataset roots
+#
+# transfer() materializes many (src, dst) pairs like materialize(), but the
+# files that need a real copy (other device, LINK_MODE "copy", no reflink)
+# are copied in physical order instead of directory-listing or set order:
+#
+#   1. links (hardlink / reflink / symlink) are made first; they move no data
+#   2. the remaining sources are sorted by the physical offset of their first
+#      extent (FIEMAP ioctl), or by inode number where FIEMAP is unsupported
+#   3. READERS threads read in that order into a buffer of at most
+#      BUFFER_BYTES; small files (labels) travel in batches, and WRITERS
+#      threads write them to the destination, which may be another device
+#
+# One reader keeps a single spindle streaming; use more writers when the
+# destination is an SSD or another disk. TransferStats reports MB/s and files/s:
+#
+#   python transfer.py <src_dir> <dst_dir>    copy a directory tree in disk order
+import fcntl
+import os
+import queue
+import shutil
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from materialize import format_bytes, try_link
+
+READERS      = 1          # one per source spindle
+WRITERS      = 2
+BUFFER_BYTES = 256 << 20  # read-ahead held in memory
+SMALL_FILE   = 64 << 10   # files below this are batched ...
+SMALL_BATCH  = 256        # ... this many per writer task
+ORDER        = "extent"   # extent | inode | None (keep the given order)
+KEY_THREADS  = 16         # stat/FIEMAP calls are metadata I/O
+
+FS_IOC_FIEMAP = 0xC020660B  # _IOWR('f', 11, struct fiemap) from linux/fs.h
+_FIEMAP_HEAD = struct.Struct("=QQLLLL")             # start, length, flags, mapped, count, reserved
+_FIEMAP_EXTENT = struct.Struct("=QQQQQLLLL")        # logical, physical, length, 2x reserved, flags, 3x reserved
+
+
+def first_extent(path):
+    """Physical byte offset of a file's first extent (FIEMAP).
+
+    None when nothing is mapped (empty, inline or not yet allocated);
+    raises OSError where the filesystem has no FIEMAP.
+    """
+    buf = bytearray(_FIEMAP_HEAD.pack(0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0) + bytes(_FIEMAP_EXTENT.size))
+    with open(path, "rb") as f:
+        fcntl.ioctl(f.fileno(), FS_IOC_FIEMAP, buf)
+    if _FIEMAP_HEAD.unpack_from(buf)[3] == 0:
+        return None
+    return _FIEMAP_EXTENT.unpack_from(buf, _FIEMAP_HEAD.size)[1]
+
+
+def _disk_keys(paths, order):
+    keys = []
+    for p in paths:
+        try:
+            st = os.stat(p)
+        except OSError:
+            keys.append(((-1, 0, 0), 0))  # missing: fails (and is reported) when read
+            continue
+        key = (st.st_dev, 1, st.st_ino)
+        if order == "extent":
+            try:
+                phys = first_extent(p)
+            except OSError:
+                phys = None
+            if phys is not None:
+                key = (st.st_dev, 0, phys)
+        keys.append((key, st.st_size))
+    return keys
+
+
+def disk_order(paths, order=ORDER, threads=KEY_THREADS):
+    """Indices of paths in physical read order and the file sizes."""
+    paths = list(paths)
+    batches = [paths[i:i + 4096] for i in range(0, len(paths), 4096)]
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        keys = [k for batch in ex.map(lambda b: _disk_keys(b, order), batches) for k in batch]
+    sizes = [size for _, size in keys]
+    if order is None:
+        return list(range(len(paths))), sizes
+    return sorted(range(len(paths)), key=lambda i: keys[i][0]), sizes
+
+
+class TransferStats:
+    """Files and bytes moved by transfer(), with the wall time of the copy phase."""
+
+    def __init__(self):
+        self.linked = 0
+        self.copied = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.errors = []  # (src, exception)
+
+    def report(self):
+        s = max(self.seconds, 1e-9)
+        out = f"{self.linked} linked, {self.copied} copied"
+        if self.copied:
+            out += (f" ({format_bytes(self.bytes)} in {self.seconds:.0f}s: "
+                    f"{self.bytes / s / 2**20:.1f} MB/s, {self.copied / s:.0f} files/s)")
+        if self.errors:
+            out += f", {len(self.errors)} errors"
+        return out
+
+
+class _Budget:
+    """Bytes of read-ahead in flight; a file larger than the budget still gets through alone."""
+
+    def __init__(self, limit):
+        self.limit, self.used = limit, 0
+        self.cond = threading.Condition()
+
+    def acquire(self, n):
+        with self.cond:
+            while self.used and self.used + n > self.limit:
+                self.cond.wait()
+            self.used += n
+
+    def release(self, n):
+        with self.cond:
+            self.used -= n
+            self.cond.notify_all()
+
+
+def _write(src, dst, data):
+    with open(dst, "wb") as f:
+        f.write(data)
+    shutil.copystat(src, dst)
+
+
+def transfer(jobs, mode="auto", order=ORDER, readers=READERS, writers=WRITERS,
+             buffer_bytes=BUFFER_BYTES, stats=None, desc="Copying"):
+    """Materialize (src, dst) jobs; returns (strategy, bytes written) or an exception per job.
+
+    Results are in job order and use materialize()'s strategy names, so they
+    can go straight into a LinkStats. Failures are returned, not raised, and
+    also collected in stats.errors.
+    """
+    jobs = [(os.fspath(s), os.fspath(d)) for s, d in jobs]
+    stats = stats if stats is not None else TransferStats()
+    results = [None] * len(jobs)
+
+    to_copy = []
+    for i, (src, dst) in enumerate(jobs):
+        try:
+            results[i] = try_link(src, dst, mode)
+        except OSError as e:
+            results[i] = e
+            continue
+        if results[i] is None:
+            to_copy.append(i)
+        elif results[i][0] != "existing":
+            stats.linked += 1
+    if not to_copy:
+        stats.errors += [(jobs[i][0], r) for i, r in enumerate(results) if isinstance(r, Exception)]
+        return results
+
+    idx, sizes = disk_order([jobs[i][0] for i in to_copy], order)
+    plan = [(to_copy[k], sizes[k]) for k in idx]
+    budget = _Budget(buffer_bytes)
+    tasks = queue.Queue()
+    plan_lock = threading.Lock()
+    pos = [0]
+    bar = tqdm(total=len(plan), desc=desc, unit="file")
+    bar_lock = threading.Lock()
+
+    def next_batch():
+        # one large file, or up to SMALL_BATCH small ones, in plan order
+        with plan_lock:
+            start = pos[0]
+            end = start + 1
+            if start < len(plan) and plan[start][1] < SMALL_FILE:
+                while end < len(plan) and end - start < SMALL_BATCH and plan[end][1] < SMALL_FILE:
+                    end += 1
+            pos[0] = min(end, len(plan))
+            return plan[start:end]
+
+    def read_loop():
+        while True:
+            batch = next_batch()
+            if not batch:
+                return
+            budget.acquire(sum(size for _, size in batch))
+            items = []
+            for i, size in batch:
+                try:
+                    with open(jobs[i][0], "rb") as f:
+                        items.append((i, size, f.read()))
+                except OSError as e:
+                    results[i] = e
+                    budget.release(size)
+            if len(items) < len(batch):
+                with bar_lock:
+                    bar.update(len(batch) - len(items))
+            tasks.put(items)
+
+    def write_loop():
+        while True:
+            items = tasks.get()
+            if items is None:
+                return
+            for i, size, data in items:
+                try:
+                    _write(*jobs[i], data)
+                    results[i] = ("copy", len(data))
+                except OSError as e:
+                    results[i] = e
+                budget.release(size)
+            with bar_lock:
+                bar.update(len(items))
+
+    t0 = time.time()
+    read_threads = [threading.Thread(target=read_loop) for _ in range(max(1, readers))]
+    write_threads = [threading.Thread(target=write_loop) for _ in range(max(1, writers))]
+    for t in read_threads + write_threads:
+        t.start()
+    for t in read_threads:
+        t.join()
+    for _ in write_threads:
+        tasks.put(None)
+    for t in write_threads:
+        t.join()
+    bar.close()
+    stats.seconds += time.time() - t0
+
+    stats.errors += [(jobs[i][0], r) for i, r in enumerate(results) if isinstance(r, Exception)]
+    copied = [results[i] for i in to_copy if not isinstance(results[i], Exception)]
+    stats.copied += len(copied)
+    stats.bytes += sum(n for _, n in copied)
+    return results
+
+
+def tree_jobs(src_root, dst_root):
+    """(src, dst) for every file below src_root, creating the directories below dst_root."""
+    jobs = []
+    for dirpath, _, files in os.walk(src_root):
+        out = os.path.join(dst_root, os.path.relpath(dirpath, src_root))
+        os.makedirs(out, exist_ok=True)
+        jobs += [(os.path.join(dirpath, f), os.path.join(out, f)) for f in files]
+    return jobs
+
+
+if __name__ == "__main__":
+    src_root, dst_root = sys.argv[1:3]
+    stats = TransferStats()
+    transfer(tree_jobs(src_root, dst_root), mode="copy", stats=stats)
+    print(f"✅ {src_root} → {dst_root}: {stats.report()}")
+    for src, err in stats.errors[:5]:
+        print(f"  ✗ {src}: {err}")
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# Batched, prefetching YOLO evaluator (script version of eval_*.ipynb)
+#
+# Images are decoded on a thread pool while the model runs on the previous
+# batch, inference runs on whole batches and the boxes of a batch come off
+# the device as one array. Metrics are the notebooks' (TP/FP/FN, precision,
+# recall, F1, mean IoU, TP/FP confidences at --iou) plus AP at IoU
+# .50:.05:.95 from matching.py, written to --outdir. Predictions only match
+# GT of their own class and AP is averaged over the evaluated classes. For
+# all 801 classes with area ranges and a per-source breakdown see
+# multiclass_eval.py.
+#
+#   python batch_eval.py --weights best.pt \
+#       --images .../test_1_copy/images --label-suffix _annotations
+#   python batch_eval.py --weights best.pt --device 0 --batch 32 \
+#       --images .../merged_dataset_quarter/val.txt --classes all
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+# shared dataset tools (label parsing)
+sys.path.append(str(Path(__file__).resolve().parents[1] / "dataset_works" / "labels_mapping_dataset_creation"))
+from image_meta import load_meta  # noqa: E402
+from label_store import IMG_EXTS, parse_label_text  # noqa: E402
+from matching import IOU_THRESHOLDS, APAccumulator, match_image  # noqa: E402
+from pred_cache import CONF_FLOOR, PredictionCache  # noqa: E402
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Batched YOLO evaluation on a labelled image set")
+    ap.add_argument("--weights", required=True, help="model .pt")
+    ap.add_argument("--images", required=True, type=Path,
+                    help="image directory, or a <split>.txt image list (labels under /labels/)")
+    ap.add_argument("--labels", type=Path, default=None,
+                    help="label directory (default: sibling 'labels' of an image directory)")
+    ap.add_argument("--label-suffix", default="",
+                    help="label file is <stem><suffix>.txt, e.g. _annotations for the Roboflow test set")
+    ap.add_argument("--outdir", type=Path, default=Path("eval_out"))
+    ap.add_argument("--classes", default="0",
+                    help="comma-separated class ids to evaluate, or 'all' (default: 0, person)")
+    ap.add_argument("--conf", type=float, default=0.5,
+                    help="confidence threshold (use e.g. 0.001 for a full-range mAP)")
+    ap.add_argument("--iou", type=float, default=0.5, help="NMS and matching IoU threshold")
+    ap.add_argument("--max-det", type=int, default=100)
+    ap.add_argument("--imgsz", type=int, default=640)
+    ap.add_argument("--batch", type=int, default=16, help="images per inference batch")
+    ap.add_argument("--device", default=None, help="cpu, 0, 0,1 ... (default: Ultralytics' choice)")
+    ap.add_argument("--half", action="store_true", help="FP16 inference (GPU)")
+    ap.add_argument("--threads", type=int, default=8, help="image decode threads")
+    ap.add_argument("--save-vis", action="store_true", help="draw GT / TP / FP per image")
+    ap.add_argument("--cache-dir", type=Path, default=None,
+                    help="prediction cache (see pred_cache.py); reruns with other --conf / "
+                         "--classes then skip inference")
+    return ap.parse_args(argv)
+
+
+def list_images(images: Path, labels: Path = None, suffix=""):
+    """(image paths, label paths) for an image directory or a <split>.txt list."""
+    if images.is_file():
+        imgs = [Path(ln.strip()) for ln in images.read_text().splitlines() if ln.strip()]
+        lbls = []
+        for p in imgs:
+            head, sep, tail = str(p).rpartition(f"{os.sep}images{os.sep}")
+            lbl = Path(f"{head}{os.sep}labels{os.sep}{tail}" if sep else p)
+            lbls.append(lbl.with_name(f"{lbl.stem}{suffix}.txt"))
+        return imgs, lbls
+    labels = labels or images.parent / "labels"
+    imgs = sorted(p for p in images.iterdir() if p.suffix.lower() in IMG_EXTS)
+    return imgs, [labels / f"{p.stem}{suffix}.txt" for p in imgs]
+
+
+def load_gt(lbl_path, classes, W, H):
+    """GT boxes of the evaluated classes as (n, 4) pixel xyxy plus (n,) class ids."""
+    try:
+        rows = parse_label_text(Path(lbl_path).read_text())
+    except FileNotFoundError:
+        rows = np.empty((0, 5))
+    if classes is not None:
+        rows = rows[np.isin(rows[:, 0].astype(int), classes)]
+    xc, yc, w, h = (rows[:, 1:5] * [W, H, W, H]).T
+    return np.stack([xc - w / 2, yc - h / 2, xc + w / 2, yc + h / 2], axis=1), rows[:, 0].astype(int)
+
+
+def image_sizes(paths):
+    """Path → EXIF-transposed (W, H) from the image headers (image_meta.py), None if unreadable."""
+    by_dir = {}
+    for p in paths:
+        by_dir.setdefault(p.parent, []).append(p)
+    sizes = {}
+    for d, ps in by_dir.items():
+        meta = load_meta(d, names=[p.name for p in ps])
+        sizes.update((p, meta.size(p.name, exif_transpose=True)) for p in ps)
+    return sizes
+
+
+def iter_batches(paths, batch, threads, decode=True):
+    """Yield (paths, decoded BGR images) per batch, decoding ahead on a thread pool.
+
+    With decode=False the images are None (callers that only need the paths).
+    """
+    chunks = [paths[i:i + batch] for i in range(0, len(paths), batch)]
+    if not decode:
+        for chunk in chunks:
+            yield chunk, [None] * len(chunk)
+        return
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, [ex.submit(cv2.imread, str(p)) for p in chunk]))
+            if len(pending) > 2:  # keep two batches decoding while the model runs
+                done, futs = pending.popleft()
+                yield done, [f.result() for f in futs]
+        while pending:
+            done, futs = pending.popleft()
+            yield done, [f.result() for f in futs]
+
+
+def predict_batch(model, imgs, args, classes):
+    """Run one batch; returns per image an (n, 6) array x1, y1, x2, y2, conf, cls."""
+    import torch
+
+    results = model.predict(imgs, conf=args.conf, iou=args.iou, classes=classes,
+                            max_det=args.max_det, imgsz=args.imgsz, device=args.device,
+                            half=args.half, batch=len(imgs), verbose=False)
+    counts = [len(r.boxes) for r in results]
+    if not sum(counts):
+        return [np.empty((0, 6), dtype=np.float32) for _ in results]
+    data = torch.cat([r.boxes.data for r in results]).cpu().numpy()  # one transfer per batch
+    return np.split(data, np.cumsum(counts)[:-1])
+
+
+def draw(img, gt, pred, tp, out_file):
+    disp = img.copy()
+    # (A) ground-truth in green, (B) true positives in red, (C) false positives in blue
+    for g in gt.astype(int):
+        cv2.rectangle(disp, (g[0], g[1]), (g[2], g[3]), (0, 255, 0), 2)
+    for p, hit in zip(pred, tp):
+        x1, y1, x2, y2 = p[:4].astype(int)
+        color = (0, 0, 255) if hit else (255, 0, 0)
+        cv2.rectangle(disp, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(disp, f"{p[4]:.2f}", (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+    cv2.imwrite(str(out_file), disp)
+
+
+def evaluate(args):
+    classes = None if args.classes == "all" else [int(c) for c in args.classes.split(",")]
+    img_paths, lbl_paths = list_images(args.images, args.labels, args.label_suffix)
+    lbl_of = dict(zip(img_paths, lbl_paths))
+    print(f"Found {len(img_paths)} images in {args.images}")
+    args.outdir.mkdir(parents=True, exist_ok=True)
+    if args.save_vis:
+        (args.outdir / "images").mkdir(exist_ok=True)
+
+    cached = sizes = None
+    if args.cache_dir is not None:
+        # all classes above the floor; --conf / --classes become row filters
+        cache = PredictionCache(args.cache_dir, args.weights, min(CONF_FLOOR, args.conf), args.iou,
+                                args.imgsz, args.max_det, args.half, args.device)
+        cached = dict(zip(img_paths, cache.predict(img_paths, batch=args.batch, threads=args.threads)))
+        # warm reruns need no decode: W, H from the headers, pixels only for --save-vis
+        sizes = image_sizes(img_paths)
+    else:
+        from ultralytics import YOLO
+
+        model = YOLO(args.weights)
+        print("✅ Loaded YOLO model from", args.weights)
+
+    TP = FP = FN = 0
+    conf_tp, conf_fp, all_f1, all_miou = [], [], [], []
+    # row 0: the --iou threshold for P/R/F1, rows 1..10: .50:.95 for AP
+    thresholds = np.r_[args.iou, IOU_THRESHOLDS]
+    accs = {}  # class id → APAccumulator
+    t_infer = t_wait = 0.0
+    unreadable = []
+    t0 = t_last = time.perf_counter()
+    bar = tqdm(total=len(img_paths), desc="Eval images", unit="img")
+    decode = cached is None or args.save_vis
+    for paths, imgs in iter_batches(img_paths, args.batch, args.threads, decode):
+        t_wait += time.perf_counter() - t_last
+        n_batch = len(paths)
+        if cached is None:
+            ok = [i for i, im in enumerate(imgs) if im is not None]
+        else:
+            ok = [i for i, p in enumerate(paths) if sizes[p] is not None and cached[p] is not None
+                  and (not decode or imgs[i] is not None)]
+        ok_set = set(ok)
+        unreadable += [str(paths[i]) for i in range(len(paths)) if i not in ok_set]
+        paths, imgs = [paths[i] for i in ok], [imgs[i] for i in ok]
+
+        t = time.perf_counter()
+        if cached is not None:
+            preds = [cached[p] for p in paths]
+            preds = [p[(p[:, 4] >= args.conf) & (np.isin(p[:, 5], classes) if classes else True)]
+                     for p in preds]
+        else:
+            preds = predict_batch(model, imgs, args, classes) if imgs else []
+        t_infer += time.perf_counter() - t
+
+        for path, img, pred in zip(paths, imgs, preds):
+            W, H = sizes[path] if sizes is not None else img.shape[1::-1]
+            gt, gt_cls = load_gt(lbl_of[path], classes, W, H)
+            p_cls = pred[:, 5].astype(int)
+            tp_all, iou_all = match_image(pred[:, :4], pred[:, 4], gt, thresholds, p_cls, gt_cls)
+            for c in np.union1d(p_cls, gt_cls):
+                sel = p_cls == c
+                accs.setdefault(int(c), APAccumulator()).add(pred[sel, 4], tp_all[1:, sel],
+                                                             np.count_nonzero(gt_cls == c))
+            tp, ious = tp_all[0], iou_all[0, tp_all[0]]
+            conf_tp += pred[tp, 4].tolist()
+            conf_fp += pred[~tp, 4].tolist()
+            tp_n, fp_n = int(tp.sum()), int((~tp).sum())
+            fn_n = len(gt) - tp_n
+            TP += tp_n
+            FP += fp_n
+            FN += fn_n
+
+            # per-image metrics
+            prec = tp_n / (tp_n + fp_n + 1e-9)
+            rec  = tp_n / (tp_n + fn_n + 1e-9)
+            all_f1.append(2 * prec * rec / (prec + rec + 1e-9))
+            all_miou.append(float(ious.mean()) if len(ious) else 0.0)
+            if args.save_vis:
+                draw(img, gt, pred, tp, args.outdir / "images" / f"{path.stem}.jpg")
+        bar.update(n_batch)
+        t_last = time.perf_counter()
+    bar.close()
+    elapsed = time.perf_counter() - t0
+
+    n = len(all_f1)
+    overall_prec = TP / (TP + FP + 1e-9)
+    overall_rec  = TP / (TP + FN + 1e-9)
+    overall_f1   = 2 * overall_prec * overall_rec / (overall_prec + overall_rec + 1e-9)
+    print(f"Images: {n}   TP/FP/FN: {TP}/{FP}/{FN}")
+    print(f"Precision: {overall_prec:.4f}  Recall: {overall_rec:.4f}  F1: {overall_f1:.4f}")
+    print(f"mean IoU: {np.mean(all_miou) if n else 0.0:.4f}")
+    # AP per class with GT, averaged over classes (COCO-style mAP)
+    ap_cls = {c: a.compute()["ap"] for c, a in sorted(accs.items()) if a.n_gt}
+    ap = np.mean(list(ap_cls.values()), axis=0) if ap_cls else np.zeros(len(IOU_THRESHOLDS))
+    res = {"ap": ap, "map50": float(ap[0]), "map50_95": float(ap.mean())}
+    print(f"mAP@.50: {res['map50']:.4f}  mAP@.50:.95: {res['map50_95']:.4f}  ({len(ap_cls)} classes)")
+    print(f"Throughput: {n / elapsed:.1f} img/s  (inference {t_infer:.1f}s, "
+          f"waiting on decode {t_wait:.1f}s, total {elapsed:.1f}s)")
+    if unreadable:
+        print(f"⚠️  {len(unreadable)} unreadable images skipped, e.g. {unreadable[0]}")
+
+    np.savez(args.outdir / "eval_results.npz", conf_tp=np.array(conf_tp), conf_fp=np.array(conf_fp),
+             f1=np.array(all_f1), miou=np.array(all_miou), tp_fp_fn=np.array([TP, FP, FN]),
+             iou_thresholds=IOU_THRESHOLDS, ap=res["ap"])
+    (args.outdir / "summary.json").write_text(json.dumps({
+        "weights": str(args.weights), "images": n, "TP": TP, "FP": FP, "FN": FN,
+        "precision": overall_prec, "recall": overall_rec, "f1": overall_f1,
+        "mean_iou": float(np.mean(all_miou)) if n else 0.0,
+        "map50": res["map50"], "map50_95": res["map50_95"],
+        "ap_per_iou": dict(zip(np.round(IOU_THRESHOLDS, 2).tolist(), res["ap"].tolist())),
+        "ap_per_class": {c: {"ap50": float(a[0]), "ap50_95": float(a.mean())} for c, a in ap_cls.items()},
+        "img_per_s": n / elapsed, "unreadable": unreadable,
+    }, indent=2))
+    print(f"Results written to {args.outdir}")
+
+
+if __name__ == "__main__":
+    evaluate(parse_args())
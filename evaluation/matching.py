@@ -0,0 +1,115 @@
+# Vectorized box matching and one-pass AP over IoU thresholds .50:.05:.95
+#
+# match_image() computes the pairwise IoU matrix of one image and runs the
+# greedy, confidence-ordered matching for all thresholds at once; the
+# resulting (T, n_pred) TP matrix goes into an APAccumulator, which sorts
+# all predictions once at the end and gets precision/recall and AP for
+# every threshold from one cumulative sum.
+import numpy as np
+
+IOU_THRESHOLDS = np.linspace(0.50, 0.95, 10)
+RECALL_POINTS  = np.linspace(0.0, 1.0, 101)  # COCO 101-point interpolation
+
+
+def box_iou(a, b):
+    """Pairwise IoU of (n, 4) and (m, 4) xyxy boxes → (n, m)."""
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(rb - lt, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def greedy_match(iou, pred_conf, thresholds=IOU_THRESHOLDS):
+    """Matched GT index per threshold and prediction, (T, n) int (-1 = FP).
+
+    Predictions are visited in descending confidence; at each threshold a
+    prediction takes the unmatched GT with the highest IoU >= threshold.
+    Pairs that must never match (e.g. different classes) get IoU < 0.
+    """
+    T, (n, m) = len(thresholds), iou.shape
+    matched = np.full((T, n), -1, dtype=np.int64)
+    if n == 0 or m == 0:
+        return matched
+    thr = np.asarray(thresholds)[:, None]
+    used = np.zeros((T, m), dtype=bool)
+    rows = np.arange(T)
+    for i in np.argsort(-np.asarray(pred_conf), kind="stable"):
+        cand = np.where((iou[i] >= thr) & ~used, iou[i], -1.0)  # (T, m)
+        best = cand.argmax(axis=1)
+        hit = cand[rows, best] >= 0
+        used[rows[hit], best[hit]] = True
+        matched[hit, i] = best[hit]
+    return matched
+
+
+def match_image(pred_xyxy, pred_conf, gt_xyxy, thresholds=IOU_THRESHOLDS, pred_cls=None, gt_cls=None):
+    """Greedy matching of one image at every IoU threshold (see greedy_match).
+
+    With pred_cls and gt_cls a prediction only matches GT of its own class.
+    Returns (tp, iou): tp is (T, n_pred) bool in the input prediction order,
+    iou is (T, n_pred) with the IoU of the matched GT (0 for FPs).
+    """
+    T, n = len(thresholds), len(pred_xyxy)
+    if n == 0 or len(gt_xyxy) == 0:
+        return np.zeros((T, n), dtype=bool), np.zeros((T, n))
+    iou = box_iou(np.asarray(pred_xyxy, dtype=np.float64), np.asarray(gt_xyxy, dtype=np.float64))
+    if pred_cls is not None and gt_cls is not None:
+        iou[np.asarray(pred_cls)[:, None] != np.asarray(gt_cls)[None, :]] = -1.0
+    matched = greedy_match(iou, pred_conf, thresholds)
+    tp = matched >= 0
+    matched_iou = np.where(tp, iou[np.arange(n), np.maximum(matched, 0)], 0.0)
+    return tp, matched_iou
+
+
+def average_precision(tp_sorted, n_gt):
+    """AP per threshold from a (T, N) TP matrix sorted by descending confidence.
+
+    Returns (ap (T,), precision (T, N), recall (T, N)).
+    """
+    tpc = np.cumsum(tp_sorted, axis=1)
+    fpc = np.cumsum(~tp_sorted, axis=1)
+    recall = tpc / max(n_gt, 1)
+    precision = tpc / np.maximum(tpc + fpc, 1)
+    if n_gt == 0 or tp_sorted.shape[1] == 0:
+        return np.zeros(len(tp_sorted)), precision, recall
+    # precision envelope (monotonically decreasing), sampled at 101 recall points
+    envelope = np.flip(np.maximum.accumulate(np.flip(precision, axis=1), axis=1), axis=1)
+    ap = np.empty(len(tp_sorted))
+    for t in range(len(tp_sorted)):
+        idx = np.searchsorted(recall[t], RECALL_POINTS, side="left")
+        ap[t] = np.where(idx < envelope.shape[1],
+                         envelope[t, np.minimum(idx, envelope.shape[1] - 1)], 0.0).mean()
+    return ap, precision, recall
+
+
+class APAccumulator:
+    """Collects per-image matching results; AP at every threshold in one pass."""
+
+    def __init__(self, thresholds=IOU_THRESHOLDS):
+        self.thresholds = np.asarray(thresholds)
+        self._conf, self._tp = [], []
+        self.n_gt = 0
+
+    def add(self, conf, tp, n_gt):
+        """conf (n,) and tp (T, n) of one image, n_gt its number of GT boxes."""
+        self._conf.append(np.asarray(conf, dtype=np.float32))
+        self._tp.append(np.asarray(tp, dtype=bool))
+        self.n_gt += int(n_gt)
+
+    def arrays(self):
+        """All predictions sorted by descending confidence: (conf (N,), tp (T, N))."""
+        if not self._conf:
+            return np.empty(0, dtype=np.float32), np.zeros((len(self.thresholds), 0), dtype=bool)
+        conf = np.concatenate(self._conf)
+        tp = np.concatenate(self._tp, axis=1)
+        order = np.argsort(-conf, kind="stable")
+        return conf[order], tp[:, order]
+
+    def compute(self):
+        """{'ap': (T,), 'map50', 'map50_95', 'precision', 'recall', 'conf'}."""
+        conf, tp = self.arrays()
+        ap, precision, recall = average_precision(tp, self.n_gt)
+        return {"ap": ap, "map50": float(ap[0]), "map50_95": float(ap.mean()),
+                "precision": precision, "recall": recall, "conf": conf}
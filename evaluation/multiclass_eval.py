@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# COCO-style evaluation over all classes of the merged label space
+#
+# Every prediction is matched once per image against the GT of its own class
+# at IoU .50:.05:.95 (matching.greedy_match with cross-class pairs masked).
+# TP/FP are counted into preallocated histograms over confidence bins,
+#
+#   tp, fp   (classes, IoU thresholds, area ranges, conf bins)   int32
+#   n_gt     (classes, area ranges)
+#
+# so memory is fixed however many images are evaluated, and AP for every
+# class, threshold and area range comes from one reversed cumsum at the end.
+# The same counts are kept per source dataset (area "all" only), found from
+# the <dataset>_ prefix the merge gives file names (or, for a manifest-mode
+# merge, from the converted dataset directory in the path).
+#
+# Area ranges follow COCO (pixels², original image size): GT outside a range
+# is left out of it, together with the predictions matched to it; unmatched
+# predictions count in the range of their own area.
+#
+#   python multiclass_eval.py --weights best.pt --device 0 \
+#       --images .../merged_dataset/val.txt --outdir eval_801
+import argparse
+import json
+import time
+import warnings
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from batch_eval import iter_batches, list_images, load_gt, predict_batch
+from matching import IOU_THRESHOLDS, RECALL_POINTS, box_iou, greedy_match
+
+MASTER_NAMES = (Path(__file__).resolve().parents[1] / "dataset_works"
+                / "labels_mapping_dataset_creation" / "master.names")
+# converted dataset names (= merge prefixes); the longest match wins
+SOURCES      = ("coco", "crowdHuman", "Objects365",
+                "open-images-v6", "voc2012_split")
+AREA_RANGES  = {"all":    (0, np.inf),
+                "small":  (0, 32 ** 2),
+                "medium": (32 ** 2, 96 ** 2),
+                "large":  (96 ** 2, np.inf)}
+CONF_BINS    = 200        # confidence histogram resolution (0.005)
+FLUSH_EVERY  = 1 << 20    # buffered counter increments before adding them up
+
+
+def ap_from_bins(tp, fp, n_gt):
+    """101-point AP from per-bin TP/FP counts (..., B), bins in ascending conf.
+
+    n_gt broadcasts against the leading dims; AP is nan where n_gt == 0.
+    """
+    tpc = np.cumsum(tp[..., ::-1], axis=-1, dtype=np.float64)
+    fpc = np.cumsum(fp[..., ::-1], axis=-1, dtype=np.float64)
+    n_gt = np.broadcast_to(n_gt, tpc.shape[:-1])
+    recall = tpc / np.maximum(n_gt, 1)[..., None]
+    precision = tpc / np.maximum(tpc + fpc, 1)
+    envelope = np.flip(np.maximum.accumulate(np.flip(precision, -1), axis=-1), -1)
+
+    B = tpc.shape[-1]
+    ap = np.full(tpc.shape[:-1], np.nan)
+    flat_r, flat_e, flat_ap = recall.reshape(-1, B), envelope.reshape(-1, B), ap.reshape(-1)
+    for i in np.flatnonzero(n_gt.reshape(-1) > 0):
+        idx = np.searchsorted(flat_r[i], RECALL_POINTS, side="left")
+        flat_ap[i] = np.where(idx < B, flat_e[i, np.minimum(idx, B - 1)], 0.0).mean()
+    return ap
+
+
+class MultiClassEvaluator:
+    """Fixed-size TP/FP histograms per class, IoU threshold, area range and source."""
+
+    def __init__(self, nc, sources=SOURCES, thresholds=IOU_THRESHOLDS, conf_bins=CONF_BINS):
+        self.nc, self.thresholds, self.bins = nc, np.asarray(thresholds), conf_bins
+        self.sources = list(sources) + ["other"]
+        # longest name first, so a name that extends another one wins
+        self._by_len = sorted(range(len(sources)), key=lambda i: -len(sources[i]))
+        self._areas = np.array(list(AREA_RANGES.values()))
+        T, A, B, S = len(self.thresholds), len(self._areas), conf_bins, len(self.sources)
+
+        self.tp = np.zeros((nc, T, A, B), dtype=np.int32)
+        self.fp = np.zeros((nc, T, A, B), dtype=np.int32)
+        self.n_gt = np.zeros((nc, A), dtype=np.int64)
+        self.src_tp = np.zeros((S, nc, T, B), dtype=np.int32)
+        self.src_fp = np.zeros((S, nc, T, B), dtype=np.int32)
+        self.src_n_gt = np.zeros((S, nc), dtype=np.int64)
+        self.src_images = np.zeros(S, dtype=np.int64)
+        self._buf = {"tp": [], "fp": [], "src_tp": [], "src_fp": []}
+        self._buffered = 0
+
+    def source_of(self, path):
+        """Index into self.sources from the merged file name or the path."""
+        path = Path(path)
+        for i in self._by_len:
+            if path.name.startswith(self.sources[i] + "_"):
+                return i
+        parts = set(path.parts[:-1])
+        for i in self._by_len:
+            if self.sources[i] in parts:
+                return i
+        return len(self.sources) - 1
+
+    def _in_area(self, xyxy):
+        area = np.prod(xyxy[:, 2:] - xyxy[:, :2], axis=1)
+        return (area >= self._areas[:, :1]) & (area < self._areas[:, 1:])  # (A, n)
+
+    def add(self, path, pred, gt_xyxy, gt_cls):
+        """One image: pred (n, 6) x1, y1, x2, y2, conf, cls; GT as from load_gt."""
+        s = self.source_of(path)
+        T, A, B = len(self.thresholds), len(self._areas), self.bins
+        gt_cls = np.asarray(gt_cls, dtype=np.int64)
+        gt_area = self._in_area(gt_xyxy)
+        for a in range(A):
+            np.add.at(self.n_gt[:, a], gt_cls[gt_area[a]], 1)
+        np.add.at(self.src_n_gt[s], gt_cls, 1)
+        self.src_images[s] += 1
+        if not len(pred):
+            return
+
+        p_cls = pred[:, 5].astype(np.int64)
+        iou = box_iou(pred[:, :4].astype(np.float64), gt_xyxy)
+        iou[p_cls[:, None] != gt_cls[None, :]] = -1.0  # match within the class only
+        matched = greedy_match(iou, pred[:, 4], self.thresholds)  # (T, n)
+        hit = matched >= 0
+        if len(gt_cls):
+            gt_in = gt_area[:, np.maximum(matched, 0)]  # (A, T, n)
+        else:
+            gt_in = np.zeros((A,) + matched.shape, dtype=bool)
+        tp_mask = hit[None] & gt_in
+        fp_mask = ~hit[None] & self._in_area(pred[:, :4])[:, None, :]
+
+        b = np.minimum((pred[:, 4] * B).astype(np.int64), B - 1)
+        base = p_cls * T                       # flat (c, t) per prediction
+        for key, mask in (("tp", tp_mask), ("fp", fp_mask)):
+            a, t, i = np.nonzero(mask)
+            self._buf[key].append(((base[i] + t) * A + a) * B + b[i])
+            t, i = np.nonzero(mask[0])          # area "all" → per-source counts
+            self._buf["src_" + key].append(((s * self.nc + p_cls[i]) * T + t) * B + b[i])
+            self._buffered += len(a)
+        if self._buffered >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        for key, parts in self._buf.items():
+            if parts:
+                np.add.at(getattr(self, key).reshape(-1), np.concatenate(parts), 1)
+                parts.clear()
+        self._buffered = 0
+
+    def compute(self):
+        """AP arrays: 'ap' (C, T, A) and 'src_ap' (S, C, T), nan without GT."""
+        self.flush()
+        return {"ap": ap_from_bins(self.tp, self.fp, self.n_gt[:, None, :]),
+                "src_ap": ap_from_bins(self.src_tp, self.src_fp, self.src_n_gt[:, :, None])}
+
+    def save(self, path):
+        self.flush()
+        np.savez_compressed(path, tp=self.tp, fp=self.fp, n_gt=self.n_gt,
+                            src_tp=self.src_tp, src_fp=self.src_fp, src_n_gt=self.src_n_gt,
+                            src_images=self.src_images, sources=np.array(self.sources),
+                            iou_thresholds=self.thresholds, areas=np.array(list(AREA_RANGES)))
+
+
+def _nanmean(x, axis=None):
+    with warnings.catch_warnings():  # all-nan → nan, without the warning
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmean(x, axis=axis)
+
+
+def report(ev, res, names, outdir):
+    ap, src_ap = res["ap"], res["src_ap"]
+    areas = list(AREA_RANGES)
+    has_gt = ev.n_gt[:, 0] > 0
+    print(f"\nClasses with GT: {int(has_gt.sum())} / {ev.nc}")
+    print(f"mAP@.50: {_nanmean(ap[:, 0, 0]):.4f}  mAP@.50:.95: {_nanmean(ap[:, :, 0].mean(1)):.4f}  "
+          + "  ".join(f"AP{a[0].upper()}: {_nanmean(ap[:, :, k].mean(1)):.4f}"
+                      for k, a in enumerate(areas) if k))
+
+    print(f"\n{'source':<18}{'images':>9}{'GT boxes':>10}{'classes':>9}{'mAP50':>8}{'mAP50-95':>10}")
+    per_source = {}
+    for s, name in enumerate(ev.sources):
+        if not ev.src_images[s]:
+            continue
+        m50, m5095 = _nanmean(src_ap[s, :, 0]), _nanmean(src_ap[s].mean(1))
+        n_cls = int((ev.src_n_gt[s] > 0).sum())
+        print(f"{name:<18}{ev.src_images[s]:>9}{ev.src_n_gt[s].sum():>10}{n_cls:>9}"
+              f"{m50:>8.4f}{m5095:>10.4f}")
+        per_source[name] = {"images": int(ev.src_images[s]), "gt_boxes": int(ev.src_n_gt[s].sum()),
+                            "classes": n_cls, "map50": float(m50), "map50_95": float(m5095)}
+
+    # per-class table, classes without GT left out
+    with open(outdir / "per_class.csv", "w") as f:
+        f.write("class_id,name,n_gt,ap50,ap75,ap50_95," + ",".join(f"ap_{a}" for a in areas[1:]) + "\n")
+        for c in np.flatnonzero(has_gt):
+            row = [ap[c, 0, 0], ap[c, 5, 0], ap[c, :, 0].mean()] + [ap[c, :, k].mean()
+                                                                    for k in range(1, len(areas))]
+            f.write(f"{c},{names[c]},{ev.n_gt[c, 0]}," + ",".join(f"{v:.4f}" for v in row) + "\n")
+    return per_source
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="All-class COCO-style evaluation with per-source breakdown")
+    ap.add_argument("--weights", required=True, help="model .pt")
+    ap.add_argument("--images", required=True, type=Path,
+                    help="image directory, or a <split>.txt image list (labels under /labels/)")
+    ap.add_argument("--labels", type=Path, default=None)
+    ap.add_argument("--label-suffix", default="")
+    ap.add_argument("--names", type=Path, default=MASTER_NAMES, help="class names, one per line")
+    ap.add_argument("--sources", default=",".join(SOURCES),
+                    help="comma-separated dataset names used as merge prefixes")
+    ap.add_argument("--outdir", type=Path, default=Path("eval_all_classes"))
+    ap.add_argument("--conf", type=float, default=0.001)
+    ap.add_argument("--iou", type=float, default=0.7, help="NMS IoU threshold")
+    ap.add_argument("--max-det", type=int, default=300)
+    ap.add_argument("--imgsz", type=int, default=640)
+    ap.add_argument("--batch", type=int, default=16)
+    ap.add_argument("--device", default=None)
+    ap.add_argument("--half", action="store_true")
+    ap.add_argument("--threads", type=int, default=8, help="image decode threads")
+    return ap.parse_args(argv)
+
+
+def evaluate(args):
+    from ultralytics import YOLO
+
+    names = [ln.strip() for ln in args.names.read_text().splitlines() if ln.strip()]
+    img_paths, lbl_paths = list_images(args.images, args.labels, args.label_suffix)
+    lbl_of = dict(zip(img_paths, lbl_paths))
+    print(f"Found {len(img_paths)} images in {args.images}, {len(names)} classes")
+    args.outdir.mkdir(parents=True, exist_ok=True)
+
+    model = YOLO(args.weights)
+    print("✅ Loaded YOLO model from", args.weights)
+    ev = MultiClassEvaluator(len(names), [s for s in args.sources.split(",") if s])
+
+    unreadable = []
+    t0 = time.perf_counter()
+    bar = tqdm(total=len(img_paths), desc="Eval images", unit="img")
+    for paths, imgs in iter_batches(img_paths, args.batch, args.threads):
+        n_batch = len(paths)
+        ok = [i for i, im in enumerate(imgs) if im is not None]
+        unreadable += [str(paths[i]) for i in range(n_batch) if imgs[i] is None]
+        paths, imgs = [paths[i] for i in ok], [imgs[i] for i in ok]
+        preds = predict_batch(model, imgs, args, None) if imgs else []
+        for path, img, pred in zip(paths, imgs, preds):
+            H, W = img.shape[:2]
+            gt, gt_cls = load_gt(lbl_of[path], None, W, H)
+            ev.add(path, pred, gt, gt_cls)
+        bar.update(n_batch)
+    bar.close()
+    elapsed = time.perf_counter() - t0
+
+    res = ev.compute()
+    per_source = report(ev, res, names, args.outdir)
+    n = int(ev.src_images.sum())
+    print(f"\nThroughput: {n / elapsed:.1f} img/s ({elapsed:.1f}s)")
+    if unreadable:
+        print(f"⚠️  {len(unreadable)} unreadable images skipped, e.g. {unreadable[0]}")
+
+    ev.save(args.outdir / "counts.npz")
+    ap = res["ap"]
+    (args.outdir / "summary.json").write_text(json.dumps({
+        "weights": str(args.weights), "images": n, "classes": len(names),
+        "map50": float(_nanmean(ap[:, 0, 0])), "map50_95": float(_nanmean(ap[:, :, 0].mean(1))),
+        **{f"ap_{a}": float(_nanmean(ap[:, :, k].mean(1))) for k, a in enumerate(AREA_RANGES) if k},
+        "per_source": per_source, "img_per_s": n / elapsed, "unreadable": unreadable,
+    }, indent=2))
+    print(f"Results written to {args.outdir}")
+
+
+if __name__ == "__main__":
+    evaluate(parse_args())
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# On-disk prediction cache: run the model once, re-analyse without it
+#
+# Raw predictions (all classes, every box above CONF_FLOOR) are stored per
+# model and inference settings in one columnar file,
+#
+#   <cache_dir>/<weights hash>-<settings hash>.npz
+#     keys     (n_img,)     image content hash (blake2b of the file bytes)
+#     offset   (n_img + 1,) first row of each image
+#     xyxy     (N, 4) float32, conf (N,) float32, cls (N,) int16
+#
+# so a renamed or copied image is still a hit and a changed one is not.
+# Only images missing from the cache go through the model. Any higher
+# confidence threshold or class subset is a row filter: NMS keeps a box
+# only against higher-scoring boxes, so the boxes above a threshold are
+# the same as from a run at that threshold (up to the max_det cap).
+#
+# Threshold sweeps, PR curves and confusion matrices below work on the
+# matched arrays with one sort + cumsum each.
+#
+#   python pred_cache.py --weights best.pt --images .../test/images --cache-dir pred_cache
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+from matching import box_iou, greedy_match
+
+CONF_FLOOR   = 0.001
+HASH_THREADS = 16
+HASH_CHUNK   = 1 << 20
+
+
+def file_hash(path):
+    """blake2b-128 hex digest of a file's content."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_files(paths, threads=HASH_THREADS):
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        return list(ex.map(file_hash, paths))
+
+
+class PredictionCache:
+    """Cached predictions of one weights file at one set of inference settings."""
+
+    def __init__(self, cache_dir, weights, conf=CONF_FLOOR, iou=0.7, imgsz=640,
+                 max_det=300, half=False, device=None):
+        self.weights = str(weights)
+        self.settings = {"conf": conf, "iou": iou, "imgsz": imgsz, "max_det": max_det, "half": half}
+        settings_hash = hashlib.sha1(json.dumps(self.settings, sort_keys=True).encode()).hexdigest()
+        self.path = Path(cache_dir) / f"{file_hash(weights)[:16]}-{settings_hash[:8]}.npz"
+        self.device = device
+        self._load()
+
+    def _load(self):
+        self._new = {}
+        self._index, self._offset = {}, np.zeros(1, dtype=np.int64)
+        self._xyxy = np.empty((0, 4), dtype=np.float32)
+        self._conf = np.empty(0, dtype=np.float32)
+        self._cls = np.empty(0, dtype=np.int16)
+        if self.path.exists():
+            with np.load(self.path) as z:
+                self._index = {k: i for i, k in enumerate(z["keys"].tolist())}
+                self._offset, self._xyxy, self._conf, self._cls = (z["offset"], z["xyxy"],
+                                                                  z["conf"], z["cls"])
+
+    def __contains__(self, key):
+        return key in self._index or key in self._new
+
+    def __len__(self):
+        return len(self._index) + len(self._new)
+
+    def get(self, key):
+        """(n, 6) x1, y1, x2, y2, conf, cls of one image hash, None on a miss."""
+        if key in self._new:
+            return self._new[key]
+        i = self._index.get(key)
+        if i is None:
+            return None
+        a, b = self._offset[i], self._offset[i + 1]
+        return np.column_stack([self._xyxy[a:b], self._conf[a:b], self._cls[a:b]])
+
+    def put(self, key, pred):
+        self._new[key] = np.asarray(pred, dtype=np.float32).reshape(-1, 6)
+
+    def save(self):
+        if not self._new:
+            return
+        keys = list(self._index) + list(self._new)
+        new = list(self._new.values())
+        counts = np.r_[np.diff(self._offset), [len(p) for p in new]].astype(np.int64)
+        rows = np.concatenate([np.empty((0, 6), dtype=np.float32)] + new)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp.npz")
+        np.savez(tmp, keys=np.array(keys), offset=np.r_[0, np.cumsum(counts)],
+                 xyxy=np.concatenate([self._xyxy, rows[:, :4]]),
+                 conf=np.concatenate([self._conf, rows[:, 4]]),
+                 cls=np.concatenate([self._cls, rows[:, 5].astype(np.int16)]),
+                 weights=self.weights, settings=json.dumps(self.settings))
+        os.replace(tmp, self.path)
+        self._load()
+
+    def predict(self, img_paths, model=None, batch=16, threads=8):
+        """Predictions for every image, running `model` (loaded on demand) on misses only."""
+        keys = hash_files(img_paths)
+        todo = [p for p, k in zip(img_paths, keys) if k not in self]
+        print(f"Prediction cache {self.path.name}: {len(img_paths) - len(todo)} hits, "
+              f"{len(todo)} to predict")
+        if todo:
+            from tqdm import tqdm
+            from batch_eval import iter_batches, predict_batch
+            if model is None:
+                from ultralytics import YOLO
+                model = YOLO(self.weights)
+            args = SimpleNamespace(device=self.device, **self.settings)
+            key_of = dict(zip(img_paths, keys))
+            for paths, imgs in tqdm(iter_batches(todo, batch, threads),
+                                    total=-(-len(todo) // batch), desc="Predict (cache misses)"):
+                ok = [i for i, im in enumerate(imgs) if im is not None]
+                preds = predict_batch(model, [imgs[i] for i in ok], args, None) if ok else []
+                for i, pred in zip(ok, preds):
+                    self.put(key_of[paths[i]], pred)
+            self.save()
+        return [self.get(k) for k in keys]
+
+
+def threshold_sweep(conf, tp, n_gt, thresholds=np.linspace(0, 1, 101)):
+    """Precision and recall at each confidence threshold (keep conf >= t).
+
+    conf (N,) and tp (N,) bool of all matched predictions; sort + cumsum, no loop.
+    """
+    order = np.argsort(-conf, kind="stable")
+    tpc = np.r_[0, np.cumsum(tp[order])]
+    # number of predictions with conf >= t
+    k = len(conf) - np.searchsorted(conf[order][::-1], thresholds, side="left")
+    tp_t, fp_t = tpc[k], k - tpc[k]
+    return tp_t / np.maximum(tp_t + fp_t, 1e-9), tp_t / max(n_gt, 1e-9)
+
+
+def pr_curve(conf, tp, n_gt):
+    """(precision, recall, conf) at every prediction, by descending confidence."""
+    order = np.argsort(-conf, kind="stable")
+    tpc = np.cumsum(tp[order])
+    n = np.arange(1, len(tpc) + 1)
+    return tpc / n, tpc / max(n_gt, 1), conf[order]
+
+
+def match_classes(pred, gt_xyxy, gt_cls, iou=0.5):
+    """Class-agnostic match of one image for confusion matrices.
+
+    Returns (GT class of each prediction's match, -1 for none; confidence of
+    the prediction matching each GT, -1 for none). Greedy by confidence, so
+    restricting to conf >= t later gives the same pairs as matching at t.
+    """
+    n, m = len(pred), len(gt_xyxy)
+    pred_gt_cls = np.full(n, -1, dtype=np.int64)
+    gt_conf = np.full(m, -1, dtype=np.float32)
+    if n and m:
+        matched = greedy_match(box_iou(pred[:, :4].astype(np.float64), gt_xyxy),
+                               pred[:, 4], [iou])[0]
+        hit = matched >= 0
+        pred_gt_cls[hit] = np.asarray(gt_cls)[matched[hit]]
+        gt_conf[matched[hit]] = pred[hit, 4]
+    return pred_gt_cls, gt_conf
+
+
+def confusion_matrix(pred_cls, pred_conf, pred_gt_cls, gt_cls, gt_conf, nc, conf=0.25):
+    """(nc + 1, nc + 1) counts, rows predicted, columns true; index nc = background."""
+    pred_cls, gt_cls = np.asarray(pred_cls, dtype=np.int64), np.asarray(gt_cls, dtype=np.int64)
+    keep = pred_conf >= conf
+    rows = np.r_[pred_cls[keep], np.full(int((gt_conf < conf).sum()), nc)]
+    cols = np.r_[np.where(pred_gt_cls[keep] >= 0, pred_gt_cls[keep], nc), gt_cls[gt_conf < conf]]
+    return np.bincount(rows * (nc + 1) + cols, minlength=(nc + 1) ** 2).reshape(nc + 1, nc + 1)
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Fill the prediction cache for an image set")
+    ap.add_argument("--weights", required=True)
+    ap.add_argument("--images", required=True, type=Path, help="image directory or <split>.txt list")
+    ap.add_argument("--cache-dir", type=Path, default=Path("pred_cache"))
+    ap.add_argument("--conf", type=float, default=CONF_FLOOR)
+    ap.add_argument("--iou", type=float, default=0.7, help="NMS IoU threshold")
+    ap.add_argument("--imgsz", type=int, default=640)
+    ap.add_argument("--max-det", type=int, default=300)
+    ap.add_argument("--batch", type=int, default=16)
+    ap.add_argument("--device", default=None)
+    ap.add_argument("--half", action="store_true")
+    ap.add_argument("--threads", type=int, default=8)
+    return ap.parse_args(argv)
+
+
+if __name__ == "__main__":
+    from batch_eval import list_images
+
+    args = parse_args()
+    cache = PredictionCache(args.cache_dir, args.weights, args.conf, args.iou, args.imgsz,
+                            args.max_det, args.half, args.device)
+    preds = cache.predict(list_images(args.images)[0], batch=args.batch, threads=args.threads)
+    print(f"{sum(p is not None for p in preds)} images, "
+          f"{sum(len(p) for p in preds if p is not None)} boxes in {cache.path}")
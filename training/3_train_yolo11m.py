@@ -1,17 +1,34 @@
 from ultralytics import YOLO
 
+from subset_sampler import SubsetTrainer
+
+# Pre-decoded image shards from image_shards.py (same imgsz); None = decode
+# the JPEGs every epoch (with cache='ram' when training on the whole split)
+SHARDS_ROOT = None  # e.g. '/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/image_shards_640'
+# Fraction of the full train split drawn (class-aware, fresh each epoch) per
+# epoch, see subset_sampler.py; None = every image every epoch. Training
+# reads the full merged train split, validation the fixed quarter val set
+# (see merged_dataset.yaml)
+SUBSET_RATIO = 0.25
+# RAM-caching the full 2.27M-image train split does not fit: only cache
+# without subsetting and without shards
+CACHE = 'ram' if SHARDS_ROOT is None and SUBSET_RATIO is None else False
+
 def train_yolo11():
     model = YOLO('yolo11m.pt')  # Ensure model is available or it'll auto-download
+    SubsetTrainer.shards_root = SHARDS_ROOT
+    SubsetTrainer.subset_ratio = SUBSET_RATIO
     # model.train(data='./merged_dataset.yaml', epochs=20, batch=8, workers = 12)
     model.train(
         data        = './merged_dataset.yaml',
         epochs      = 5,
         batch       = 4,          
         device      = 0,
-        cache       = 'ram',      # cache in memory
+        trainer     = SubsetTrainer,
+        cache       = CACHE,
         workers     = 8,          # more data loaders
         amp         = True,       # mixed precision
-        rect        = True,       # rectangular batches
+        rect        = SUBSET_RATIO is None,  # rectangular batches need the full, fixed order
         mosaic      = 0.0,        # turn off heavy aug
         mixup       = 0.0,
         auto_augment= 'none',
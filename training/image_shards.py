@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# Pre-decoded, pre-resized training images in memory-mapped shard files
+#
+# Offline step: every image of the dataset YAML's train/val sources is
+# decoded once and resized the way Ultralytics' load_image() does (long side
+# = IMGSZ, aspect kept; the letterbox padding is added later by the
+# transforms), and its uint8 pixels are appended to large shard files:
+#
+#   <SHARDS_ROOT>/shard_00000.bin ...   raw HxWx3 BGR pixels, back to back
+#   <SHARDS_ROOT>/index.npz             path, mtime_ns, shard, offset, h, w, h0, w0
+#
+# Training then reads pixels through the page cache (see shard_dataset.py)
+# instead of decoding JPEGs from the HDD every epoch, without cache='ram'.
+# Reruns only pack images that are new or changed since the last run.
+import math
+import os
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import yaml
+from tqdm import tqdm
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "dataset_works" / "labels_mapping_dataset_creation"))
+from conversion_engine import DEFAULT_WORKERS, run_pool  # noqa: E402
+from label_store import IMG_EXTS  # noqa: E402
+
+# === PATHS ===
+DATA_YAML   = Path("./merged_dataset.yaml")
+SHARDS_ROOT = Path("/media/sameerhashmi/ran_epav_disk/Sameer_dataset_from_smb/image_shards_640")
+IMGSZ       = 640            # must match the imgsz used for training
+SHARD_BYTES = 4 << 30        # start a new shard file after ~4 GiB
+WORKERS     = DEFAULT_WORKERS
+CHUNKSIZE   = 64             # images per worker task
+
+INDEX_NAME = "index.npz"
+
+
+def dataset_images(data_yaml: Path, splits=("train", "val")):
+    """Absolute image paths of the YAML's splits (directories or .txt lists)."""
+    cfg = yaml.safe_load(Path(data_yaml).read_text())
+    base = Path(cfg.get("path", Path(data_yaml).parent))
+    paths = []
+    for split in splits:
+        for src in ([cfg[split]] if isinstance(cfg.get(split), str) else cfg.get(split) or []):
+            src = Path(src) if Path(src).is_absolute() else base / src
+            if src.suffix == ".txt":
+                for ln in src.read_text().splitlines():
+                    ln = ln.strip()
+                    if ln:
+                        paths.append(os.path.abspath(ln if os.path.isabs(ln) else src.parent / ln))
+            else:
+                with os.scandir(src) as it:
+                    paths += [os.path.abspath(e.path) for e in it
+                              if os.path.splitext(e.name)[1].lower() in IMG_EXTS]
+    return sorted(set(paths))
+
+
+def load_resized(path, imgsz=IMGSZ):
+    """Decode + resize like Ultralytics load_image(rect_mode=True); None if unreadable."""
+    im = cv2.imread(path)
+    if im is None:
+        return None
+    h0, w0 = im.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz)
+        im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+    return np.ascontiguousarray(im), (h0, w0)
+
+
+class ImageShards:
+    """Read side: image path → (pixels, (h0, w0), (h, w)) like load_image()."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        with np.load(self.root / INDEX_NAME) as z:
+            self.imgsz = int(z["imgsz"])
+            self.paths = z["paths"]
+            self.shard, self.offset = z["shard"], z["offset"]
+            self.hw, self.hw0 = z["hw"], z["hw0"]
+        self._index = {p: i for i, p in enumerate(self.paths.tolist())}
+        self._maps = {}
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, path):
+        return os.path.abspath(path) in self._index
+
+    def __getstate__(self):
+        # dataloader workers open their own memmaps
+        state = self.__dict__.copy()
+        state["_maps"] = {}
+        return state
+
+    def _map(self, s):
+        m = self._maps.get(s)
+        if m is None:
+            m = self._maps[s] = np.memmap(self.root / f"shard_{s:05d}.bin", dtype=np.uint8, mode="r")
+        return m
+
+    def get(self, path):
+        """Writable copy of the packed image, None if it is not in the shards."""
+        i = self._index.get(os.path.abspath(path))
+        if i is None:
+            return None
+        h, w = self.hw[i]
+        a = self.offset[i]
+        im = np.array(self._map(int(self.shard[i]))[a:a + h * w * 3]).reshape(h, w, 3)
+        return im, tuple(self.hw0[i].tolist()), (int(h), int(w))
+
+
+def _pack_one(path):
+    return load_resized(path, IMGSZ)
+
+
+def pack(paths, root: Path = SHARDS_ROOT, imgsz=IMGSZ, workers=WORKERS):
+    """Append new/changed images to the shards and rewrite the index."""
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    mtime = np.array([os.stat(p).st_mtime_ns for p in paths], dtype=np.int64)
+
+    old = {}
+    cols = {"paths": [], "mtime_ns": [], "shard": [], "offset": [], "hw": [], "hw0": []}
+    next_shard = 0
+    if (root / INDEX_NAME).exists():
+        with np.load(root / INDEX_NAME) as z:
+            if int(z["imgsz"]) == imgsz:
+                old = {p: i for i, p in enumerate(z["paths"].tolist())}
+                prev = {k: z[k] for k in cols}
+                next_shard = int(z["shard"].max()) + 1 if len(z["shard"]) else 0
+    todo = []
+    for p, m in zip(paths, mtime):
+        i = old.get(p)
+        if i is not None and prev["mtime_ns"][i] == m:
+            for k in cols:
+                cols[k].append(prev[k][i])
+        else:
+            todo.append((p, m))
+    print(f"{len(paths)} images, {len(paths) - len(todo)} already packed, {len(todo)} to pack")
+
+    shard, f, written, failed = next_shard - 1, None, SHARD_BYTES, []
+    try:
+        results = run_pool(_pack_one, (p for p, _ in todo), workers, chunksize=CHUNKSIZE)
+        for (path, m), (_, res, err) in tqdm(zip(todo, results), total=len(todo),
+                                             desc="Packing images", unit="img"):
+            if err is not None or res is None:
+                failed.append(path)
+                continue
+            im, hw0 = res
+            if written >= SHARD_BYTES:  # roll over to a new shard file
+                if f is not None:
+                    f.close()
+                shard += 1
+                f = open(root / f"shard_{shard:05d}.bin", "wb")
+                written = 0
+            cols["paths"].append(path)
+            cols["mtime_ns"].append(m)
+            cols["shard"].append(shard)
+            cols["offset"].append(written)
+            cols["hw"].append(im.shape[:2])
+            cols["hw0"].append(hw0)
+            f.write(im.tobytes())
+            written += im.nbytes
+    finally:
+        if f is not None:
+            f.close()
+
+    tmp = root / (INDEX_NAME + ".tmp.npz")
+    np.savez(tmp, imgsz=imgsz, paths=np.array(cols["paths"], dtype=str),
+             mtime_ns=np.array(cols["mtime_ns"], dtype=np.int64),
+             shard=np.array(cols["shard"], dtype=np.int32),
+             offset=np.array(cols["offset"], dtype=np.int64),
+             hw=np.array(cols["hw"], dtype=np.int32).reshape(-1, 2),
+             hw0=np.array(cols["hw0"], dtype=np.int32).reshape(-1, 2))
+    os.replace(tmp, root / INDEX_NAME)
+    if failed:
+        print(f"⚠️  {len(failed)} unreadable images not packed, e.g. {failed[0]}")
+    return ImageShards(root)
+
+
+def main():
+    shards = pack(dataset_images(DATA_YAML))
+    live = int(shards.hw.prod(axis=1).sum() * 3)
+    on_disk = sum(p.stat().st_size for p in SHARDS_ROOT.glob("shard_*.bin"))
+    print(f"✅ {len(shards)} images at imgsz {shards.imgsz}: {live / 2**30:.1f} GiB of pixels, "
+          f"{on_disk / 2**30:.1f} GiB in shard files → {SHARDS_ROOT}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Ultralytics dataset/trainer adapter serving images from image_shards.py
+#
+# attach_shards() swaps a YOLODataset's load_image() for a lookup in the
+# memory-mapped shards; images that are not packed (or packed at another
+# imgsz) fall back to the normal decode path. ShardTrainer does this for the
+# train and val datasets it builds:
+#
+#   ShardTrainer.shards_root = SHARDS_ROOT
+#   model.train(trainer=ShardTrainer, cache=False, ...)
+import types
+
+import cv2
+from ultralytics.models.yolo.detect import DetectionTrainer
+
+from image_shards import ImageShards
+
+
+def _load_image(self, i, rect_mode=True):
+    hit = self.shards.get(self.im_files[i]) if self.ims[i] is None else None
+    if hit is None:
+        return self._decode_image(i, rect_mode)
+    im, hw0, hw = hit
+    if not rect_mode and hw != (self.imgsz, self.imgsz):
+        im = cv2.resize(im, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+        hw = im.shape[:2]
+    if self.augment:
+        # keep the mosaic buffer working; pixels stay in the page cache, not in self.ims
+        self.buffer.append(i)
+        if len(self.buffer) >= self.max_buffer_length:
+            self.buffer.pop(0)
+    return im, hw0, hw
+
+
+def attach_shards(dataset, shards):
+    """Serve dataset.load_image() from `shards` (an ImageShards) where possible."""
+    if shards.imgsz != dataset.imgsz:
+        print(f"⚠️  shards are packed at imgsz {shards.imgsz}, training at {dataset.imgsz}: "
+              "decoding images as usual")
+        return dataset
+    dataset.shards = shards
+    dataset._decode_image = dataset.load_image
+    dataset.load_image = types.MethodType(_load_image, dataset)
+    hits = sum(f in shards for f in dataset.im_files)
+    print(f"Image shards: {hits}/{len(dataset.im_files)} images pre-decoded in {shards.root}")
+    return dataset
+
+
+class ShardTrainer(DetectionTrainer):
+    """DetectionTrainer whose datasets read pre-decoded pixels from image shards."""
+
+    shards_root = None
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        dataset = super().build_dataset(img_path, mode, batch)
+        if self.shards_root is not None:
+            if getattr(self, "_shards", None) is None:
+                self._shards = ImageShards(self.shards_root)
+            attach_shards(dataset, self._shards)
+        return dataset
@@ -0,0 +1,131 @@
+# Per-epoch, class-aware subsets of the full training set
+#
+# Instead of training on a fixed copied subset (creating_quarter_dataset.py),
+# EpochSubsetSampler draws a fresh subset of the full merged train split every
+# epoch: subset_ratio of the images, sampled without replacement with
+# probability weighted by the LVIS repeat factor of each image
+#
+#   f_c = fraction of images containing class c
+#   r_c = max(1, sqrt(t / f_c))         t = REPEAT_THRESH
+#   r_i = max(r_c for c in image i)     (1 for background images)
+#
+# so images with rare classes show up in most epochs while the common ones
+# rotate. An epoch costs as much as one on the quarter dataset, the model sees
+# the whole corpus over a run, and nothing is copied. SubsetTrainer wires it
+# into the train dataloader (on top of ShardTrainer):
+#
+#   SubsetTrainer.subset_ratio = 0.25
+#   model.train(trainer=SubsetTrainer, rect=False, ...)
+import os
+
+import numpy as np
+from torch.utils.data import Sampler
+from ultralytics.data.build import PIN_MEMORY, InfiniteDataLoader, seed_worker
+from ultralytics.utils.torch_utils import torch_distributed_zero_first
+
+from shard_dataset import ShardTrainer
+
+REPEAT_THRESH = 0.001  # classes in fewer than this fraction of images get oversampled
+
+
+def repeat_factors(labels, nc, thresh=REPEAT_THRESH):
+    """Per-image repeat factors r_i from YOLODataset.labels (list of dicts with 'cls')."""
+    cls = [np.unique(lb["cls"].astype(np.int64).ravel()) for lb in labels]
+    n_cls = np.array([len(c) for c in cls], dtype=np.int64)
+    img = np.repeat(np.arange(len(cls)), n_cls)
+    cls = np.concatenate(cls) if len(img) else np.zeros(0, dtype=np.int64)
+
+    freq = np.bincount(cls, minlength=nc) / max(len(labels), 1)
+    r_cls = np.maximum(1.0, np.sqrt(thresh / np.maximum(freq, 1e-12)))
+    r_img = np.ones(len(labels))
+    np.maximum.at(r_img, img, r_cls[cls])
+    return r_img
+
+
+def weighted_subset(weights, k, rng):
+    """k indices drawn without replacement ∝ weights (Efraimidis–Spirakis keys)."""
+    keys = np.log(rng.random(len(weights))) / weights  # log(u^(1/w)), larger = earlier
+    if k >= len(weights):
+        return np.argsort(-keys)
+    top = np.argpartition(-keys, k - 1)[:k]
+    return top[np.argsort(-keys[top])]  # random order within the subset
+
+
+class EpochSubsetSampler(Sampler):
+    """Yields the weighted subset of k dataset indices for the current epoch.
+
+    The subset is seeded from (seed, epoch) with the epoch given by
+    set_epoch() (called by the trainer every epoch), so all DDP ranks draw
+    the same subset and take every world_size-th index, and re-iterating an
+    epoch (e.g. a loader reset) repeats its subset.
+    """
+
+    def __init__(self, weights, k, seed=0, rank=-1, world_size=1):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.seed = seed
+        self.rank, self.world_size = max(rank, 0), world_size if rank != -1 else 1
+        k = min(int(k), len(self.weights))
+        self.k = max(k - k % self.world_size, self.world_size)  # equal share per rank
+        self.epoch = 0
+        self.drawn = []  # epoch of every pass drawn so far
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.k // self.world_size
+
+    def __iter__(self):
+        self.drawn.append(self.epoch)
+        rng = np.random.default_rng([self.seed, self.epoch])
+        idx = weighted_subset(self.weights, self.k, rng)
+        return iter(idx[self.rank::self.world_size].tolist())
+
+
+class SubsetTrainer(ShardTrainer):
+    """ShardTrainer whose train loader samples a fresh class-aware subset each epoch."""
+
+    subset_ratio = None  # fraction of the train images per epoch; None = all of them
+    repeat_thresh = REPEAT_THRESH
+
+    def get_dataloader(self, dataset_path, batch_size=16, rank=0, mode="train"):
+        if mode != "train" or self.subset_ratio is None:
+            return super().get_dataloader(dataset_path, batch_size, rank, mode)
+        with torch_distributed_zero_first(rank):
+            dataset = self.build_dataset(dataset_path, mode, batch_size)
+        if dataset.rect:
+            # rect batches are fixed groups of images sorted by aspect ratio
+            raise ValueError("subset sampling needs rect=False for training")
+
+        weights = repeat_factors(dataset.labels, self.data["nc"], self.repeat_thresh)
+        k = round(len(dataset) * self.subset_ratio)
+        world_size = int(os.getenv("WORLD_SIZE", 1))
+        self.subset_sampler = EpochSubsetSampler(weights, k, seed=self.args.seed, rank=rank,
+                                                 world_size=world_size)
+        k = self.subset_sampler.k
+        print(f"Subset sampling: {k}/{len(dataset)} train images per epoch, "
+              f"{int((weights > 1).sum())} images with rare classes oversampled "
+              f"(max repeat factor {weights.max():.1f})")
+        self.add_callback("on_train_epoch_start", _draw_epoch_subset)
+
+        nw = min(os.cpu_count() // max(world_size, 1), self.args.workers)
+        return InfiniteDataLoader(
+            dataset=dataset,
+            batch_size=min(batch_size, k),
+            sampler=self.subset_sampler,
+            num_workers=nw,
+            pin_memory=PIN_MEMORY,
+            collate_fn=getattr(dataset, "collate_fn", None),
+            worker_init_fn=seed_worker,
+        )
+
+
+def _draw_epoch_subset(trainer):
+    # The loader prefetches the next pass before the epoch starts, i.e. with the
+    # previous epoch's seed (and Ultralytics only calls set_epoch under DDP):
+    # set the epoch and restart the loader unless its only pass already is this epoch's.
+    sampler = trainer.subset_sampler
+    current = sampler.drawn == [trainer.epoch]
+    sampler.set_epoch(trainer.epoch)
+    if not current:
+        trainer.train_loader.reset()